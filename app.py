@@ -1,20 +1,183 @@
-from flask import Flask, request, jsonify, send_file
+from flask import (Flask, request, jsonify, send_file, current_app, g, has_app_context, has_request_context,
+                   Response, stream_with_context, url_for)
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timedelta
+from flask_sqlalchemy.session import Session
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.sql.util import find_tables
+from datetime import date, datetime, timedelta
 import base64
+import atexit
+import hashlib
 import io
+import multiprocessing
 import os
-from collections import defaultdict
+from collections import defaultdict, namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as DelaiDepasse
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from itertools import accumulate, chain, groupby, repeat
+from bisect import bisect_left, bisect_right
+import operator
+import re
+import unicodedata
 import statistics
 import json
+import csv
 from dateutil import parser
 from PIL import Image as PILImage
 import uuid
+import threading
+import click
+import random
+import time
+import shutil
+import sqlite3
+import tempfile
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import FormDataParser
+
+try:
+    import numpy as np
+except ImportError:  # Backend d'analyse vectorisé optionnel
+    np = None
+
+try:
+    import orjson
+except ImportError:  # Encodeur JSON des réponses optionnel
+    orjson = None
+
+def uri_base_de_donnees():
+    """URI de la base : DATABASE_URL (PostgreSQL...), sinon le fichier SQLite DATABASE_PATH,
+    sinon allergie_detection.db dans le dossier instance"""
+    url = os.environ.get('DATABASE_URL')
+    if url:
+        return _uri_postgresql(url)
+    chemin = os.environ.get('DATABASE_PATH')
+    if chemin:
+        return f'sqlite:///{os.path.abspath(chemin)}'
+    return 'sqlite:///allergie_detection.db'
+
+def _uri_postgresql(url):
+    return 'postgresql://' + url[len('postgres://'):] if url.startswith('postgres://') else url
+
+def options_moteur(uri):
+    """Options du pool de connexions d'un moteur (base principale ou réplique)"""
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),  # connexions gardées ouvertes par processus
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),  # secondes d'attente d'une connexion libre
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),  # secondes
+        'pool_pre_ping': not uri.startswith('sqlite'),
+    }
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///allergie_detection.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = uri_base_de_donnees()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options_moteur(app.config['SQLALCHEMY_DATABASE_URI'])
+# Réplique en lecture seule (PostgreSQL en streaming, copie SQLite...) servant les routes @lecture_replica
+app.config['DATABASE_REPLICA_URL'] = _uri_postgresql(os.environ.get('DATABASE_REPLICA_URL', ''))
+if app.config['DATABASE_REPLICA_URL']:
+    app.config['SQLALCHEMY_BINDS'] = {
+        'replica': dict(options_moteur(app.config['DATABASE_REPLICA_URL']), url=app.config['DATABASE_REPLICA_URL'])
+    }
+app.config['REPLICA_RETARD_MAX'] = float(os.environ.get('REPLICA_RETARD_MAX', 5))  # secondes, au-delà : base principale
+app.config['REPLICA_FENETRE_COLLANTE'] = float(os.environ.get('REPLICA_FENETRE_COLLANTE', 10))  # secondes après une écriture
+app.config['REPLICA_VERIFICATION_PERIODE'] = float(os.environ.get('REPLICA_VERIFICATION_PERIODE', 1))  # secondes
+app.config['REPLICA_REESSAI'] = float(os.environ.get('REPLICA_REESSAI', 30))  # secondes avant de réessayer une réplique en panne
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_CACHE_SIZE'] = int(os.environ.get('SQLITE_CACHE_SIZE', -20000))  # négatif : en Kio
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))  # octets, 0 = désactivé
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 15000))  # ms d'attente du verrou d'écriture
+app.config['SQLITE_ECRITURE_IMMEDIATE'] = os.environ.get('SQLITE_ECRITURE_IMMEDIATE', '1') == '1'  # BEGIN IMMEDIATE (POST...)
+app.config['SQLITE_CHECKPOINT_PERIODE'] = float(os.environ.get('SQLITE_CHECKPOINT_PERIODE', 60))  # secondes, 0 = désactivé
+app.config['SQLITE_WAL_TAILLE_MAX'] = int(os.environ.get('SQLITE_WAL_TAILLE_MAX', 64 * 1024 * 1024))  # au-delà : TRUNCATE
+app.config['ANALYSE_BACKEND'] = os.environ.get('ANALYSE_BACKEND', 'python')
+app.config['ANALYSE_TACHES_WORKERS'] = int(os.environ.get('ANALYSE_TACHES_WORKERS', 2))  # 0 = exécution immédiate
+app.config['ANALYSE_TACHES_RETENTION'] = int(os.environ.get('ANALYSE_TACHES_RETENTION', 24))  # en heures
+app.config['ANALYSE_TACHES_DELAI_MAX'] = int(os.environ.get('ANALYSE_TACHES_DELAI_MAX', 600))  # secondes, au-delà : tâche abandonnée
+app.config['DASHBOARD_CACHE_TAILLE'] = int(os.environ.get('DASHBOARD_CACHE_TAILLE', 1000))  # entrées
+app.config['DASHBOARD_CACHE_PERIODE'] = int(os.environ.get('DASHBOARD_CACHE_PERIODE', 300))  # en secondes
+app.config['IMAGES_STOCKAGE'] = os.environ.get('IMAGES_STOCKAGE', 'base')  # 'base' ou 'fichiers'
+app.config['IMAGES_DOSSIER'] = os.environ.get('IMAGES_DOSSIER', os.path.join(app.instance_path, 'images'))
+app.config['IMAGES_TAILLE_MAX'] = int(os.environ.get('IMAGES_TAILLE_MAX', 20 * 1024 * 1024))  # octets, upload direct
+app.config['IMAGES_TRAITEMENT_WORKERS'] = int(os.environ.get('IMAGES_TRAITEMENT_WORKERS', 2))  # processus, 0 = dans la requête
+app.config['IMAGES_TRAITEMENT_MAX_EN_COURS'] = int(os.environ.get('IMAGES_TRAITEMENT_MAX_EN_COURS', 8))  # au-delà : 503
+app.config['IMAGES_TRAITEMENT_DELAI'] = float(os.environ.get('IMAGES_TRAITEMENT_DELAI', 30))  # secondes d'attente max
+app.config['IMAGES_TRAITEMENT_DELAI_MAX'] = int(os.environ.get('IMAGES_TRAITEMENT_DELAI_MAX', 600))  # secondes, au-delà : image en erreur
+app.config['IMAGES_VARIANTES_UPLOAD'] = [v for v in os.environ.get('IMAGES_VARIANTES_UPLOAD', '').split(',') if v]  # générées dès l'ajout
+app.config['JSON_BACKEND'] = os.environ.get('JSON_BACKEND', 'json')  # encodeur des réponses : json ou orjson
+app.config['METRIQUES_DOSSIER'] = os.environ.get('METRIQUES_DOSSIER', '')  # partagé par les workers, vide = processus seul
+app.config['METRIQUES_PERIODE'] = float(os.environ.get('METRIQUES_PERIODE', 5))  # secondes entre deux écritures du fichier d'un worker
+app.config['REQUETES_BUDGET'] = int(os.environ.get('REQUETES_BUDGET', 30))  # requêtes SQL par requête HTTP (mode debug)
+app.config['REQUETES_BUDGET_STRICT'] = os.environ.get('REQUETES_BUDGET_STRICT', '0') == '1'  # 500 au lieu d'un avertissement
+if app.config['DASHBOARD_CACHE_PERIODE'] <= 0:
+    raise RuntimeError(f"DASHBOARD_CACHE_PERIODE doit être un nombre de secondes positif (reçu : {app.config['DASHBOARD_CACHE_PERIODE']})")
+
+class SessionRoutee(Session):
+    """Session qui envoie les lectures des routes @lecture_replica à la réplique.
+    
+    Les écritures (flush, INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE) vont toujours à la base principale, et les
+    lectures suivantes de la requête aussi : la requête relit ce qu'elle vient d'écrire. Il en va
+    de même d'une requête contenant du SQL textuel (db.text, index FTS...), dont les tables ne
+    sont pas connues, sauf si elle est marquée sûre par execution_options(lecture_replica=True).
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get('lecture_replica'):
+            if self._flushing or isinstance(clause, UpdateBase) or getattr(clause, '_for_update_arg', None) is not None:
+                g.lecture_replica = False
+            elif clause is not None and not clause.get_execution_options().get('lecture_replica') and any(
+                    isinstance(element, TextClause) for element in visitors.iterate(clause)):
+                g.lecture_replica = False
+            elif not self._tables_lues(mapper, clause) & TABLES_BASE_PRINCIPALE:
+                return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+    
+    @staticmethod
+    def _tables_lues(mapper, clause):
+        tables = {db.inspect(mapper).local_table.name} if mapper is not None else set()
+        if clause is not None:
+            tables.update(table.name for table in find_tables(clause, include_aliases=True, include_joins=True))
+        return tables
+
+db = SQLAlchemy(app, session_options={'class_': SessionRoutee})
+
+class TexteJSON(db.TypeDecorator):
+    """Document JSON lu et écrit en texte par l'application : colonne TEXT sous SQLite,
+    JSONB sous PostgreSQL (interrogeable par containment @> et indexable en GIN)"""
+    impl = db.Text
+    cache_ok = True
+    
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.JSONB())
+        return dialect.type_descriptor(db.Text())
+    
+    def process_bind_param(self, value, dialect):
+        if dialect.name != 'postgresql' or value is None:
+            return value
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value  # Texte qui n'est pas du JSON : conservé comme chaîne JSON
+    
+    def process_result_value(self, value, dialect):
+        if dialect.name != 'postgresql' or value is None:
+            return value
+        return json.dumps(value)
+
+def contient_element(colonne, valeur):
+    """Condition « la liste JSON de la colonne contient valeur » : containment @> (index GIN) sous
+    PostgreSQL, recherche de l'élément entre guillemets dans le texte JSON sous SQLite"""
+    if db.engine.dialect.name == 'postgresql':
+        return colonne.op('@>')(db.literal([valeur], type_=postgresql.JSONB))
+    return colonne.contains(json.dumps(valeur), autoescape=True)
 
 class PlanAlimentaire(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -26,15 +189,23 @@ class PlanAlimentaire(db.Model):
     
     # Relations
     repas_planifies = db.relationship('RepasPlanifie', backref='plan', lazy=True, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        db.Index('ix_plan_alimentaire_utilisateur_semaine', 'utilisateur_id', 'semaine_debut'),
+    )
 
 class RepasPlanifie(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     plan_id = db.Column(db.Integer, db.ForeignKey('plan_alimentaire.id'), nullable=False)
     jour_semaine = db.Column(db.Integer, nullable=False)  # 0=Lundi, 6=Dimanche
     type_repas = db.Column(db.String(50), nullable=False)  # petit_dejeuner, dejeuner, diner, collation
-    aliments_planifies = db.Column(db.Text, nullable=False)  # JSON des aliments
+    aliments_planifies = db.Column(TexteJSON, nullable=False)  # JSON des aliments
     calories_estimees = db.Column(db.Float)
     notes = db.Column(db.Text)
+    
+    __table_args__ = (
+        db.Index('ix_repas_planifie_plan_jour', 'plan_id', 'jour_semaine'),
+    )
 
 class Buffet(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -50,6 +221,10 @@ class Buffet(db.Model):
     
     # Relations
     plats_buffet = db.relationship('PlatBuffet', backref='buffet', lazy=True, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        db.Index('ix_buffet_utilisateur_date', 'utilisateur_id', 'date_evenement'),
+    )
 
 class PlatBuffet(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -58,12 +233,17 @@ class PlatBuffet(db.Model):
     categorie = db.Column(db.String(100))  # entree, plat_principal, dessert, boisson
     quantite_par_personne = db.Column(db.Float)  # en grammes ou unités
     cout_unitaire = db.Column(db.Float)
-    allergenes = db.Column(db.Text)  # JSON des allergènes
-    ingredients = db.Column(db.Text)  # JSON des ingrédients
+    allergenes = db.Column(TexteJSON)  # JSON des allergènes
+    ingredients = db.Column(TexteJSON)  # JSON des ingrédients
     instructions_preparation = db.Column(db.Text)
     temps_preparation = db.Column(db.Integer)  # en minutes
     difficulte = db.Column(db.Integer)  # 1-5
     notes = db.Column(db.Text)
+    
+    __table_args__ = (
+        db.Index('ix_plat_buffet_buffet', 'buffet_id'),
+    )
+
 # Modèles de base de données
 class Utilisateur(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -77,14 +257,17 @@ class Utilisateur(db.Model):
     images = db.relationship('Image', backref='utilisateur', lazy=True, cascade='all, delete-orphan')
     plans_alimentaires = db.relationship('PlanAlimentaire', backref='utilisateur', lazy=True, cascade='all, delete-orphan')
     buffets = db.relationship('Buffet', backref='utilisateur', lazy=True, cascade='all, delete-orphan')
+    expositions = db.relationship('ExpositionAliment', backref='utilisateur', lazy=True, cascade='all, delete-orphan')
+    taches = db.relationship('TacheAsynchrone', backref='utilisateur', lazy=True, cascade='all, delete-orphan')
+    cache_rapport = db.relationship('CacheRapport', backref='utilisateur', lazy=True, cascade='all, delete-orphan')
 
 
 
 class Aliment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nom = db.Column(db.String(100), nullable=False, unique=True)
-    ingredients = db.Column(db.Text)  # JSON string des ingrédients
-    allergenes_courants = db.Column(db.Text)  # JSON string des allergènes
+    ingredients = db.Column(TexteJSON)  # JSON string des ingrédients
+    allergenes_courants = db.Column(TexteJSON)  # JSON string des allergènes
     calories_pour_100g = db.Column(db.Float)
     proteines_pour_100g = db.Column(db.Float)
     glucides_pour_100g = db.Column(db.Float)
@@ -94,15 +277,51 @@ class Aliment(db.Model):
     date_creation = db.Column(db.DateTime, default=datetime.utcnow)
     date_modification = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_aliment_nom_id', 'nom', 'id'),  # Pagination par curseur
+        # Filtres par ingrédient / allergène (containment JSONB), PostgreSQL uniquement
+        db.Index('ix_aliment_ingredients_gin', 'ingredients', postgresql_using='gin',
+                 postgresql_ops={'ingredients': 'jsonb_path_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_aliment_allergenes_gin', 'allergenes_courants', postgresql_using='gin',
+                 postgresql_ops={'allergenes_courants': 'jsonb_path_ops'}).ddl_if(dialect='postgresql'),
+        # Nom contenant un texte (ILIKE '%...%') par trigrammes, PostgreSQL uniquement (extension pg_trgm)
+        db.Index('ix_aliment_nom_trgm', 'nom', postgresql_using='gin',
+                 postgresql_ops={'nom': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
+
+EXTENSION_TRIGRAMMES = db.DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+db.event.listen(Aliment.__table__, 'before_create', EXTENSION_TRIGRAMMES.execute_if(dialect='postgresql'))
+    
 class Repas(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     utilisateur_id = db.Column(db.Integer, db.ForeignKey('utilisateur.id'), nullable=False)
     date_heure = db.Column(db.DateTime, nullable=False)
-    aliments = db.Column(db.Text, nullable=False)  # JSON string des aliments avec quantités
+    aliments = db.Column(TexteJSON, nullable=False)  # JSON string des aliments avec quantités
     description = db.Column(db.Text)
+    cle_client = db.Column(db.String(64))  # Clé d'idempotence de l'ingestion par lot
     
     # Relations
     images = db.relationship('Image', backref='repas', lazy=True, cascade='all, delete-orphan')
+    lignes = db.relationship('RepasAliment', backref='repas', lazy=True, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        db.Index('ix_repas_utilisateur_date_id', 'utilisateur_id', 'date_heure', 'id'),
+        db.Index('uq_repas_utilisateur_cle', 'utilisateur_id', 'cle_client', unique=True),
+    )
+
+class RepasAliment(db.Model):
+    """Aliment d'un repas, forme normalisée du JSON de Repas.aliments"""
+    id = db.Column(db.Integer, primary_key=True)
+    repas_id = db.Column(db.Integer, db.ForeignKey('repas.id'), nullable=False)
+    aliment_id = db.Column(db.Integer, db.ForeignKey('aliment.id'))  # Renseigné si le nom existe au catalogue
+    nom = db.Column(db.String(255), nullable=False)  # Nom tel que saisi dans le repas
+    quantite = db.Column(db.Float)  # en grammes
+    
+    __table_args__ = (
+        db.Index('ix_repas_aliment_aliment_repas', 'aliment_id', 'repas_id'),
+        db.Index('ix_repas_aliment_repas', 'repas_id'),
+        db.Index('ix_repas_aliment_nom', 'nom'),
+    )
     
 class Symptome(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -111,15 +330,23 @@ class Symptome(db.Model):
     type_symptome = db.Column(db.String(100), nullable=False)
     severite = db.Column(db.Integer, nullable=False)  # 1-10
     description = db.Column(db.Text)
+    cle_client = db.Column(db.String(64))  # Clé d'idempotence de l'ingestion par lot
     
     # Relations
     images = db.relationship('Image', backref='symptome', lazy=True, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        db.Index('ix_symptome_utilisateur_date_id', 'utilisateur_id', 'date_heure', 'id'),
+        db.Index('uq_symptome_utilisateur_cle', 'utilisateur_id', 'cle_client', unique=True),
+    )
 
 class Image(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     uuid = db.Column(db.String(36), unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
     nom_fichier = db.Column(db.String(255), nullable=False)
-    donnees_blob = db.Column(db.LargeBinary, nullable=False)  # Stockage en blob
+    donnees_blob = db.deferred(db.Column(db.LargeBinary, nullable=False))  # Stockage en blob (vide si stockée sur disque), chargé à la demande
+    empreinte = db.Column(db.String(64), index=True)  # sha256 du contenu
+    stockage = db.Column(db.String(20), default='base')  # 'base' ou 'fichiers'
     type_mime = db.Column(db.String(50), nullable=False)
     taille = db.Column(db.Integer)  # Taille en bytes
     largeur = db.Column(db.Integer)
@@ -128,6 +355,208 @@ class Image(db.Model):
     utilisateur_id = db.Column(db.Integer, db.ForeignKey('utilisateur.id'))
     repas_id = db.Column(db.Integer, db.ForeignKey('repas.id'))
     symptome_id = db.Column(db.Integer, db.ForeignKey('symptome.id'))
+    statut = db.Column(db.String(20), default='pret')  # 'traitement', 'pret' ou 'erreur'
+    derivees = db.relationship('DeriveeImage', backref='image', lazy=True, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        db.Index('ix_image_utilisateur_date_id', 'utilisateur_id', 'date_creation', 'id'),
+        db.Index('ix_image_repas', 'repas_id'),
+        db.Index('ix_image_symptome', 'symptome_id'),
+    )
+
+class DeriveeImage(db.Model):
+    """Version réduite d'une image (miniature...), générée une fois puis conservée"""
+    id = db.Column(db.Integer, primary_key=True)
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id'), nullable=False)
+    variante = db.Column(db.String(20), nullable=False)  # 'thumb', 'medium'
+    donnees_blob = db.deferred(db.Column(db.LargeBinary, nullable=False))  # Vide si stockée sur disque
+    empreinte = db.Column(db.String(64), index=True)
+    stockage = db.Column(db.String(20), default='base')
+    type_mime = db.Column(db.String(50), nullable=False)
+    taille = db.Column(db.Integer)
+    largeur = db.Column(db.Integer)
+    hauteur = db.Column(db.Integer)
+    date_creation = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('image_id', 'variante', name='uq_derivee_image_variante'),
+    )
+
+# Nombre d'images d'un repas / symptôme, par sous-requête (chargé avec undefer)
+Repas.nb_images = db.column_property(
+    db.select(db.func.count(Image.id)).where(Image.repas_id == Repas.id).correlate_except(Image).scalar_subquery(),
+    deferred=True
+)
+Symptome.nb_images = db.column_property(
+    db.select(db.func.count(Image.id)).where(Image.symptome_id == Symptome.id).correlate_except(Image).scalar_subquery(),
+    deferred=True
+)
+
+# Colonnes servies par les routes de métadonnées, sans les données de l'image
+COLONNES_METADONNEES_IMAGE = (
+    Image.id, Image.uuid, Image.nom_fichier, Image.type_mime, Image.taille, Image.largeur, Image.hauteur,
+    Image.date_creation, Image.utilisateur_id, Image.repas_id, Image.symptome_id, Image.statut
+)
+
+# Sérialisation des réponses
+charger_json = orjson.loads if orjson is not None else json.loads
+
+def date_iso(valeur):
+    return valeur.isoformat() if valeur is not None else None
+
+def liste_json(valeur):
+    """Liste stockée en texte JSON ([] si la colonne est vide)"""
+    return charger_json(valeur) if valeur else []
+
+class Serialiseur:
+    """Dict de réponse d'un modèle ou d'une ligne de projection.
+    
+    Un champ est un nom d'attribut ou un couple (nom, conversion). Les attributs sont lus par un
+    seul attrgetter construit une fois (un itemgetter sur le __dict__ des instances chargées pour
+    les listes, sans passer par les descripteurs de l'ORM), puis seules les valeurs à convertir
+    (dates, texte JSON...) passent par leur fonction.
+    """
+    def __init__(self, *champs):
+        self.champs = tuple(champ if isinstance(champ, tuple) else (champ, None) for champ in champs)
+        self.cles = tuple(nom for nom, _ in self.champs)
+        lire, lire_dict = operator.attrgetter(*self.cles), operator.itemgetter(*self.cles)
+        if len(self.cles) > 1:
+            self._lire, self._lire_dict = lire, lire_dict
+        else:
+            self._lire, self._lire_dict = lambda objet: (lire(objet),), lambda valeurs: (lire_dict(valeurs),)
+        self._conversions = tuple((nom, conversion) for nom, conversion in self.champs if conversion is not None)
+    
+    def __call__(self, objet):
+        donnees = dict(zip(self.cles, self._lire(objet)))
+        for nom, conversion in self._conversions:
+            donnees[nom] = conversion(donnees[nom])
+        return donnees
+    
+    def liste(self, objets):
+        cles, lire, lire_dict = self.cles, self._lire, self._lire_dict
+        objets = objets if isinstance(objets, list) else list(objets)
+        try:
+            resultats = [dict(zip(cles, lire_dict(objet.__dict__))) for objet in objets]
+        except (AttributeError, KeyError):  # Lignes de projection, attributs expirés ou différés
+            resultats = [dict(zip(cles, lire(objet))) for objet in objets]
+        for nom, conversion in self._conversions:
+            for donnees in resultats:
+                donnees[nom] = conversion(donnees[nom])
+        return resultats
+    
+    def avec(self, *champs):
+        """Sérialiseur avec des champs en plus"""
+        return Serialiseur(*self.champs, *champs)
+    
+    def seulement(self, *noms):
+        """Sérialiseur limité à certains champs"""
+        conversions = dict(self.champs)
+        return Serialiseur(*((nom, conversions[nom]) for nom in noms))
+
+SERIALISEUR_UTILISATEUR = Serialiseur('id', 'nom', 'email', ('date_creation', date_iso))
+SERIALISEUR_ALIMENT = Serialiseur(
+    'id', 'nom', ('ingredients', liste_json), ('allergenes_courants', liste_json),
+    'calories_pour_100g', 'proteines_pour_100g', 'glucides_pour_100g', 'lipides_pour_100g', 'fibres_pour_100g',
+    'categorie', ('date_creation', date_iso), ('date_modification', date_iso)
+)
+SERIALISEUR_REPAS = Serialiseur('id', ('date_heure', date_iso), ('aliments', charger_json), 'description')
+SERIALISEUR_SYMPTOME = Serialiseur('id', ('date_heure', date_iso), 'type_symptome', 'severite', 'description')
+SERIALISEUR_IMAGE_METADONNEES = Serialiseur(
+    'id', 'uuid', 'nom_fichier', 'type_mime', 'taille', 'largeur', 'hauteur', ('date_creation', date_iso)
+)
+SERIALISEUR_IMAGE = SERIALISEUR_IMAGE_METADONNEES.avec(
+    'utilisateur_id', 'repas_id', 'symptome_id', ('statut', lambda statut: statut or 'pret')
+)
+SERIALISEUR_UTILISATEUR_RESUME = SERIALISEUR_UTILISATEUR.seulement('id', 'nom', 'email')
+SERIALISEUR_RECHERCHE_ALIMENT = SERIALISEUR_ALIMENT.seulement('id', 'nom', 'categorie', 'ingredients')
+SERIALISEUR_REPAS_LISTE = SERIALISEUR_REPAS.avec('nb_images')
+SERIALISEUR_SYMPTOME_LISTE = SERIALISEUR_SYMPTOME.avec('nb_images')
+SERIALISEUR_IMAGE_UTILISATEUR = SERIALISEUR_IMAGE_METADONNEES.avec('repas_id', 'symptome_id')
+SERIALISEUR_IMAGE_BASE64 = SERIALISEUR_IMAGE_METADONNEES.seulement(
+    'id', 'uuid', 'nom_fichier', 'type_mime', 'taille', 'largeur', 'hauteur'
+)
+SERIALISEUR_REPAS_PLANIFIE = Serialiseur('id', ('aliments', charger_json), 'calories_estimees', 'notes')
+
+class FournisseurJsonOrjson(DefaultJSONProvider):
+    """Encodage des réponses par orjson (JSON_BACKEND=orjson), écrit directement en octets.
+    
+    Clés triées et indentation en debug comme l'encodeur par défaut ; les dates et les types
+    inconnus passent par sa fonction default, les réponses restent donc identiques (aux
+    caractères non ASCII près, écrits en UTF-8 au lieu d'être échappés).
+    """
+    def _options(self, indenter=False):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indenter:
+            options |= orjson.OPT_INDENT_2
+        return options
+    
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode('utf-8')
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indenter = (self.compact is None and self._app.debug) or self.compact is False
+        corps = orjson.dumps(obj, default=self.default, option=self._options(indenter))
+        return self._app.response_class(corps + b'\n', mimetype=self.mimetype)
+
+if app.config['JSON_BACKEND'] == 'orjson':
+    if orjson is None:
+        raise RuntimeError("JSON_BACKEND=orjson nécessite le paquet orjson")
+    app.json = FournisseurJsonOrjson(app)
+elif app.config['JSON_BACKEND'] != 'json':
+    raise RuntimeError(f"JSON_BACKEND inconnu : {app.config['JSON_BACKEND']} (valeurs : json, orjson)")
+
+class ExpositionAliment(db.Model):
+    """Compteurs d'exposition par (utilisateur, aliment), maintenus à chaque repas/symptôme"""
+    id = db.Column(db.Integer, primary_key=True)
+    utilisateur_id = db.Column(db.Integer, db.ForeignKey('utilisateur.id'), nullable=False)
+    aliment = db.Column(db.String(255), nullable=False)
+    nb_repas = db.Column(db.Integer, nullable=False, default=0)  # Repas contenant l'aliment
+    nb_repas_avec_symptome = db.Column(db.Integer, nullable=False, default=0)  # Suivis d'un symptôme (2h-48h)
+    
+    __table_args__ = (
+        db.UniqueConstraint('utilisateur_id', 'aliment', name='uq_exposition_utilisateur_aliment'),
+    )
+
+class CompteurVersion(db.Model):
+    """Compteur incrémenté à chaque écriture, sert à invalider les caches (ex: 'utilisateur:1')"""
+    cle = db.Column(db.String(100), primary_key=True)
+    valeur = db.Column(db.Integer, nullable=False, default=0)
+    date_maj = db.Column(db.DateTime, default=datetime.utcnow)
+
+class MigrationSchema(db.Model):
+    """Migration de schéma appliquée à la base (voir MIGRATIONS)"""
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    date_application = db.Column(db.DateTime, default=datetime.utcnow)
+
+class TacheAsynchrone(db.Model):
+    """File de tâches locale (SQLite) exécutée par le pool de workers du processus"""
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    type_tache = db.Column(db.String(50), nullable=False)  # rapport_analyse
+    utilisateur_id = db.Column(db.Integer, db.ForeignKey('utilisateur.id'))
+    statut = db.Column(db.String(20), nullable=False, default='en_attente')  # en_attente, en_cours, termine, erreur
+    resultat = db.Column(db.Text)  # JSON du résultat
+    erreur = db.Column(db.Text)
+    date_creation = db.Column(db.DateTime, default=datetime.utcnow)
+    date_debut = db.Column(db.DateTime)
+    date_fin = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_tache_utilisateur_statut', 'utilisateur_id', 'statut'),  # Tâche en cours d'un utilisateur
+        db.Index('ix_tache_statut_fin', 'statut', 'date_fin'),  # Purge des tâches terminées
+    )
+
+class CacheRapport(db.Model):
+    """Dernier rapport d'analyse calculé, valide tant que la version de l'utilisateur n'a pas changé"""
+    utilisateur_id = db.Column(db.Integer, db.ForeignKey('utilisateur.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    rapport = db.Column(db.Text, nullable=False)  # JSON du rapport
+    date_calcul = db.Column(db.DateTime, default=datetime.utcnow)
 
 # Classe pour l'analyse des allergies
 class AnalyseurAllergies:
@@ -135,17 +564,235 @@ class AnalyseurAllergies:
         self.fenetre_temporelle_min = 2  # 2 heures
         self.fenetre_temporelle_max = 48  # 48 heures
         self.seuil_alerte = 30  # 30%
+        self.backends = ('python', 'numpy')
+    
+    def niveau_alerte(self, score):
+        """Niveau d'alerte associé à un score de risque"""
+        return 'ÉLEVÉ' if score >= self.seuil_alerte else 'MODÉRÉ' if score >= 15 else 'FAIBLE'
+    
+    def _noms_aliments(self, aliments_json):
+        """Extrait les noms d'aliments d'un repas à partir de son JSON"""
+        try:
+            return [nom for nom, _ in extraire_lignes_aliments(json.loads(aliments_json))]
+        except:
+            return []
+    
+    def _repas_avec_noms(self, query):
+        """Regroupe des lignes (repas_id, date_heure, nom) triées par repas en [(date_heure, noms)]"""
+        return [
+            (date_heure, [nom for _, _, nom in lignes])
+            for (_, date_heure), lignes in groupby(query, key=lambda ligne: (ligne[0], ligne[1]))
+        ]
+    
+    def _charger_historique(self, utilisateur_id):
+        """Charge une seule fois les repas et symptômes d'un utilisateur, triés par date_heure"""
+        repas = self._repas_avec_noms(
+            db.session.query(Repas.id, Repas.date_heure, RepasAliment.nom).join(
+                RepasAliment, RepasAliment.repas_id == Repas.id
+            ).filter(
+                Repas.utilisateur_id == utilisateur_id
+            ).order_by(Repas.date_heure, Repas.id)
+        )
+        dates_symptomes = [
+            date_heure for (date_heure,) in db.session.query(Symptome.date_heure).filter(
+                Symptome.utilisateur_id == utilisateur_id
+            ).order_by(Symptome.date_heure)
+        ]
+        return repas, dates_symptomes
+    
+    def _marquer_reactions(self, dates_repas, dates_symptomes):
+        """Balayage unique : indique pour chaque repas (trié) si un symptôme tombe dans la fenêtre 2h-48h"""
+        delai_min = timedelta(hours=self.fenetre_temporelle_min)
+        delai_max = timedelta(hours=self.fenetre_temporelle_max)
+        nb_symptomes = len(dates_symptomes)
+        reactions = []
+        j = 0
+        for date_repas in dates_repas:
+            # Les repas étant triés, le début de fenêtre ne fait qu'avancer
+            debut = date_repas + delai_min
+            while j < nb_symptomes and dates_symptomes[j] < debut:
+                j += 1
+            reactions.append(j < nb_symptomes and dates_symptomes[j] <= date_repas + delai_max)
+        return reactions
+    
+    def _backend(self, backend=None):
+        """Backend de calcul : paramètre d'appel, sinon ANALYSE_BACKEND ('python' ou 'numpy')"""
+        backend = backend or current_app.config.get('ANALYSE_BACKEND', 'python')
+        if backend not in self.backends:
+            raise ValueError(f"Backend d'analyse inconnu: {backend} (valeurs: {', '.join(self.backends)})")
+        if backend == 'numpy' and np is None:
+            raise ValueError("Le backend numpy nécessite le paquet numpy")
+        return backend
+    
+    def _compter_expositions(self, repas, dates_symptomes, aliments=None, backend=None):
+        """Compte, pour chaque aliment, les repas le contenant et ceux suivis d'un symptôme.
+        
+        Un repas contient un aliment si l'un de ses noms contient le nom recherché
+        (insensible à la casse). Retourne {aliment: (nb_repas, nb_repas_avec_symptome)}.
+        """
+        if self._backend(backend) == 'numpy':
+            return self._compter_expositions_numpy(repas, dates_symptomes, aliments)
+        return self._compter_expositions_python(repas, dates_symptomes, aliments)
+    
+    @staticmethod
+    def _microsecondes(dates):
+        """Convertit des datetimes naïfs en tableau int64 de microsecondes depuis 1970"""
+        ecarts = map(operator.sub, dates, repeat(datetime(1970, 1, 1)))
+        return np.fromiter(
+            map(operator.floordiv, ecarts, repeat(timedelta(microseconds=1))), dtype=np.int64, count=len(dates)
+        )
+    
+    def _compter_expositions_python(self, repas, dates_symptomes, aliments=None):
+        """Implémentation de référence en Python pur"""
+        reactions = self._marquer_reactions([date_heure for date_heure, _ in repas], dates_symptomes)
+        
+        # Index nom (minuscules) -> indices des repas qui le contiennent
+        repas_par_nom = defaultdict(set)
+        for i, (_, noms) in enumerate(repas):
+            for nom in noms:
+                repas_par_nom[nom.lower()].add(i)
+        
+        if aliments is None:
+            aliments = {nom for _, noms in repas for nom in noms}
+        
+        comptes_par_cle = {}
+        resultats = {}
+        for aliment in aliments:
+            if not aliment:  # Éviter les chaînes vides
+                continue
+            cle = aliment.lower()
+            if cle not in comptes_par_cle:
+                indices = set()
+                for nom, indices_nom in repas_par_nom.items():
+                    if cle in nom:
+                        indices |= indices_nom
+                comptes_par_cle[cle] = (len(indices), sum(1 for i in indices if reactions[i]))
+            if comptes_par_cle[cle][0]:
+                resultats[aliment] = comptes_par_cle[cle]
+        return resultats
+    
+    def _compter_expositions_numpy(self, repas, dates_symptomes, aliments=None):
+        """Implémentation vectorisée pour les longs historiques.
+        
+        Les dates sont des tableaux int64 triés (microsecondes) : la fenêtre de chaque
+        repas s'obtient par searchsorted. Les comptes par aliment sont le produit de
+        l'incidence creuse repas x aliment (format COO) par le vecteur des réactions.
+        """
+        # Conversions en colonnes par itération native (map) plutôt qu'en boucle Python
+        listes_noms = list(map(operator.itemgetter(1), repas))
+        noms_plats = list(chain.from_iterable(listes_noms))
+        if aliments is None:
+            aliments = set(noms_plats)
+        aliments = [aliment for aliment in aliments if aliment]
+        if not noms_plats or not aliments:
+            return {}
+        
+        # Fenêtres 2h-48h : nombre de symptômes entre les deux bornes de chaque repas
+        dates_repas = self._microsecondes(list(map(operator.itemgetter(0), repas)))
+        symptomes = self._microsecondes(dates_symptomes)
+        delai_min = timedelta(hours=self.fenetre_temporelle_min) // timedelta(microseconds=1)
+        delai_max = timedelta(hours=self.fenetre_temporelle_max) // timedelta(microseconds=1)
+        reactions = (
+            np.searchsorted(symptomes, dates_repas + delai_max, side='right')
+            > np.searchsorted(symptomes, dates_repas + delai_min, side='left')
+        )
+        
+        # Incidence repas x nom (minuscules)
+        noms_min = list(map(str.lower, noms_plats))
+        indices_noms = {nom: j for j, nom in enumerate(dict.fromkeys(noms_min))}
+        lignes_noms = np.fromiter(map(indices_noms.__getitem__, noms_min), dtype=np.int64, count=len(noms_min))
+        lignes_repas = np.repeat(
+            np.arange(len(repas)), np.fromiter(map(len, listes_noms), dtype=np.int64, count=len(repas))
+        )
+        
+        # Incidence nom x aliment : un aliment couvre tous les noms qui le contiennent
+        # (recherche des occurrences dans les noms concaténés, un séparateur évitant
+        # qu'une occurrence chevauche deux noms)
+        cles = sorted({aliment.lower() for aliment in aliments})
+        texte_noms = '\x00'.join(indices_noms)
+        debuts_noms = list(accumulate((len(nom) + 1 for nom in indices_noms), initial=0))
+        paires_cles = []
+        paires_noms = []
+        for k, cle in enumerate(cles):
+            position = texte_noms.find(cle)
+            while position >= 0:
+                j = bisect_right(debuts_noms, position) - 1
+                paires_cles.append(k)
+                paires_noms.append(j)
+                # Reprendre au nom suivant : un nom ne compte qu'une fois par aliment
+                position = texte_noms.find(cle, debuts_noms[j + 1])
+        nb_repas = np.zeros(len(cles), dtype=np.int64)
+        nb_reactions = np.zeros(len(cles), dtype=np.int64)
+        
+        if paires_cles:
+            paires_cles = np.array(paires_cles, dtype=np.int64)
+            paires_noms = np.array(paires_noms, dtype=np.int64)
+            
+            # Repas regroupés par nom (CSR) puis développés pour chaque paire (aliment, nom)
+            ordre = np.argsort(lignes_noms, kind='stable')
+            repas_par_nom = lignes_repas[ordre]
+            nb_par_nom = np.bincount(lignes_noms, minlength=len(indices_noms))
+            debuts = np.cumsum(nb_par_nom) - nb_par_nom
+            longueurs = nb_par_nom[paires_noms]
+            decalages = np.arange(longueurs.sum()) - np.repeat(np.cumsum(longueurs) - longueurs, longueurs)
+            repas_developpes = repas_par_nom[np.repeat(debuts[paires_noms], longueurs) + decalages]
+            cles_developpees = np.repeat(paires_cles, longueurs)
+            
+            # Un repas ne compte qu'une fois par aliment
+            nb_total_repas = len(repas)
+            incidence = np.sort(cles_developpees * nb_total_repas + repas_developpes)
+            incidence = incidence[np.concatenate(([True], incidence[1:] != incidence[:-1]))]
+            cles_incidence = incidence // nb_total_repas
+            repas_incidence = incidence % nb_total_repas
+            nb_repas = np.bincount(cles_incidence, minlength=len(cles))
+            nb_reactions = np.bincount(cles_incidence[reactions[repas_incidence]], minlength=len(cles))
+        
+        comptes_par_cle = dict(zip(cles, zip(nb_repas.tolist(), nb_reactions.tolist())))
+        return {
+            aliment: comptes_par_cle[aliment.lower()]
+            for aliment in aliments if comptes_par_cle[aliment.lower()][0]
+        }
+    
+    def _score(self, nb_repas, nb_reactions):
+        """Pourcentage de repas suivis d'un symptôme"""
+        if not nb_repas:
+            return 0
+        return round((nb_reactions / nb_repas) * 100, 2)
     
-    def calculer_score_risque(self, utilisateur_id, aliment_nom):
+    def calculer_score_risque(self, utilisateur_id, aliment_nom, backend=None):
         """Calcule le score de risque pour un aliment donné"""
-        # Récupérer tous les repas contenant cet aliment
+        repas, dates_symptomes = self._charger_historique(utilisateur_id)
+        expositions = self._compter_expositions(repas, dates_symptomes, [aliment_nom], backend)
+        return self._score(*expositions.get(aliment_nom, (0, 0)))
+    
+    def detecter_patterns(self, utilisateur_id, backend=None):
+        """Détecte les patterns d'allergies pour un utilisateur (un seul passage sur l'historique)"""
+        repas, dates_symptomes = self._charger_historique(utilisateur_id)
+        
+        resultats = []
+        for aliment, (nb_repas, nb_reactions) in self._compter_expositions(
+            repas, dates_symptomes, backend=backend
+        ).items():
+            score = self._score(nb_repas, nb_reactions)
+            if score > 0:
+                resultats.append({
+                    'aliment': aliment,
+                    'score_risque': score,
+                    'niveau_alerte': self.niveau_alerte(score)
+                })
+        
+        # Trier par score décroissant
+        resultats.sort(key=lambda x: x['score_risque'], reverse=True)
+        return resultats
+    
+    def _calculer_score_risque_naif(self, utilisateur_id, aliment_nom):
+        """Ancien calcul (une requête Symptome par repas), conservé pour comparer les deux moteurs"""
         repas_avec_aliment = []
         repas_utilisateur = Repas.query.filter_by(utilisateur_id=utilisateur_id).all()
         
         for repas in repas_utilisateur:
             try:
                 aliments_repas = json.loads(repas.aliments)
-                # Vérifier si l'aliment est présent (format: [{"nom": "aliment", "quantite": 100}])
                 if isinstance(aliments_repas, list):
                     if any(aliment_nom.lower() in aliment.get('nom', '').lower() for aliment in aliments_repas):
                         repas_avec_aliment.append(repas)
@@ -158,9 +805,7 @@ class AnalyseurAllergies:
         if not repas_avec_aliment:
             return 0
         
-        # Compter les symptômes après consommation
         symptomes_apres_consommation = 0
-        
         for repas in repas_avec_aliment:
             symptomes = Symptome.query.filter_by(utilisateur_id=utilisateur_id).filter(
                 Symptome.date_heure >= repas.date_heure + timedelta(hours=self.fenetre_temporelle_min),
@@ -170,45 +815,218 @@ class AnalyseurAllergies:
             if symptomes:
                 symptomes_apres_consommation += 1
         
-        # Calculer le score
         score = (symptomes_apres_consommation / len(repas_avec_aliment)) * 100
         return round(score, 2)
     
-    def detecter_patterns(self, utilisateur_id):
-        """Détecte les patterns d'allergies pour un utilisateur"""
-        # Récupérer tous les aliments consommés
+    def _detecter_patterns_naif(self, utilisateur_id):
+        """Ancienne détection (un calcul complet par aliment), conservée pour comparer les deux moteurs"""
         aliments_uniques = set()
-        repas_utilisateur = Repas.query.filter_by(utilisateur_id=utilisateur_id).all()
+        for repas in Repas.query.filter_by(utilisateur_id=utilisateur_id).all():
+            aliments_uniques.update(self._noms_aliments(repas.aliments))
         
-        for repas in repas_utilisateur:
-            try:
-                aliments_repas = json.loads(repas.aliments)
-                if isinstance(aliments_repas, list):
-                    aliments_uniques.update([aliment.get('nom', '') for aliment in aliments_repas])
-                elif isinstance(aliments_repas, dict):
-                    aliments_uniques.update(aliments_repas.keys())
-            except:
-                continue
-        
-        # Calculer les scores pour chaque aliment
         resultats = []
         for aliment in aliments_uniques:
-            if aliment:  # Éviter les chaînes vides
-                score = self.calculer_score_risque(utilisateur_id, aliment)
+            if aliment:
+                score = self._calculer_score_risque_naif(utilisateur_id, aliment)
                 if score > 0:
                     resultats.append({
                         'aliment': aliment,
                         'score_risque': score,
-                        'niveau_alerte': 'ÉLEVÉ' if score >= self.seuil_alerte else 'MODÉRÉ' if score >= 15 else 'FAIBLE'
+                        'niveau_alerte': self.niveau_alerte(score)
                     })
         
-        # Trier par score décroissant
+        resultats.sort(key=lambda x: x['score_risque'], reverse=True)
+        return resultats
+    
+    # ----- Table d'exposition maintenue incrémentalement -----
+    
+    def reconstruire_expositions(self, utilisateur_id, backend=None):
+        """Recalcule entièrement la table d'exposition d'un utilisateur (sans commit)"""
+        self._verrouiller_expositions(utilisateur_id)
+        ExpositionAliment.query.filter_by(utilisateur_id=utilisateur_id).delete(synchronize_session=False)
+        repas, dates_symptomes = self._charger_historique(utilisateur_id)
+        lignes = [
+            {'utilisateur_id': utilisateur_id, 'aliment': aliment,
+             'nb_repas': nb_repas, 'nb_repas_avec_symptome': nb_reactions}
+            for aliment, (nb_repas, nb_reactions) in self._compter_expositions(
+                repas, dates_symptomes, backend=backend
+            ).items()
+        ]
+        if lignes:
+            # Une reconstruction concurrente pour le même utilisateur écrit les mêmes valeurs
+            db.session.execute(inserer_ou_mettre_a_jour(
+                ExpositionAliment.__table__, ['utilisateur_id', 'aliment'], ['nb_repas', 'nb_repas_avec_symptome']
+            ), lignes)
+    
+    def _expositions_a_reconstruire(self, utilisateur_id, aliments_connus):
+        """Table vide alors que l'utilisateur a déjà des repas : le suivi incrémental perdrait l'historique"""
+        return not aliments_connus and db.session.query(Repas.id).filter(
+            Repas.utilisateur_id == utilisateur_id
+        ).first() is not None
+    
+    def verifier_expositions(self, utilisateur_id):
+        """Compare la table d'exposition à un recalcul complet, retourne les écarts"""
+        enregistre = {
+            e.aliment: (e.nb_repas, e.nb_repas_avec_symptome)
+            for e in ExpositionAliment.query.filter_by(utilisateur_id=utilisateur_id)
+        }
+        repas, dates_symptomes = self._charger_historique(utilisateur_id)
+        attendu = self._compter_expositions(repas, dates_symptomes)
+        return {
+            aliment: {'enregistre': enregistre.get(aliment), 'attendu': attendu.get(aliment)}
+            for aliment in set(enregistre) | set(attendu)
+            if enregistre.get(aliment) != attendu.get(aliment)
+        }
+    
+    def _symptome_dans_fenetre(self, utilisateur_id, date_repas, exclure_id=None):
+        """Vérifie qu'au moins un symptôme suit le repas dans la fenêtre 2h-48h"""
+        query = db.session.query(Symptome.id).filter(
+            Symptome.utilisateur_id == utilisateur_id,
+            Symptome.date_heure >= date_repas + timedelta(hours=self.fenetre_temporelle_min),
+            Symptome.date_heure <= date_repas + timedelta(hours=self.fenetre_temporelle_max)
+        )
+        if exclure_id is not None:
+            query = query.filter(Symptome.id != exclure_id)
+        return query.first() is not None
+    
+    def _verrouiller_expositions(self, utilisateur_id):
+        """Sérialise jusqu'au commit les mises à jour d'exposition d'un utilisateur.
+        
+        Sous PostgreSQL (READ COMMITTED), un repas et un symptôme enregistrés en même temps
+        ne se verraient pas l'un l'autre et la réaction ne serait comptée par aucun des deux :
+        la ligne de l'utilisateur est verrouillée (FOR UPDATE) avant toute lecture. SQLite
+        n'a qu'un écrivain à la fois (FOR UPDATE y est ignoré).
+        """
+        db.session.query(Utilisateur.id).filter(Utilisateur.id == utilisateur_id).with_for_update().first()
+    
+    def _aliments_concernes(self, aliments_connus, noms):
+        """Aliments connus dont le nom est contenu dans l'un des noms du repas"""
+        noms_min = [nom.lower() for nom in noms]
+        return [aliment for aliment in aliments_connus if any(aliment.lower() in nom for nom in noms_min)]
+    
+    def enregistrer_repas(self, repas):
+        """Met à jour la table d'exposition après l'ajout d'un repas (avant le commit)"""
+        self._verrouiller_expositions(repas.utilisateur_id)
+        db.session.flush()
+        noms = {ligne.nom for ligne in repas.lignes}
+        if not noms:
+            return
+        
+        aliments_connus = {aliment for (aliment,) in db.session.query(ExpositionAliment.aliment).filter(
+            ExpositionAliment.utilisateur_id == repas.utilisateur_id
+        )}
+        if self._expositions_a_reconstruire(repas.utilisateur_id, aliments_connus):
+            # Le recalcul complet inclut le repas courant, déjà envoyé par le flush
+            self.reconstruire_expositions(repas.utilisateur_id)
+            return
+        
+        reaction = 1 if self._symptome_dans_fenetre(repas.utilisateur_id, repas.date_heure) else 0
+        
+        # Aliments déjà suivis : un repas de plus, avec ou sans réaction
+        concernes = self._aliments_concernes(aliments_connus, noms)
+        if concernes:
+            ExpositionAliment.query.filter(
+                ExpositionAliment.utilisateur_id == repas.utilisateur_id,
+                ExpositionAliment.aliment.in_(concernes)
+            ).update({
+                ExpositionAliment.nb_repas: ExpositionAliment.nb_repas + 1,
+                ExpositionAliment.nb_repas_avec_symptome: ExpositionAliment.nb_repas_avec_symptome + reaction
+            }, synchronize_session=False)
+        
+        # Nouveaux aliments : calcul initial sur l'historique (repas courant inclus)
+        nouveaux = noms - aliments_connus
+        if nouveaux:
+            historique, dates_symptomes = self._charger_historique(repas.utilisateur_id)
+            lignes = [
+                {'utilisateur_id': repas.utilisateur_id, 'aliment': aliment,
+                 'nb_repas': nb_repas, 'nb_repas_avec_symptome': nb_reactions}
+                for aliment, (nb_repas, nb_reactions) in self._compter_expositions(
+                    historique, dates_symptomes, nouveaux
+                ).items()
+            ]
+            if lignes:
+                # Ligne créée entre-temps par un repas concurrent du même utilisateur : elle ne
+                # compte pas encore ce repas, on l'ajoute comme pour un aliment déjà suivi
+                table = ExpositionAliment.__table__
+                db.session.execute(insertion_dialecte(table).on_conflict_do_update(
+                    index_elements=['utilisateur_id', 'aliment'],
+                    set_={
+                        'nb_repas': table.c.nb_repas + 1,
+                        'nb_repas_avec_symptome': table.c.nb_repas_avec_symptome + reaction
+                    }
+                ), lignes)
+    
+    def enregistrer_symptome(self, symptome):
+        """Met à jour la table d'exposition après l'ajout d'un symptôme (avant le commit)"""
+        self._verrouiller_expositions(symptome.utilisateur_id)
+        db.session.flush()
+        # Seuls les repas des 2h-48h précédentes peuvent changer d'état
+        repas_fenetre = self._repas_avec_noms(
+            db.session.query(Repas.id, Repas.date_heure, RepasAliment.nom).join(
+                RepasAliment, RepasAliment.repas_id == Repas.id
+            ).filter(
+                Repas.utilisateur_id == symptome.utilisateur_id,
+                Repas.date_heure >= symptome.date_heure - timedelta(hours=self.fenetre_temporelle_max),
+                Repas.date_heure <= symptome.date_heure - timedelta(hours=self.fenetre_temporelle_min)
+            ).order_by(Repas.id)
+        )
+        if not repas_fenetre:
+            return
+        
+        aliments_connus = {aliment for (aliment,) in db.session.query(ExpositionAliment.aliment).filter(
+            ExpositionAliment.utilisateur_id == symptome.utilisateur_id
+        )}
+        if self._expositions_a_reconstruire(symptome.utilisateur_id, aliments_connus):
+            self.reconstruire_expositions(symptome.utilisateur_id)
+            return
+        
+        nouvelles_reactions = defaultdict(int)
+        for date_repas, noms in repas_fenetre:
+            # Repas déjà compté comme suivi d'un symptôme : rien ne change
+            if self._symptome_dans_fenetre(symptome.utilisateur_id, date_repas, exclure_id=symptome.id):
+                continue
+            for aliment in self._aliments_concernes(aliments_connus, set(noms)):
+                nouvelles_reactions[aliment] += 1
+        
+        for aliment, increment in nouvelles_reactions.items():
+            ExpositionAliment.query.filter_by(
+                utilisateur_id=symptome.utilisateur_id,
+                aliment=aliment
+            ).update({
+                ExpositionAliment.nb_repas_avec_symptome: ExpositionAliment.nb_repas_avec_symptome + increment
+            }, synchronize_session=False)
+    
+    def patterns_enregistres(self, utilisateur_id):
+        """Patterns lus depuis la table d'exposition (équivalent à detecter_patterns)"""
+        expositions = ExpositionAliment.query.filter(
+            ExpositionAliment.utilisateur_id == utilisateur_id
+        ).order_by(ExpositionAliment.aliment).all()
+        
+        # Table vidée depuis la migration 5 : reconstruction à la première lecture
+        if self._expositions_a_reconstruire(utilisateur_id, expositions):
+            self.reconstruire_expositions(utilisateur_id)
+            db.session.commit()
+            expositions = ExpositionAliment.query.filter(
+                ExpositionAliment.utilisateur_id == utilisateur_id
+            ).order_by(ExpositionAliment.aliment).all()
+        
+        resultats = []
+        for exposition in expositions:
+            if exposition.nb_repas_avec_symptome > 0:
+                score = self._score(exposition.nb_repas, exposition.nb_repas_avec_symptome)
+                resultats.append({
+                    'aliment': exposition.aliment,
+                    'score_risque': score,
+                    'niveau_alerte': self.niveau_alerte(score)
+                })
+        
         resultats.sort(key=lambda x: x['score_risque'], reverse=True)
         return resultats
     
     def generer_rapport(self, utilisateur_id):
         """Génère un rapport complet d'analyse"""
-        patterns = self.detecter_patterns(utilisateur_id)
+        debut = time.perf_counter()
+        patterns = self.patterns_enregistres(utilisateur_id)
         
         # Statistiques générales
         total_repas = Repas.query.filter_by(utilisateur_id=utilisateur_id).count()
@@ -227,7 +1045,7 @@ class AnalyseurAllergies:
             recommandations.append("Aucun aliment suspect détecté avec un niveau de risque élevé")
             recommandations.append("Continuez à surveiller vos réactions alimentaires")
         
-        return {
+        rapport = {
             'statistiques': {
                 'total_repas': total_repas,
                 'total_symptomes': total_symptomes,
@@ -237,40 +1055,1988 @@ class AnalyseurAllergies:
             'recommandations': recommandations,
             'date_rapport': datetime.utcnow().isoformat()
         }
+        metriques.observer('analyse_rapport_duree_secondes', time.perf_counter() - debut)
+        return rapport
 
 # Initialisation de l'analyseur
 analyseur = AnalyseurAllergies()
 
+if app.config['ANALYSE_BACKEND'] not in analyseur.backends:
+    raise RuntimeError(f"ANALYSE_BACKEND inconnu : {app.config['ANALYSE_BACKEND']} (valeurs : {', '.join(analyseur.backends)})")
+if app.config['ANALYSE_BACKEND'] == 'numpy' and np is None:
+    raise RuntimeError("ANALYSE_BACKEND=numpy nécessite le paquet numpy")
+
+# Versions et cache des rapports
+def cle_version_utilisateur(utilisateur_id):
+    return f'utilisateur:{utilisateur_id}'
+
+def lire_version(cle):
+    """Valeur courante d'un compteur de version (0 s'il n'existe pas)"""
+    valeur = db.session.query(CompteurVersion.valeur).filter(CompteurVersion.cle == cle).scalar()
+    return valeur or 0
+
+def incrementer_version(cle):
+    """Incrémente un compteur de version dans la transaction courante"""
+    maintenant = datetime.utcnow()
+    table = CompteurVersion.__table__
+    # Un seul upsert : deux premières écritures concurrentes sur la même clé ne se gênent pas
+    db.session.execute(insertion_dialecte(table).values(cle=cle, valeur=1, date_maj=maintenant).on_conflict_do_update(
+        index_elements=['cle'],
+        set_={'valeur': table.c.valeur + 1, 'date_maj': maintenant}
+    ))
+
+def obtenir_rapport_analyse(utilisateur_id):
+    """Rapport d'analyse depuis le cache, recalculé si l'utilisateur a écrit depuis"""
+    version = lire_version(cle_version_utilisateur(utilisateur_id))
+    cache = db.session.get(CacheRapport, utilisateur_id)
+    if cache and cache.version == version:
+        return json.loads(cache.rapport)
+    
+    rapport = analyseur.generer_rapport(utilisateur_id)
+    # La version lue avant le calcul protège d'une écriture concurrente
+    db.session.merge(CacheRapport(
+        utilisateur_id=utilisateur_id,
+        version=version,
+        rapport=json.dumps(rapport),
+        date_calcul=datetime.utcnow()
+    ))
+    db.session.commit()
+    return rapport
+
+# Index en mémoire des nutriments du catalogue
+CLE_VERSION_CATALOGUE = 'catalogue'
+
+NutrimentsAliment = namedtuple('NutrimentsAliment', ['calories', 'proteines', 'glucides', 'lipides', 'fibres'])
+
+class CatalogueNutriments:
+    """Nutriments du catalogue (pour 100g) indexés par id et par nom, partagés par le processus.
+    
+    L'index est rechargé quand le compteur de version 'catalogue' a changé (écriture
+    d'un autre worker) et mis à jour sur place pour les écritures du processus.
+    """
+    def __init__(self):
+        self.version = None
+        self.par_id = {}
+        self.par_nom = {}
+        self._verrou = threading.Lock()
+    
+    @staticmethod
+    def _nutriments(aliment):
+        return NutrimentsAliment(
+            aliment.calories_pour_100g,
+            aliment.proteines_pour_100g,
+            aliment.glucides_pour_100g,
+            aliment.lipides_pour_100g,
+            aliment.fibres_pour_100g
+        )
+    
+    def actualiser(self):
+        """Recharge l'index si le catalogue a changé depuis le dernier chargement"""
+        version = lire_version(CLE_VERSION_CATALOGUE)
+        if version != self.version:
+            with self._verrou:
+                if version != self.version:
+                    par_id = {}
+                    par_nom = {}
+                    for aliment in db.session.query(
+                        Aliment.id,
+                        Aliment.nom,
+                        Aliment.calories_pour_100g,
+                        Aliment.proteines_pour_100g,
+                        Aliment.glucides_pour_100g,
+                        Aliment.lipides_pour_100g,
+                        Aliment.fibres_pour_100g
+                    ):
+                        par_id[aliment.id] = par_nom[aliment.nom] = self._nutriments(aliment)
+                    self.par_id, self.par_nom, self.version = par_id, par_nom, version
+        return self
+    
+    def appliquer(self, version, aliment, ancien_nom=None, supprime=False):
+        """Reporte une écriture validée du processus sans tout recharger"""
+        with self._verrou:
+            # Une autre écriture s'est intercalée : rechargement complet au prochain accès
+            if self.version != version - 1:
+                return
+            self.par_nom.pop(ancien_nom or aliment.nom, None)
+            if supprime:
+                self.par_id.pop(aliment.id, None)
+            else:
+                self.par_id[aliment.id] = self.par_nom[aliment.nom] = self._nutriments(aliment)
+            self.version = version
+
+catalogue_nutriments = CatalogueNutriments()
+
+def incrementer_version_catalogue():
+    """Signale une modification du catalogue aux autres workers, retourne la nouvelle version"""
+    incrementer_version(CLE_VERSION_CATALOGUE)
+    return lire_version(CLE_VERSION_CATALOGUE)
+
+# Métriques (format texte Prometheus)
+BUCKETS_DUREE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # secondes
+BUCKETS_TAILLE = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)  # octets
+
+# nom -> (type, aide, buckets des histogrammes)
+DEFINITIONS_METRIQUES = OrderedDict([
+    ('http_requetes_total', ('counter', 'Requêtes HTTP traitées', None)),
+    ('http_erreurs_total', ('counter', 'Réponses HTTP en erreur (client : 4xx, serveur : 5xx)', None)),
+    ('http_requete_duree_secondes', ('histogram', 'Durée des requêtes HTTP, flux de réponse compris', BUCKETS_DUREE)),
+    ('http_reponse_taille_octets', ('histogram', 'Taille du corps des réponses HTTP', BUCKETS_TAILLE)),
+    ('sql_requetes_total', ('counter', 'Requêtes SQL exécutées pendant les requêtes HTTP', None)),
+    ('sql_duree_secondes_total', ('counter', 'Temps passé dans la base pendant les requêtes HTTP', None)),
+    ('analyse_rapport_duree_secondes', ('histogram', "Durée de génération d'un rapport d'analyse",
+                                        (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))),
+    ('image_traitement_duree_secondes', ('histogram', "Durée des étapes du traitement d'une image", BUCKETS_DUREE)),
+])
+
+class Metriques:
+    """Compteurs et histogrammes du processus, exposés sur /metrics au format texte Prometheus.
+    
+    Avec METRIQUES_DOSSIER, chaque worker écrit ses valeurs dans metriques-<pid>.json toutes les
+    METRIQUES_PERIODE secondes (et à sa sortie) ; /metrics additionne les fichiers de tous les
+    workers. Ceux des workers arrêtés sont gardés : les compteurs ne reculent pas quand gunicorn
+    recycle un worker. Le dossier est vidé par le maître au démarrage.
+    """
+    def __init__(self):
+        self._verrou = threading.Lock()
+        self._thread = None
+        self._pid = os.getpid()
+        self._version = self._version_ecrite = 0
+        self.compteurs = defaultdict(float)  # (nom, labels) -> valeur
+        self.histogrammes = {}  # (nom, labels) -> [comptes par bucket (+Inf en dernier), somme]
+    
+    def incrementer(self, nom, valeur=1, **labels):
+        with self._verrou:
+            self.compteurs[(nom, tuple(sorted(labels.items())))] += valeur
+            self._version += 1
+    
+    def observer(self, nom, valeur, **labels):
+        buckets = DEFINITIONS_METRIQUES[nom][2]
+        cle = (nom, tuple(sorted(labels.items())))
+        with self._verrou:
+            histogramme = self.histogrammes.get(cle)
+            if histogramme is None:
+                histogramme = self.histogrammes[cle] = [[0] * (len(buckets) + 1), 0.0]
+            histogramme[0][bisect_left(buckets, valeur)] += 1
+            histogramme[1] += valeur
+            self._version += 1
+    
+    def _etat(self):
+        with self._verrou:
+            return {
+                'compteurs': [[nom, labels, valeur] for (nom, labels), valeur in self.compteurs.items()],
+                'histogrammes': [[nom, labels, list(comptes), somme]
+                                 for (nom, labels), (comptes, somme) in self.histogrammes.items()]
+            }, self._version
+    
+    def ecrire(self, dossier):
+        """Écrit l'état du processus dans son fichier du dossier partagé (s'il a changé)"""
+        etat, version = self._etat()
+        if version == self._version_ecrite:
+            return
+        chemin = os.path.join(dossier, f'metriques-{os.getpid()}.json')
+        with open(f'{chemin}.tmp', 'w') as fichier:
+            json.dump(etat, fichier)
+        os.replace(f'{chemin}.tmp', chemin)
+        self._version_ecrite = version
+    
+    @staticmethod
+    def vider(dossier):
+        """Supprime les fichiers des workers d'un démarrage précédent (maître gunicorn)"""
+        if not dossier or not os.path.isdir(dossier):
+            return
+        for nom_fichier in os.listdir(dossier):
+            if nom_fichier.startswith('metriques-'):
+                os.remove(os.path.join(dossier, nom_fichier))
+    
+    def demarrer(self, application):
+        """Démarre l'écriture périodique du fichier du worker (un thread par processus)"""
+        dossier = application.config['METRIQUES_DOSSIER']
+        if not dossier:
+            return
+        with self._verrou:
+            if self._pid != os.getpid():  # Valeurs héritées du maître par fork
+                self._pid = os.getpid()
+                self.compteurs.clear()
+                self.histogrammes.clear()
+                self._version = self._version_ecrite = 0
+            if self._thread is not None and self._thread.is_alive():
+                return
+            os.makedirs(dossier, exist_ok=True)
+            self._thread = threading.Thread(
+                target=self._boucle, args=(application, dossier), name='metriques', daemon=True
+            )
+            self._thread.start()
+        atexit.register(self.ecrire, dossier)
+    
+    def _boucle(self, application, dossier):
+        while True:
+            time.sleep(application.config['METRIQUES_PERIODE'])
+            try:
+                self.ecrire(dossier)
+            except OSError:
+                application.logger.exception('Échec de l\'écriture des métriques')
+    
+    def etats(self, dossier=None):
+        """États à additionner : les fichiers de tous les workers, ou le processus seul"""
+        if not dossier:
+            return [self._etat()[0]]
+        self.ecrire(dossier)
+        etats = []
+        for nom_fichier in sorted(os.listdir(dossier)):
+            if nom_fichier.startswith('metriques-') and nom_fichier.endswith('.json'):
+                try:
+                    with open(os.path.join(dossier, nom_fichier)) as fichier:
+                        etats.append(json.load(fichier))
+                except (OSError, ValueError):
+                    continue  # Fichier remplacé ou supprimé pendant la lecture
+        return etats
+    
+    def exposition(self, dossier=None):
+        """Valeurs additionnées de tous les processus, au format texte Prometheus 0.0.4"""
+        compteurs = defaultdict(float)
+        histogrammes = {}
+        for etat in self.etats(dossier):
+            for nom, labels, valeur in etat['compteurs']:
+                compteurs[(nom, tuple(map(tuple, labels)))] += valeur
+            for nom, labels, comptes, somme in etat['histogrammes']:
+                total = histogrammes.setdefault((nom, tuple(map(tuple, labels))), [[0] * len(comptes), 0.0])
+                total[0] = [a + b for a, b in zip(total[0], comptes)]
+                total[1] += somme
+        
+        lignes = []
+        for nom, (type_metrique, aide, buckets) in DEFINITIONS_METRIQUES.items():
+            lignes.append(f'# HELP {nom} {aide}')
+            lignes.append(f'# TYPE {nom} {type_metrique}')
+            if type_metrique == 'counter':
+                for (nom_serie, labels), valeur in sorted(compteurs.items()):
+                    if nom_serie == nom:
+                        lignes.append(f'{nom}{_labels_prometheus(labels)} {_nombre_prometheus(valeur)}')
+                continue
+            for (nom_serie, labels), (comptes, somme) in sorted(histogrammes.items()):
+                if nom_serie != nom:
+                    continue
+                for borne, cumul in zip(chain(buckets, ['+Inf']), accumulate(comptes)):
+                    le = borne if borne == '+Inf' else _nombre_prometheus(borne)
+                    lignes.append(f'{nom}_bucket{_labels_prometheus(labels + (("le", le),))} {cumul}')
+                lignes.append(f'{nom}_sum{_labels_prometheus(labels)} {_nombre_prometheus(somme)}')
+                lignes.append(f'{nom}_count{_labels_prometheus(labels)} {sum(comptes)}')
+        return '\n'.join(lignes) + '\n'
+
+def _labels_prometheus(labels):
+    if not labels:
+        return ''
+    echapper = lambda valeur: str(valeur).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{cle}="{echapper(valeur)}"' for cle, valeur in labels) + '}'
+
+def _nombre_prometheus(valeur):
+    return repr(float(valeur)) if isinstance(valeur, float) and not valeur.is_integer() else str(int(valeur))
+
+metriques = Metriques()
+
+@app.before_request
+def debuter_mesure_requete():
+    g.debut_requete = time.perf_counter()
+
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def debuter_mesure_sql(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.debut_mesure_sql = time.perf_counter()
+
+@db.event.listens_for(Engine, 'after_cursor_execute')
+def terminer_mesure_sql(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context():
+        g.duree_sql = g.get('duree_sql', 0.0) + time.perf_counter() - context.debut_mesure_sql
+
+@app.after_request
+def mesurer_reponse(reponse):
+    """Note le statut et la taille de la réponse ; celle d'un flux est comptée pendant son envoi"""
+    mesure = g.mesure_reponse = [reponse.status_code, reponse.content_length]
+    if mesure[1] is None and reponse.is_streamed:
+        def compter_octets(morceaux):
+            mesure[1] = 0
+            for morceau in morceaux:
+                mesure[1] += len(morceau)
+                yield morceau
+        reponse.response = compter_octets(reponse.response)
+    return reponse
+
+@app.teardown_request
+def enregistrer_mesure_requete(erreur=None):
+    """Enregistre les métriques de la requête à sa fin (après l'envoi d'une réponse en flux)"""
+    debut = g.pop('debut_requete', None)
+    if debut is None:
+        return
+    statut, taille = g.get('mesure_reponse') or (500, None)
+    labels = {'endpoint': request.endpoint or 'aucun', 'methode': request.method}
+    metriques.incrementer('http_requetes_total', statut=str(statut), **labels)
+    if statut >= 400:
+        metriques.incrementer('http_erreurs_total', type='serveur' if statut >= 500 else 'client', **labels)
+    metriques.observer('http_requete_duree_secondes', time.perf_counter() - debut, **labels)
+    if taille is not None:
+        metriques.observer('http_reponse_taille_octets', taille, **labels)
+    metriques.incrementer('sql_requetes_total', g.get('nb_requetes_sql', 0), endpoint=labels['endpoint'])
+    metriques.incrementer('sql_duree_secondes_total', g.get('duree_sql', 0.0), endpoint=labels['endpoint'])
+
+@app.route('/metrics', methods=['GET'])
+def exposer_metriques():
+    """Métriques de tous les workers au format texte Prometheus"""
+    return current_app.response_class(
+        metriques.exposition(current_app.config['METRIQUES_DOSSIER']),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+# Routage des lectures vers la réplique
+TABLES_BASE_PRINCIPALE = {'cache_rapport', 'tache_asynchrone', 'migration_schema'}  # jamais lues sur la réplique
+
+def lecture_replica(vue=None, *, catalogue=False):
+    """Marque une route en lecture seule : ses requêtes SQL peuvent être servies par la réplique.
+    
+    La réplique doit être à jour pour l'utilisateur de la route (paramètre utilisateur_id) et,
+    avec catalogue=True, pour le catalogue d'aliments.
+    """
+    def marquer(fonction):
+        fonction.lecture_replica = {'catalogue': catalogue}
+        return fonction
+    return marquer(vue) if vue is not None else marquer
+
+class RoutageLecture:
+    """Choix, pour chaque requête d'une route @lecture_replica, entre la réplique et la base principale.
+    
+    La base principale est choisie quand la réplique est injoignable (pendant REPLICA_REESSAI
+    secondes), quand son retard dépasse REPLICA_RETARD_MAX, pendant REPLICA_FENETRE_COLLANTE
+    secondes après une écriture de l'utilisateur, ou quand ses compteurs de version diffèrent
+    de ceux de la base principale. Le retard est l'âge de la plus ancienne écriture de la base
+    principale (date_maj des compteurs de version) que la réplique n'a pas encore reçue.
+    """
+    def __init__(self):
+        self._verrou = threading.Lock()
+        self.retard = None
+        self.indisponible_jusqua = 0
+        self.prochaine_verification = 0
+        self.lectures = defaultdict(int)
+    
+    def marquer_indisponible(self, erreur):
+        with self._verrou:
+            self.indisponible_jusqua = time.monotonic() + current_app.config['REPLICA_REESSAI']
+            self.retard = None
+        current_app.logger.warning('Réplique indisponible, lectures sur la base principale : %s', erreur)
+    
+    def verifier(self):
+        """Mesure le retard de la réplique, au plus une fois par REPLICA_VERIFICATION_PERIODE"""
+        maintenant = time.monotonic()
+        with self._verrou:
+            if maintenant < max(self.prochaine_verification, self.indisponible_jusqua):
+                return
+            self.prochaine_verification = maintenant + current_app.config['REPLICA_VERIFICATION_PERIODE']
+        try:
+            with db.engines['replica'].connect() as connexion:
+                derniere = connexion.execute(db.select(db.func.max(CompteurVersion.date_maj))).scalar()
+        except OperationalError as e:
+            self.marquer_indisponible(e)
+            return
+        requete = db.select(db.func.min(CompteurVersion.date_maj))
+        if derniere is not None:
+            requete = requete.where(CompteurVersion.date_maj > derniere)
+        with db.engine.connect() as connexion:
+            plus_ancienne_absente = connexion.execute(requete).scalar()
+        with self._verrou:
+            self.retard = max((datetime.utcnow() - plus_ancienne_absente).total_seconds(), 0) if plus_ancienne_absente else 0
+    
+    def choisir(self, cles, cle_utilisateur=None):
+        """Retourne 'replica' ou la raison de lire la base principale
+        ('indisponible', 'retard', 'collant', 'version')"""
+        config = current_app.config
+        self.verifier()
+        if time.monotonic() < self.indisponible_jusqua:
+            return 'indisponible'
+        if self.retard is None or self.retard > config['REPLICA_RETARD_MAX']:
+            return 'retard'
+        if not cles:
+            return 'replica'
+        
+        # Connexion rendue au pool aussitôt : la session de la requête n'en garde pas une pendant la vue
+        with db.engine.connect() as connexion:
+            principale = {
+                ligne.cle: ligne for ligne in connexion.execute(
+                    db.select(CompteurVersion.cle, CompteurVersion.valeur, CompteurVersion.date_maj)
+                    .where(CompteurVersion.cle.in_(cles))
+                )
+            }
+        ecriture = principale.get(cle_utilisateur)
+        if ecriture is not None and ecriture.date_maj is not None and (
+                datetime.utcnow() - ecriture.date_maj).total_seconds() < config['REPLICA_FENETRE_COLLANTE']:
+            return 'collant'
+        try:
+            with db.engines['replica'].connect() as connexion:
+                replique = dict(connexion.execute(
+                    db.select(CompteurVersion.cle, CompteurVersion.valeur).where(CompteurVersion.cle.in_(cles))
+                ).all())
+        except OperationalError as e:
+            self.marquer_indisponible(e)
+            return 'indisponible'
+        if any(replique.get(cle) != ligne.valeur for cle, ligne in principale.items()):
+            return 'version'
+        return 'replica'
+    
+    def compter(self, base):
+        with self._verrou:
+            self.lectures[base] += 1
+    
+    def statistiques(self):
+        with self._verrou:
+            return {
+                'configuree': bool(current_app.config['DATABASE_REPLICA_URL']),
+                'disponible': time.monotonic() >= self.indisponible_jusqua,
+                'retard_secondes': self.retard,
+                'lectures': dict(self.lectures)
+            }
+
+routage_lecture = RoutageLecture()
+
+@app.before_request
+def router_lecture():
+    """Lit sur la réplique pendant une requête d'une route @lecture_replica quand elle est à jour"""
+    options = getattr(current_app.view_functions.get(request.endpoint), 'lecture_replica', None)
+    if options is None or 'replica' not in db.engines:
+        return
+    utilisateur_id = (request.view_args or {}).get('utilisateur_id')
+    cle_utilisateur = cle_version_utilisateur(utilisateur_id) if utilisateur_id is not None else None
+    cles = [cle for cle in (cle_utilisateur, CLE_VERSION_CATALOGUE if options['catalogue'] else None) if cle]
+    g.base_lecture = routage_lecture.choisir(cles, cle_utilisateur)
+    g.lecture_replica = g.base_lecture == 'replica'
+    routage_lecture.compter(g.base_lecture)
+
+@db.event.listens_for(Engine, 'handle_error')
+def signaler_erreur_replica(contexte):
+    """Marque les erreurs levées par une connexion à la réplique (voir rejouer_sur_base_principale)"""
+    if (has_app_context() and contexte.sqlalchemy_exception is not None
+            and 'replica' in db.engines and contexte.engine is db.engines['replica']):
+        contexte.sqlalchemy_exception.erreur_replica = True
+
+@app.errorhandler(OperationalError)
+def rejouer_sur_base_principale(erreur):
+    """Réplique tombée pendant une requête : la route, en lecture seule, est rejouée sur la base principale"""
+    if not g.get('lecture_replica') or not getattr(erreur, 'erreur_replica', False):
+        raise erreur
+    routage_lecture.marquer_indisponible(erreur)
+    db.session.rollback()
+    g.lecture_replica = False
+    g.base_lecture = 'indisponible'
+    return current_app.ensure_sync(current_app.view_functions[request.endpoint])(**request.view_args)
+
+@app.after_request
+def indiquer_base_lecture(reponse):
+    """En debug, indique la base qui a servi une route @lecture_replica (replica ou raison du repli)"""
+    if (current_app.debug or current_app.testing) and g.get('base_lecture'):
+        reponse.headers['X-Base-Lecture'] = g.base_lecture
+    return reponse
+
+# Index de recherche plein texte du catalogue (SQLite FTS5)
+LIGATURES = {'œ': 'oe', 'Œ': 'OE', 'æ': 'ae', 'Æ': 'AE', 'ß': 'ss'}
+
+class _TableNormalisation(dict):
+    """Table pour str.translate remplie à la demande : caractère -> forme sans accents ni ligatures"""
+    def __missing__(self, code):
+        caractere = chr(code)
+        forme = LIGATURES.get(caractere)
+        if forme is None:
+            forme = ''.join(c for c in unicodedata.normalize('NFKD', caractere) if not unicodedata.combining(c))
+        self[code] = forme
+        return forme
+
+_table_normalisation = _TableNormalisation()
+
+def normaliser_texte(texte):
+    """Minuscules sans accents ni ligatures : « Bœuf haché » -> « boeuf hache »"""
+    return (texte or '').translate(_table_normalisation).lower()
+
+_index_recherche_present = set()  # Moteurs sur lesquels la table FTS a été trouvée
+
+def index_recherche_disponible():
+    """La base possède-t-elle la table FTS5 aliment_recherche ?"""
+    cle = str(db.engine.url)
+    if cle not in _index_recherche_present:
+        if db.engine.dialect.name != 'sqlite' or not db.inspect(db.engine).has_table('aliment_recherche'):
+            return False
+        _index_recherche_present.add(cle)
+    return True
+
+def creer_index_recherche(reconstruire=False):
+    """Crée la table FTS5 et la (re)remplit depuis le catalogue si nécessaire ; False hors SQLite/FTS5"""
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    try:
+        # unicode61 + texte normalisé en Python (ligatures) ; index de préfixes pour la saisie partielle
+        db.session.execute(db.text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS aliment_recherche USING fts5("
+            "nom, ingredients, allergenes, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        ))
+    except Exception:
+        db.session.rollback()
+        return False
+    nb_indexes = db.session.execute(db.text('SELECT count(*) FROM aliment_recherche')).scalar()
+    if reconstruire or nb_indexes != db.session.query(db.func.count(Aliment.id)).scalar():
+        db.session.execute(db.text('DELETE FROM aliment_recherche'))
+        for aliment in Aliment.query.yield_per(1000):
+            indexer_aliment(aliment, verifier=False)
+    db.session.commit()
+    return True
+
+# Suggestions de noms d'aliments (saisie semi-automatique), en mémoire
+class IndexSuggestions:
+    """Noms du catalogue normalisés, triés pour une recherche par préfixe en O(log n + k).
+    
+    Deux tableaux triés : les noms complets, et les alias (le nom à partir de chacun de
+    ses mots suivants, pour que « hache » propose « Bœuf haché »). Même cycle de vie que
+    CatalogueNutriments : rechargé quand la version du catalogue change, mis à jour pour
+    les écritures du processus. Les tableaux publiés ne sont jamais modifiés : une écriture
+    travaille sur des copies puis remplace la paire (clés, entrées) en une affectation, ce
+    qui laisse suggerer lire sans verrou.
+    """
+    def __init__(self):
+        self.version = None
+        self._verifie = 0.0
+        self._noms = ([], [])  # (clés normalisées triées, (id, nom) correspondants)
+        self._alias = ([], [])
+        self._verrou = threading.Lock()
+    
+    _debut_mot = re.compile(r'(?<=[\W_])\w')
+    
+    @classmethod
+    def _cles(cls, nom):
+        """Clé du nom complet puis clés d'alias (à partir de chaque mot suivant)"""
+        cle = normaliser_texte(nom).strip()
+        return cle, [cle[m.start():] for m in cls._debut_mot.finditer(cle)]
+    
+    @staticmethod
+    def _inserer(tableau, cle, entree):
+        cles, entrees = tableau
+        position = bisect_right(cles, cle)
+        cles.insert(position, cle)
+        entrees.insert(position, entree)
+    
+    @staticmethod
+    def _retirer(tableau, cle, identifiant):
+        cles, entrees = tableau
+        position = bisect_left(cles, cle)
+        while position < len(cles) and cles[position] == cle:
+            if entrees[position][0] == identifiant:
+                del cles[position], entrees[position]
+                return
+            position += 1
+    
+    def construire(self, aliments):
+        """Remplace l'index par les (id, nom) fournis"""
+        noms, alias = [], []
+        for identifiant, nom in aliments:
+            cle, cles_alias = self._cles(nom)
+            noms.append((cle, (identifiant, nom)))
+            alias.extend((cle_alias, (identifiant, nom)) for cle_alias in cles_alias)
+        noms.sort()
+        alias.sort()
+        self._noms = ([cle for cle, _ in noms], [entree for _, entree in noms])
+        self._alias = ([cle for cle, _ in alias], [entree for _, entree in alias])
+    
+    def actualiser(self, delai=1.0):
+        """Recharge l'index si le catalogue a changé (version relue au plus toutes les `delai` secondes)"""
+        if time.monotonic() - self._verifie < delai:
+            return self
+        version = lire_version(CLE_VERSION_CATALOGUE)
+        if version != self.version:
+            with self._verrou:
+                if version != self.version:
+                    self.construire(db.session.query(Aliment.id, Aliment.nom))
+                    self.version = version
+        self._verifie = time.monotonic()
+        return self
+    
+    def appliquer(self, version, aliment, ancien_nom=None, supprime=False):
+        """Reporte une écriture validée du processus sans tout recharger"""
+        with self._verrou:
+            if self.version != version - 1:
+                self._verifie = 0.0  # Écriture intercalée : rechargement au prochain accès
+                return
+            noms = tuple(list(tableau) for tableau in self._noms)
+            alias = tuple(list(tableau) for tableau in self._alias)
+            cle, cles_alias = self._cles(ancien_nom or aliment.nom)
+            self._retirer(noms, cle, aliment.id)
+            for cle_alias in cles_alias:
+                self._retirer(alias, cle_alias, aliment.id)
+            if not supprime:
+                cle, cles_alias = self._cles(aliment.nom)
+                self._inserer(noms, cle, (aliment.id, aliment.nom))
+                for cle_alias in cles_alias:
+                    self._inserer(alias, cle_alias, (aliment.id, aliment.nom))
+            self._noms, self._alias = noms, alias
+            self.version = version
+    
+    def suggerer(self, prefixe, limite=10):
+        """Jusqu'à `limite` (id, nom) : d'abord les noms qui commencent par le préfixe, puis les alias"""
+        prefixe = normaliser_texte(prefixe).strip()
+        resultats = []
+        vus = set()
+        if not prefixe:
+            return resultats
+        for cles, entrees in (self._noms, self._alias):
+            position = bisect_left(cles, prefixe)
+            while position < len(cles) and len(resultats) < limite and cles[position].startswith(prefixe):
+                entree = entrees[position]
+                if entree[0] not in vus:
+                    vus.add(entree[0])
+                    resultats.append(entree)
+                position += 1
+        return resultats
+    
+    def __len__(self):
+        return len(self._noms[0])
+
+index_suggestions = IndexSuggestions()
+
+def _liste_json_texte(valeur):
+    try:
+        elements = json.loads(valeur) if valeur else []
+    except ValueError:
+        return valeur
+    return ' '.join(str(element) for element in elements) if isinstance(elements, list) else str(elements)
+
+def indexer_aliment(aliment, verifier=True):
+    """Met à jour l'entrée de l'aliment dans l'index (dans la transaction courante)"""
+    indexer_aliments([aliment], verifier)
+
+def indexer_aliments(aliments, verifier=True):
+    """Met à jour les entrées d'un lot d'aliments (id, nom, ingredients, allergenes_courants) en deux requêtes"""
+    if not aliments or (verifier and not index_recherche_disponible()):
+        return
+    db.session.execute(db.text('DELETE FROM aliment_recherche WHERE rowid = :id'),
+                       [{'id': aliment.id} for aliment in aliments])
+    db.session.execute(db.text(
+        'INSERT INTO aliment_recherche (rowid, nom, ingredients, allergenes) '
+        'VALUES (:id, :nom, :ingredients, :allergenes)'
+    ), [{
+        'id': aliment.id,
+        'nom': normaliser_texte(aliment.nom),
+        'ingredients': normaliser_texte(_liste_json_texte(aliment.ingredients)),
+        'allergenes': normaliser_texte(_liste_json_texte(aliment.allergenes_courants))
+    } for aliment in aliments])
+
+def desindexer_aliment(aliment_id):
+    if index_recherche_disponible():
+        db.session.execute(db.text('DELETE FROM aliment_recherche WHERE rowid = :id'), {'id': aliment_id})
+
+def requete_recherche(terme, colonne=None):
+    """Expression MATCH FTS5 : chaque mot du terme, normalisé, en préfixe (tous requis) ; None si aucun mot"""
+    mots = re.findall(r'\w+', normaliser_texte(terme))
+    if not mots:
+        return None
+    expression = ' '.join(f'"{mot}"*' for mot in mots)
+    return f'{colonne} : ({expression})' if colonne else expression
+
+def ids_recherche(requete):
+    """Sous-requête des ids d'aliments correspondant à une expression MATCH, utilisable dans un IN"""
+    return db.text(
+        'SELECT rowid FROM aliment_recherche WHERE aliment_recherche MATCH :requete'
+    ).bindparams(requete=requete).columns(db.column('rowid', db.Integer))
+
+def rechercher_ids_aliments(terme, limite=None):
+    """Ids des aliments correspondant au terme, du plus pertinent au moins pertinent (bm25,
+    le nom pesant plus que les ingrédients puis les allergènes) ; None sans index FTS"""
+    if not index_recherche_disponible():
+        return None
+    requete = requete_recherche(terme)
+    if not requete:
+        return []
+    sql = ('SELECT rowid FROM aliment_recherche WHERE aliment_recherche MATCH :requete '
+           'ORDER BY bm25(aliment_recherche, 10.0, 3.0, 1.0)')
+    parametres = {'requete': requete}
+    if limite is not None:
+        sql += ' LIMIT :limite'
+        parametres['limite'] = limite
+    return [identifiant for (identifiant,) in db.session.execute(db.text(sql), parametres)]
+
+def requete_recherche_aliments(terme):
+    """Recherche sans index plein texte (PostgreSQL, SQLite sans FTS5) : nom contenant le terme,
+    ou ingrédient / allergène égal au terme.
+    
+    Une branche par condition, réunies par UNION : sous PostgreSQL chacune est servie par son
+    index (trigrammes pour le nom, GIN pour les listes JSONB), ce qu'un OR empêcherait.
+    """
+    ids = db.union(
+        db.select(Aliment.id).where(Aliment.nom.icontains(terme, autoescape=True)),
+        db.select(Aliment.id).where(contient_element(Aliment.ingredients, terme)),
+        db.select(Aliment.id).where(contient_element(Aliment.allergenes_courants, terme)),
+    )
+    return Aliment.query.filter(Aliment.id.in_(ids)).order_by(Aliment.nom, Aliment.id)
+
+# Cache des réponses du dashboard
+class CacheReponses:
+    """Cache LRU borné de réponses sérialisées, avec compteurs de succès et d'échecs"""
+    def __init__(self):
+        self._entrees = OrderedDict()
+        self._verrou = threading.Lock()
+        self.succes = 0
+        self.echecs = 0
+        self.evictions = 0
+    
+    def obtenir(self, cle):
+        with self._verrou:
+            corps = self._entrees.get(cle)
+            if corps is None:
+                self.echecs += 1
+            else:
+                self.succes += 1
+                self._entrees.move_to_end(cle)
+            return corps
+    
+    def enregistrer(self, cle, corps, taille_max):
+        with self._verrou:
+            self._entrees[cle] = corps
+            self._entrees.move_to_end(cle)
+            while len(self._entrees) > taille_max:
+                self._entrees.popitem(last=False)
+                self.evictions += 1
+    
+    def statistiques(self):
+        with self._verrou:
+            total = self.succes + self.echecs
+            return {
+                'entrees': len(self._entrees),
+                'succes': self.succes,
+                'echecs': self.echecs,
+                'evictions': self.evictions,
+                'taux_succes': round(self.succes / total, 3) if total else 0
+            }
+
+cache_dashboard = CacheReponses()
+
+def avec_total():
+    """Le client demande-t-il le total (?total=true) ? Le compter coûte un COUNT(*)"""
+    return request.args.get('total', 'false').lower() == 'true'
+
+def encoder_curseur(cle, identifiant):
+    if isinstance(cle, datetime):
+        cle = cle.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([cle, identifiant]).encode()).decode().rstrip('=')
+
+def decoder_curseur(curseur, colonne_cle):
+    try:
+        cle, identifiant = json.loads(base64.urlsafe_b64decode(curseur + '=' * (-len(curseur) % 4)))
+        if isinstance(colonne_cle.type, db.DateTime):
+            cle = datetime.fromisoformat(cle)
+        return cle, int(identifiant)
+    except Exception:
+        raise ValueError('Curseur invalide')
+
+def paginer_par_curseur(query, colonne_cle, colonne_id, decroissant=True):
+    """Page de `query` ordonnée sur (colonne_cle, colonne_id) qui suit le curseur ?cursor=.
+    
+    Pas d'OFFSET ni de COUNT(*) (total seulement avec ?total=true) : le coût d'une page ne
+    dépend pas de sa profondeur. Retourne (éléments, pagination avec next_cursor).
+    """
+    per_page = request.args.get('per_page', 20, type=int)
+    if per_page < 1:
+        raise ValueError('per_page doit être un entier positif')
+    total = query.order_by(None).with_entities(db.func.count(colonne_id)).scalar() if avec_total() else None
+    
+    curseur = request.args.get('cursor')
+    if curseur:
+        position = decoder_curseur(curseur, colonne_cle)
+        cle = db.tuple_(colonne_cle, colonne_id)
+        query = query.filter(cle < position if decroissant else cle > position)
+    ordre = (colonne_cle.desc(), colonne_id.desc()) if decroissant else (colonne_cle, colonne_id)
+    elements = query.order_by(*ordre).limit(per_page + 1).all()
+    
+    suivant = None
+    if len(elements) > per_page:
+        elements = elements[:per_page]
+        suivant = encoder_curseur(getattr(elements[-1], colonne_cle.key), getattr(elements[-1], colonne_id.key))
+    return elements, {'per_page': per_page, 'next_cursor': suivant, 'total': total}
+
+def compter_par(colonne, ids):
+    """Nombre de lignes par valeur de `colonne` (clé étrangère) parmi `ids`, en une requête groupée"""
+    if not ids:
+        return {}
+    return dict(
+        db.session.query(colonne, db.func.count())
+        .filter(colonne.in_(ids))
+        .group_by(colonne)
+    )
+
+def utilisateurs_concernes_image(image):
+    """Utilisateurs dont les données affichées dépendent d'une image"""
+    utilisateurs = {image.utilisateur_id}
+    if image.repas_id:
+        utilisateurs.add(db.session.query(Repas.utilisateur_id).filter(Repas.id == image.repas_id).scalar())
+    if image.symptome_id:
+        utilisateurs.add(db.session.query(Symptome.utilisateur_id).filter(Symptome.id == image.symptome_id).scalar())
+    return {utilisateur_id for utilisateur_id in utilisateurs if utilisateur_id}
+
+# Tâches asynchrones
+_executeur_taches = None
+_verrou_executeur = threading.Lock()
+
+def executeur_taches():
+    """Pool de workers du processus, créé à la première tâche"""
+    global _executeur_taches
+    with _verrou_executeur:
+        if _executeur_taches is None:
+            _executeur_taches = ThreadPoolExecutor(
+                max_workers=current_app.config['ANALYSE_TACHES_WORKERS'],
+                thread_name_prefix='taches'
+            )
+        return _executeur_taches
+
+def executer_tache_rapport(application, tache_id):
+    """Calcule le rapport d'une tâche dans son propre contexte d'application"""
+    with application.app_context():
+        # Les écritures ouvrent leur transaction : hors requête, SQLite n'attend le verrou d'écriture
+        # (busy_timeout) que si la transaction n'a encore rien lu, sinon « database is locked »
+        reservee = TacheAsynchrone.query.filter_by(id=tache_id, statut='en_attente').update({
+            TacheAsynchrone.statut: 'en_cours',
+            TacheAsynchrone.date_debut: datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        if not reservee:
+            return
+        
+        try:
+            utilisateur_id = db.session.query(TacheAsynchrone.utilisateur_id).filter_by(id=tache_id).scalar()
+            fin = {
+                TacheAsynchrone.resultat: json.dumps(obtenir_rapport_analyse(utilisateur_id)),
+                TacheAsynchrone.statut: 'termine'
+            }
+        except Exception as e:
+            fin = {TacheAsynchrone.statut: 'erreur', TacheAsynchrone.erreur: str(e)}
+        fin[TacheAsynchrone.date_fin] = datetime.utcnow()
+        db.session.rollback()  # Le rapport mis en cache est déjà enregistré
+        TacheAsynchrone.query.filter_by(id=tache_id).update(fin, synchronize_session=False)
+        db.session.commit()
+
+def soumettre_tache(tache_id):
+    """Confie une tâche enregistrée au pool (ou l'exécute immédiatement sans workers)"""
+    application = current_app._get_current_object()
+    if current_app.config['ANALYSE_TACHES_WORKERS'] > 0:
+        executeur_taches().submit(executer_tache_rapport, application, tache_id)
+    else:
+        executer_tache_rapport(application, tache_id)
+
+def purger_taches():
+    """Supprime les tâches terminées plus anciennes que la rétention configurée"""
+    limite = datetime.utcnow() - timedelta(hours=current_app.config['ANALYSE_TACHES_RETENTION'])
+    TacheAsynchrone.query.filter(
+        TacheAsynchrone.statut.in_(['termine', 'erreur']),
+        TacheAsynchrone.date_fin < limite
+    ).delete(synchronize_session=False)
+
+def limite_taches_actives():
+    """Date de création (ou de début) en deçà de laquelle une tâche active est considérée abandonnée"""
+    return datetime.utcnow() - timedelta(seconds=current_app.config['ANALYSE_TACHES_DELAI_MAX'])
+
+def expirer_taches(utilisateur_id=None):
+    """Passe en erreur les tâches restées en attente ou en cours au-delà du délai maximal.
+    
+    Le pool est propre au processus : une tâche soumise avant un redémarrage ne sera jamais
+    reprise, et bloquerait sinon les demandes de rapport de son utilisateur.
+    """
+    query = TacheAsynchrone.query.filter(
+        TacheAsynchrone.statut.in_(['en_attente', 'en_cours']),
+        db.func.coalesce(TacheAsynchrone.date_debut, TacheAsynchrone.date_creation) < limite_taches_actives()
+    )
+    if utilisateur_id is not None:
+        query = query.filter(TacheAsynchrone.utilisateur_id == utilisateur_id)
+    return query.update({
+        TacheAsynchrone.statut: 'erreur',
+        TacheAsynchrone.erreur: 'Tâche interrompue : délai dépassé',
+        TacheAsynchrone.date_fin: datetime.utcnow()
+    }, synchronize_session=False)
+
+def tache_en_json(tache):
+    donnees = {
+        'id': tache.id,
+        'type_tache': tache.type_tache,
+        'utilisateur_id': tache.utilisateur_id,
+        'statut': tache.statut,
+        'date_creation': tache.date_creation.isoformat(),
+        'date_debut': tache.date_debut.isoformat() if tache.date_debut else None,
+        'date_fin': tache.date_fin.isoformat() if tache.date_fin else None
+    }
+    if tache.statut == 'termine':
+        donnees['resultat'] = json.loads(tache.resultat)
+    elif tache.statut == 'erreur':
+        donnees['erreur'] = tache.erreur
+    return donnees
+
+# Utilitaires pour les repas
+def analyser_date(valeur):
+    """Date ISO 8601 (chemin rapide) ou tout format reconnu par dateutil ; ValueError sinon"""
+    if not isinstance(valeur, str):
+        raise ValueError('date_heure doit être un texte')
+    try:
+        return datetime.fromisoformat(valeur)
+    except ValueError:
+        pass
+    try:
+        return parser.parse(valeur)
+    except (ValueError, OverflowError):
+        raise ValueError(f'date_heure invalide : {valeur}')
+
+def extraire_lignes_aliments(aliments):
+    """Normalise les deux formes de Repas.aliments en [(nom, quantite)].
+    
+    Formes acceptées : [{"nom": ..., "quantite": ...}] ou {"nom": quantite}.
+    Un repas mal formé ne produit aucune ligne.
+    """
+    if isinstance(aliments, list):
+        if not all(isinstance(aliment, dict) for aliment in aliments):
+            return []
+        lignes = [(aliment.get('nom', ''), aliment.get('quantite')) for aliment in aliments]
+    elif isinstance(aliments, dict):
+        lignes = list(aliments.items())
+    else:
+        return []
+    
+    if not all(isinstance(nom, str) for nom, _ in lignes):
+        return []
+    return [
+        (nom, float(quantite) if isinstance(quantite, (int, float)) and not isinstance(quantite, bool) else None)
+        for nom, quantite in lignes if nom
+    ]
+
+def ids_catalogue_par_nom(noms):
+    return dict(db.session.query(Aliment.nom, Aliment.id).filter(Aliment.nom.in_(set(noms))))
+
+def creer_lignes_repas(repas, aliments, ids_catalogue=None):
+    """Ajoute à la session les lignes RepasAliment d'un repas.
+    
+    ids_catalogue ({nom: id}) évite la recherche dans le catalogue quand l'appelant l'a déjà faite.
+    """
+    lignes = extraire_lignes_aliments(aliments)
+    if not lignes:
+        return
+    if ids_catalogue is None:
+        ids_catalogue = ids_catalogue_par_nom(nom for nom, _ in lignes)
+    for nom, quantite in lignes:
+        repas.lignes.append(RepasAliment(
+            aliment_id=ids_catalogue.get(nom),
+            nom=nom,
+            quantite=quantite
+        ))
+
+def lier_lignes_repas(aliment):
+    """Rattache au catalogue les lignes de repas saisies sous le nom de cet aliment"""
+    RepasAliment.query.filter(
+        RepasAliment.nom == aliment.nom,
+        RepasAliment.aliment_id.is_(None)
+    ).update({RepasAliment.aliment_id: aliment.id}, synchronize_session=False)
+
+def migrer_lignes_repas(taille_lot=500):
+    """Crée les lignes RepasAliment manquantes des repas existants, par lots"""
+    dernier_id = 0
+    nb_repas = 0
+    while True:
+        lot = Repas.query.filter(
+            Repas.id > dernier_id,
+            ~db.exists().where(RepasAliment.repas_id == Repas.id)
+        ).order_by(Repas.id).limit(taille_lot).all()
+        if not lot:
+            break
+        for repas in lot:
+            try:
+                creer_lignes_repas(repas, json.loads(repas.aliments))
+            except ValueError:
+                continue
+        db.session.commit()
+        dernier_id = lot[-1].id
+        nb_repas += len(lot)
+    return nb_repas
+
+def mettre_a_jour_schema():
+    """Ajoute aux tables existantes les colonnes et index apparus depuis leur création"""
+    inspecteur = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspecteur.has_table(table.name):
+            continue
+        colonnes = {colonne['name'] for colonne in inspecteur.get_columns(table.name)}
+        for colonne in table.columns:
+            if colonne.name not in colonnes:
+                type_sql = colonne.type.compile(dialect=db.engine.dialect)
+                db.session.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {colonne.name} {type_sql}'))
+    db.session.commit()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+# Migrations de schéma versionnées, appliquées une fois par base (table migration_schema)
+Migration = namedtuple('Migration', ['version', 'description', 'appliquer'])
+MIGRATIONS = []
+
+def migration(version, description):
+    """Déclare une migration. Elle doit être idempotente : une base neuve reçoit déjà le schéma
+    complet de create_all avant que les migrations ne soient enregistrées."""
+    def decorateur(fonction):
+        MIGRATIONS.append(Migration(version, description, fonction))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return fonction
+    return decorateur
+
+def creer_index(*noms):
+    """Crée les index déclarés dans les modèles sous ces noms, s'ils n'existent pas encore"""
+    index_par_nom = {index.name: index for table in db.metadata.sorted_tables for index in table.indexes}
+    for nom in noms:
+        index_par_nom[nom].create(db.engine, checkfirst=True)
+
+@migration(1, "Colonnes et index ajoutés aux modèles avant le suivi des versions")
+def _migration_rattrapage():
+    mettre_a_jour_schema()
+
+@migration(2, "Index des clés étrangères et des listes par utilisateur")
+def _migration_index_cles_etrangeres():
+    creer_index(
+        'ix_image_repas', 'ix_image_symptome',
+        'ix_plan_alimentaire_utilisateur_semaine', 'ix_repas_planifie_plan_jour',
+        'ix_buffet_utilisateur_date', 'ix_plat_buffet_buffet',
+        'ix_tache_utilisateur_statut', 'ix_tache_statut_fin'
+    )
+
+# Conversion tolérante d'un ancien texte : vide -> défaut, texte qui n'est pas du JSON -> chaîne JSON
+# (comme TexteJSON.process_bind_param), plutôt qu'un ALTER TABLE interrompu par la première valeur
+FONCTION_TEXTE_EN_JSONB = """
+CREATE OR REPLACE FUNCTION pg_temp.texte_en_jsonb(valeur text, defaut jsonb) RETURNS jsonb AS $$
+BEGIN
+    IF valeur IS NULL OR btrim(valeur) = '' THEN
+        RETURN defaut;
+    END IF;
+    RETURN valeur::jsonb;
+EXCEPTION WHEN invalid_text_representation THEN
+    RETURN to_jsonb(valeur);
+END
+$$ LANGUAGE plpgsql IMMUTABLE
+"""
+
+@migration(3, "Colonnes JSON en JSONB et index GIN du catalogue (PostgreSQL)")
+def _migration_jsonb():
+    if db.engine.dialect.name != 'postgresql':
+        return
+    inspecteur = db.inspect(db.engine)
+    db.session.execute(db.text(FONCTION_TEXTE_EN_JSONB))
+    for table in db.metadata.sorted_tables:
+        if not inspecteur.has_table(table.name):
+            continue
+        types = {colonne['name']: colonne['type'] for colonne in inspecteur.get_columns(table.name)}
+        for colonne in table.columns:
+            if isinstance(colonne.type, TexteJSON) and not isinstance(types.get(colonne.name), postgresql.JSONB):
+                # Colonne NOT NULL : une chaîne vide devient une liste vide
+                defaut = "'[]'::jsonb" if not colonne.nullable else 'NULL'
+                db.session.execute(db.text(
+                    f"ALTER TABLE {table.name} ALTER COLUMN {colonne.name} TYPE JSONB "
+                    f"USING pg_temp.texte_en_jsonb({colonne.name}, {defaut})"
+                ))
+    db.session.commit()
+    creer_index('ix_aliment_ingredients_gin', 'ix_aliment_allergenes_gin')
+
+@migration(4, "Lignes RepasAliment des repas enregistrés avant leur création")
+def _migration_lignes_repas():
+    migrer_lignes_repas()
+
+@migration(5, "Table d'exposition reconstruite pour tous les utilisateurs ayant des repas")
+def _migration_expositions():
+    # Après la migration 4 : le recalcul lit les lignes RepasAliment
+    for (utilisateur_id,) in db.session.query(Repas.utilisateur_id).distinct().order_by(Repas.utilisateur_id).all():
+        analyseur.reconstruire_expositions(utilisateur_id)
+        db.session.commit()
+
+@migration(6, "Index trigramme du nom des aliments (PostgreSQL)")
+def _migration_nom_trigrammes():
+    if db.engine.dialect.name != 'postgresql':
+        return
+    db.session.execute(db.text(EXTENSION_TRIGRAMMES.statement))
+    db.session.commit()
+    creer_index('ix_aliment_nom_trgm')
+
+def versions_schema_appliquees():
+    return {version for (version,) in db.session.query(MigrationSchema.version)}
+
+def migrer_schema(jusqua=None):
+    """Crée les tables manquantes puis applique dans l'ordre les migrations non enregistrées.
+    
+    Retourne les migrations appliquées. Une migration enregistrée entre-temps par un autre
+    processus (démarrage simultané de plusieurs workers) est simplement ignorée.
+    """
+    db.create_all()
+    appliquees = versions_schema_appliquees()
+    nouvelles = []
+    for etape in MIGRATIONS:
+        if etape.version in appliquees or (jusqua is not None and etape.version > jusqua):
+            continue
+        etape.appliquer()
+        db.session.add(MigrationSchema(version=etape.version, description=etape.description))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            continue
+        nouvelles.append(etape)
+    return nouvelles
+
+def plan_execution(query):
+    """Plan d'exécution (EXPLAIN) d'une requête ORM, une ligne de texte par étape"""
+    compilee = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+    parametres = compilee.params
+    if compilee.positional:
+        parametres = tuple(parametres[nom] for nom in compilee.positiontup)
+    connexion = db.session.connection()
+    if db.engine.dialect.name == 'postgresql':
+        # Sur une petite table, PostgreSQL préfère un parcours séquentiel : on vérifie que l'index est utilisable
+        connexion.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        return [ligne[0] for ligne in connexion.exec_driver_sql('EXPLAIN ' + compilee.string, parametres)]
+    return [ligne[-1] for ligne in connexion.exec_driver_sql('EXPLAIN QUERY PLAN ' + compilee.string, parametres)]
+
+def requetes_critiques():
+    """(description, requête, index attendu) des requêtes les plus fréquentes"""
+    maintenant = datetime.utcnow()
+    fenetre = timedelta(hours=analyseur.fenetre_temporelle_max)
+    return [
+        ("Repas d'un utilisateur par date",
+         Repas.query.filter_by(utilisateur_id=1).order_by(Repas.date_heure.desc(), Repas.id.desc()).limit(20),
+         'ix_repas_utilisateur_date_id'),
+        ("Symptômes dans la fenêtre d'un repas",
+         db.session.query(Symptome.id).filter(
+             Symptome.utilisateur_id == 1,
+             Symptome.date_heure >= maintenant,
+             Symptome.date_heure <= maintenant + fenetre
+         ),
+         'ix_symptome_utilisateur_date_id'),
+        ("Historique des symptômes (analyse)",
+         db.session.query(Symptome.date_heure).filter(Symptome.utilisateur_id == 1).order_by(Symptome.date_heure),
+         'ix_symptome_utilisateur_date_id'),
+        ("Images d'un utilisateur",
+         Image.query.with_entities(*COLONNES_METADONNEES_IMAGE).filter_by(utilisateur_id=1)
+         .order_by(Image.date_creation.desc(), Image.id.desc()),
+         'ix_image_utilisateur_date_id'),
+        ("Images d'un repas", Image.query.with_entities(Image.id).filter_by(repas_id=1), 'ix_image_repas'),
+        ("Images d'un symptôme", Image.query.with_entities(Image.id).filter_by(symptome_id=1), 'ix_image_symptome'),
+        ("Plans d'un utilisateur",
+         PlanAlimentaire.query.filter_by(utilisateur_id=1).order_by(PlanAlimentaire.semaine_debut.desc()),
+         'ix_plan_alimentaire_utilisateur_semaine'),
+        ("Repas planifiés d'un plan", RepasPlanifie.query.filter_by(plan_id=1), 'ix_repas_planifie_plan_jour'),
+        ("Buffets d'un utilisateur",
+         Buffet.query.filter_by(utilisateur_id=1).order_by(Buffet.date_evenement.desc()),
+         'ix_buffet_utilisateur_date'),
+        ("Plats d'un buffet", PlatBuffet.query.filter_by(buffet_id=1), 'ix_plat_buffet_buffet'),
+        ("Tâche en cours d'un utilisateur",
+         TacheAsynchrone.query.filter(
+             TacheAsynchrone.type_tache == 'rapport_analyse',
+             TacheAsynchrone.utilisateur_id == 1,
+             TacheAsynchrone.statut.in_(['en_attente', 'en_cours'])
+         ),
+         'ix_tache_utilisateur_statut'),
+        ("Purge des tâches terminées",
+         db.session.query(TacheAsynchrone.id).filter(
+             TacheAsynchrone.statut.in_(['termine', 'erreur']),
+             TacheAsynchrone.date_fin < maintenant
+         ),
+         'ix_tache_statut_fin'),
+    ] + ([
+        ("Aliments contenant un allergène (JSONB)",
+         Aliment.query.filter(contient_element(Aliment.allergenes_courants, 'gluten')),
+         'ix_aliment_allergenes_gin'),
+        ("Aliments contenant un ingrédient (JSONB)",
+         Aliment.query.filter(contient_element(Aliment.ingredients, 'riz')),
+         'ix_aliment_ingredients_gin'),
+        ("Recherche d'aliments hors plein texte : nom", requete_recherche_aliments('riz'), 'ix_aliment_nom_trgm'),
+        ("Recherche d'aliments hors plein texte : ingrédient", requete_recherche_aliments('riz'),
+         'ix_aliment_ingredients_gin'),
+        ("Recherche d'aliments hors plein texte : allergène", requete_recherche_aliments('riz'),
+         'ix_aliment_allergenes_gin'),
+    ] if db.engine.dialect.name == 'postgresql' else [])
+
+# Import en masse du catalogue
+CHAMPS_NUTRIMENTS = ('calories_pour_100g', 'proteines_pour_100g', 'glucides_pour_100g',
+                     'lipides_pour_100g', 'fibres_pour_100g')
+# Valeurs d'un aliment créé par l'import pour les champs absents de sa ligne
+COLONNES_ALIMENT_PAR_DEFAUT = dict(
+    {'ingredients': '[]', 'allergenes_courants': '[]', 'categorie': None},
+    **dict.fromkeys(CHAMPS_NUTRIMENTS)
+)
+
+def lire_enregistrements_import(flux, format_import):
+    """Itère sur (numéro de ligne, enregistrement) d'un flux texte NDJSON ou CSV, sans le charger en mémoire.
+    
+    Une ligne NDJSON illisible produit l'exception ValueError à la place de l'enregistrement.
+    """
+    if format_import == 'csv':
+        lecteur = csv.DictReader(flux)
+        for enregistrement in lecteur:
+            yield lecteur.line_num, enregistrement
+        return
+    for numero, texte in enumerate(flux, 1):
+        if not texte.strip():
+            continue
+        try:
+            yield numero, json.loads(texte)
+        except ValueError as e:
+            yield numero, ValueError(f'JSON invalide : {e}')
+
+def _liste_import(valeur, champ):
+    """Liste JSON, tableau JSON en texte ou valeurs séparées par ';' (CSV)"""
+    if valeur in (None, ''):
+        return []
+    if isinstance(valeur, str):
+        if valeur.lstrip().startswith('['):
+            valeur = json.loads(valeur)
+        else:
+            valeur = [element.strip() for element in valeur.split(';') if element.strip()]
+    if not isinstance(valeur, list) or not all(isinstance(element, str) for element in valeur):
+        raise ValueError(f'{champ} doit être une liste de textes')
+    return valeur
+
+def valider_aliment_import(enregistrement):
+    """Colonnes de la table aliment pour un enregistrement importé ; ValueError s'il est invalide.
+    
+    Seuls les champs présents dans l'enregistrement sont retournés (avec leur valeur vide éventuelle) :
+    les autres colonnes d'un aliment existant ne sont pas modifiées.
+    """
+    if isinstance(enregistrement, Exception):
+        raise enregistrement
+    if not isinstance(enregistrement, dict):
+        raise ValueError('objet attendu')
+    nom = enregistrement.get('nom')
+    nom = nom.strip() if isinstance(nom, str) else ''
+    if not nom:
+        raise ValueError('nom requis')
+    if len(nom) > 100:
+        raise ValueError('nom trop long (100 caractères max)')
+    colonnes = {'nom': nom}
+    for champ in ('ingredients', 'allergenes_courants'):
+        if champ in enregistrement:
+            colonnes[champ] = json.dumps(_liste_import(enregistrement[champ], champ))
+    for champ in CHAMPS_NUTRIMENTS:
+        if champ not in enregistrement:
+            continue
+        valeur = enregistrement[champ]
+        if valeur in (None, ''):
+            colonnes[champ] = None
+            continue
+        if isinstance(valeur, bool):
+            raise ValueError(f'{champ} doit être un nombre')
+        try:
+            valeur = float(valeur)
+        except (TypeError, ValueError):
+            raise ValueError(f'{champ} doit être un nombre')
+        if not 0 <= valeur < float('inf'):
+            raise ValueError(f'{champ} doit être un nombre positif')
+        colonnes[champ] = valeur
+    if 'categorie' in enregistrement:
+        categorie = enregistrement['categorie']
+        if categorie not in (None, '') and not isinstance(categorie, str):
+            raise ValueError('categorie doit être un texte')
+        if categorie and len(categorie) > 50:
+            raise ValueError('categorie trop longue (50 caractères max)')
+        colonnes['categorie'] = categorie or None
+    return colonnes
+
+def insertion_dialecte(table):
+    """INSERT propre au dialecte de la base, qui accepte on_conflict_do_update / do_nothing"""
+    dialecte = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    return dialecte.insert(table)
+
+def inserer_ou_mettre_a_jour(table, cles, colonnes):
+    """INSERT ... ON CONFLICT (cles) DO UPDATE SET colonnes, pour SQLite et PostgreSQL"""
+    instruction = insertion_dialecte(table)
+    return instruction.on_conflict_do_update(
+        index_elements=cles,
+        set_={colonne: instruction.excluded[colonne] for colonne in colonnes}
+    )
+
+def ecrire_lot_aliments(lot):
+    """Upsert d'un lot {nom: colonnes} dans une transaction ; retourne le nombre d'aliments créés.
+    
+    Un aliment existant ne reçoit que les colonnes présentes dans sa ligne : les lignes sont
+    regroupées par ensemble de colonnes, un upsert par groupe.
+    """
+    noms = list(lot)
+    existants = {nom for (nom,) in db.session.query(Aliment.nom).filter(Aliment.nom.in_(noms))}
+    maintenant = datetime.utcnow()
+    groupes = defaultdict(list)
+    for nom, colonnes in lot.items():
+        if nom not in existants:
+            colonnes = dict(COLONNES_ALIMENT_PAR_DEFAUT, **colonnes)
+        ligne = dict(colonnes, date_creation=maintenant, date_modification=maintenant)
+        groupes[tuple(sorted(ligne))].append(ligne)
+    for colonnes, lignes in groupes.items():
+        mises_a_jour = [colonne for colonne in colonnes if colonne not in ('nom', 'date_creation')]
+        db.session.execute(inserer_ou_mettre_a_jour(Aliment.__table__, ['nom'], mises_a_jour), lignes)
+    
+    aliments = db.session.query(
+        Aliment.id, Aliment.nom, Aliment.ingredients, Aliment.allergenes_courants
+    ).filter(Aliment.nom.in_(noms)).all()
+    nouveaux = {aliment.nom: aliment.id for aliment in aliments if aliment.nom not in existants}
+    if nouveaux:
+        RepasAliment.query.filter(
+            RepasAliment.nom.in_(list(nouveaux)),
+            RepasAliment.aliment_id.is_(None)
+        ).update({RepasAliment.aliment_id: db.case(nouveaux, value=RepasAliment.nom)}, synchronize_session=False)
+    indexer_aliments(aliments)
+    incrementer_version_catalogue()
+    db.session.commit()
+    return len(nouveaux)
+
+def importer_catalogue(flux, format_import='ndjson', taille_lot=1000, erreurs_max=1000, progression=None):
+    """Importe un flux NDJSON ou CSV d'aliments par lots, sans l'arrêter aux lignes invalides.
+    
+    Chaque lot est écrit dans sa propre transaction : la mémoire utilisée ne dépend que de
+    taille_lot, et une erreur en cours de flux laisse en base les lots déjà importés.
+    Seules les erreurs_max premières erreurs sont détaillées dans le rapport.
+    """
+    rapport = {'lignes': 0, 'crees': 0, 'mis_a_jour': 0, 'nb_erreurs': 0, 'erreurs': []}
+    debut = time.perf_counter()
+    lot = OrderedDict()
+    
+    def signaler(numero, message):
+        rapport['nb_erreurs'] += 1
+        if len(rapport['erreurs']) < erreurs_max:
+            rapport['erreurs'].append({'ligne': numero, 'erreur': message})
+    
+    def ecrire():
+        crees = ecrire_lot_aliments(lot)
+        rapport['crees'] += crees
+        rapport['mis_a_jour'] += len(lot) - crees
+        lot.clear()
+        if progression:
+            progression(rapport)
+    
+    numero = 0
+    try:
+        for numero, enregistrement in lire_enregistrements_import(flux, format_import):
+            rapport['lignes'] += 1
+            try:
+                colonnes = valider_aliment_import(enregistrement)
+            except ValueError as e:
+                signaler(numero, str(e))
+                continue
+            # Un nom répété dans le lot : ses champs s'ajoutent, la dernière valeur l'emporte
+            lot[colonnes['nom']] = dict(lot.pop(colonnes['nom'], {}), **colonnes)
+            if len(lot) >= taille_lot:
+                ecrire()
+        if lot:
+            ecrire()
+    except (UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        signaler(numero + 1, f'Flux illisible, import interrompu : {e}')
+        rapport['interrompu'] = True
+    
+    duree = time.perf_counter() - debut
+    rapport['duree_secondes'] = round(duree, 3)
+    rapport['lignes_par_seconde'] = round(rapport['lignes'] / duree) if duree else rapport['lignes']
+    return rapport
+
 # Utilitaires pour les images
-def traiter_image(data_base64, nom_fichier):
-    """Traite une image base64 et retourne les informations"""
+class DonneesImageIntrouvables(Exception):
+    """Fichier d'une image (ou dérivée) absent du stockage"""
+
+class StockageBase:
+    """Données d'image conservées dans la colonne donnees_blob"""
+    nom = 'base'
+
+    def enregistrer(self, image, donnees):
+        image.donnees_blob = donnees
+
+    def lire(self, image):
+        return image.donnees_blob
+
+    def chemin(self, image):
+        return None
+
+    def supprimer(self, image):
+        pass
+
+class StockageFichiers:
+    """Données d'image écrites sur disque, adressées par leur sha256 (dossier/ab/cd/abcd...)"""
+    nom = 'fichiers'
+
+    def __init__(self, dossier):
+        self.dossier = dossier
+
+    def chemin_empreinte(self, empreinte):
+        return os.path.join(self.dossier, empreinte[:2], empreinte[2:4], empreinte)
+
+    @staticmethod
+    def verrouiller(empreinte):
+        """Sérialise jusqu'au commit les écritures et suppressions d'un même fichier : verrou
+        consultatif sous PostgreSQL ; sous SQLite, la transaction doit déjà tenir le verrou
+        d'écriture de la base (voir verrouiller_ecritures)"""
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(db.text('SELECT pg_advisory_xact_lock(:cle)'), {'cle': int(empreinte[:15], 16)})
+        else:
+            verrouiller_ecritures()
+
+    def enregistrer(self, image, donnees):
+        chemin = self.chemin_empreinte(image.empreinte)
+        self.verrouiller(image.empreinte)
+        if not os.path.exists(chemin):  # Contenu identique déjà présent : partagé
+            os.makedirs(os.path.dirname(chemin), exist_ok=True)
+            temporaire = f'{chemin}.{uuid.uuid4().hex}.tmp'
+            with open(temporaire, 'wb') as fichier:
+                fichier.write(donnees)
+            os.replace(temporaire, chemin)
+        image.donnees_blob = b''
+
+    def lire(self, image):
+        try:
+            with open(self.chemin(image), 'rb') as fichier:
+                return fichier.read()
+        except FileNotFoundError:
+            raise DonneesImageIntrouvables(image.empreinte) from None
+
+    def chemin(self, image):
+        return self.chemin_empreinte(image.empreinte)
+
+    def supprimer(self, image):
+        """Supprime le fichier s'il n'est plus référencé par aucune image ni dérivée.
+        
+        À appeler dans la transaction qui retire (ou déplace) les références, avant son commit :
+        le verrou empêche un ajout du même contenu de réutiliser le fichier entre la vérification
+        et la suppression.
+        """
+        self.verrouiller(image.empreinte)
+        if any(
+            db.session.query(modele.id).filter(
+                modele.empreinte == image.empreinte, modele.stockage == self.nom
+            ).first()
+            for modele in (Image, DeriveeImage)
+        ):
+            return
+        try:
+            os.remove(self.chemin(image))
+        except FileNotFoundError:
+            pass
+
+def stockage_images(nom=None):
+    """Backend de stockage `nom` (par défaut celui configuré par IMAGES_STOCKAGE)"""
+    nom = nom or current_app.config['IMAGES_STOCKAGE']
+    if nom == StockageBase.nom:
+        return StockageBase()
+    if nom == StockageFichiers.nom:
+        return StockageFichiers(current_app.config['IMAGES_DOSSIER'])
+    raise ValueError(f"Stockage d'images inconnu: {nom}")
+
+def stockage_de(image):
+    """Backend où sont effectivement rangées les données de cette image"""
+    return stockage_images(image.stockage or StockageBase.nom)
+
+def enregistrer_donnees_image(image, donnees, stockage=None):
+    """Range les données de l'image dans le backend configuré et calcule son empreinte"""
+    stockage = stockage or stockage_images()
+    image.empreinte = hashlib.sha256(donnees).hexdigest()
+    stockage.enregistrer(image, donnees)
+    image.stockage = stockage.nom
+
+def servir_image(image, derivee=None):
+    """Réponse HTTP avec le contenu de l'image (ou de sa dérivée), envoyée depuis le fichier si possible"""
+    contenu = derivee or image
+    chemin = stockage_de(contenu).chemin(contenu)
+    if chemin is not None:
+        if not os.path.exists(chemin):
+            raise DonneesImageIntrouvables(contenu.empreinte)
+        return send_file(
+            chemin,
+            mimetype=contenu.type_mime,
+            as_attachment=False,
+            download_name=image.nom_fichier,
+            conditional=True,
+            etag=contenu.empreinte
+        )
+    return send_file(
+        io.BytesIO(contenu.donnees_blob),
+        mimetype=contenu.type_mime,
+        as_attachment=False,
+        download_name=image.nom_fichier
+    )
+
+# Dérivées (miniatures) des images
+VARIANTES_IMAGE = {'thumb': 256, 'medium': 800}  # Côté le plus long, en pixels
+
+class StatistiquesDerivees:
+    """Compteurs de service des dérivées : servies depuis le cache, générées, ou remplacées par l'original"""
+    def __init__(self):
+        self._verrou = threading.Lock()
+        self.succes = 0
+        self.generations = 0
+        self.originales = 0
+        self.octets_economises = 0
+    
+    def enregistrer(self, evenement):
+        with self._verrou:
+            setattr(self, evenement, getattr(self, evenement) + 1)
+    
+    def economiser(self, octets):
+        """Octets non transférés grâce à une dérivée servie à la place de l'original"""
+        with self._verrou:
+            self.octets_economises += max(octets, 0)
+    
+    def statistiques(self):
+        with self._verrou:
+            total = self.succes + self.generations
+            return {
+                'succes': self.succes,
+                'generations': self.generations,
+                'originales': self.originales,
+                'octets_economises': self.octets_economises,
+                'taux_succes': round(self.succes / total, 3) if total else 0
+            }
+
+statistiques_derivees = StatistiquesDerivees()
+
+def generer_derivee(image, variante):
+    """Redimensionne l'image pour la variante demandée (sans l'enregistrer en session)"""
+    cote = VARIANTES_IMAGE[variante]
+    with PILImage.open(io.BytesIO(stockage_de(image).lire(image))) as source:
+        format_image = source.format if source.format in ('JPEG', 'PNG', 'WEBP') else 'JPEG'
+        source.thumbnail((cote, cote), PILImage.Resampling.LANCZOS)
+        reduite = source.convert('RGB') if format_image == 'JPEG' and source.mode not in ('RGB', 'L') else source
+        sortie = io.BytesIO()
+        reduite.save(sortie, format=format_image, quality=85, optimize=True)
+        largeur, hauteur = reduite.size
+    donnees = sortie.getvalue()
+    derivee = DeriveeImage(
+        image_id=image.id,
+        variante=variante,
+        type_mime=PILImage.MIME[format_image],
+        taille=len(donnees),
+        largeur=largeur,
+        hauteur=hauteur
+    )
+    enregistrer_donnees_image(derivee, donnees, stockage_de(image))
+    return derivee
+
+def obtenir_derivee(image, variante):
+    """Dérivée conservée de l'image, générée au premier appel ; None si l'original est déjà assez petit"""
+    if image.largeur and image.hauteur and max(image.largeur, image.hauteur) <= VARIANTES_IMAGE[variante]:
+        return None
+    derivee = DeriveeImage.query.filter_by(image_id=image.id, variante=variante).first()
+    if derivee:
+        statistiques_derivees.enregistrer('succes')
+        return derivee
+    # La génération écrit (fichier partagé compris) : nouvelle transaction, verrou d'écriture d'abord
+    db.session.rollback()
+    verrouiller_ecritures()
+    derivee = generer_derivee(image, variante)
+    db.session.add(derivee)
+    try:
+        db.session.commit()
+    except IntegrityError:  # Générée en parallèle par une autre requête
+        db.session.rollback()
+        return DeriveeImage.query.filter_by(image_id=image.id, variante=variante).one()
+    statistiques_derivees.enregistrer('generations')
+    return derivee
+
+def reponse_image(image):
+    """Sert l'image ou la variante demandée par le paramètre `variant`"""
+    if (image.statut or 'pret') != 'pret':
+        return jsonify({'erreur': 'Image pas encore disponible', 'statut': image.statut}), 409
+    variante = request.args.get('variant')
+    if not variante:
+        return servir_image(image)
+    if variante not in VARIANTES_IMAGE:
+        return jsonify({'erreur': f"Variante inconnue: {variante} (disponibles: {', '.join(VARIANTES_IMAGE)})"}), 400
+    derivee = obtenir_derivee(image, variante)
+    if derivee is None:
+        statistiques_derivees.enregistrer('originales')
+        return servir_image(image)
+    statistiques_derivees.economiser((image.taille or 0) - (derivee.taille or 0))
+    return servir_image(image, derivee)
+
+def deplacer_images(destination, taille_lot=50):
+    """Déplace les données des images et de leurs dérivées vers le stockage `destination`, un lot par transaction"""
+    cible = stockage_images(destination)
+    nb_images = 0
+    db.session.commit()  # Chaque lot ouvre sa transaction avec le verrou d'écriture
+    for modele in (Image, DeriveeImage):
+        dernier_id = 0
+        while True:
+            verrouiller_ecritures()
+            requete = modele.query.filter(
+                modele.id > dernier_id,
+                db.func.coalesce(modele.stockage, StockageBase.nom) != cible.nom
+            )
+            if modele is Image:  # Les images en traitement n'ont pas encore de données
+                requete = requete.filter(db.func.coalesce(Image.statut, 'pret') == 'pret')
+            lot = requete.order_by(modele.id).limit(taille_lot).all()
+            if not lot:
+                db.session.rollback()
+                break
+            dernier_id = lot[-1].id
+            anciens = []
+            for contenu in lot:
+                source = stockage_de(contenu)
+                enregistrer_donnees_image(contenu, source.lire(contenu), cible)
+                anciens.append((source, contenu))
+            db.session.commit()
+            # Les anciennes copies ne sont retirées qu'une fois les nouvelles visibles
+            verrouiller_ecritures()
+            for source, contenu in anciens:
+                source.supprimer(contenu)
+            db.session.commit()
+            if modele is Image:
+                nb_images += len(lot)
+    return nb_images
+
+def traiter_fichier_image(fichier, nom_fichier):
+    """Traite une image lue depuis un fichier (ou un buffer) et retourne les informations"""
+    try:
+        debut = time.perf_counter()
+        durees = {'decodage': 0.0, 'redimensionnement': 0.0, 'encodage': 0.0}
+        
+        # Ouvrir avec PIL pour obtenir les dimensions
+        image = PILImage.open(fichier)
+        largeur, hauteur = image.size
+        
+        # Optimiser l'image si elle est trop grande
+        if largeur > 1920 or hauteur > 1080:
+            format_image = image.format if image.format else 'JPEG'
+            # JPEG : décodage directement réduit (1/2, 1/4 ou 1/8) au plus près de la taille cible
+            image.draft(image.mode, (1920, 1080))
+            image.load()
+            etape = time.perf_counter()
+            durees['decodage'] = (etape - debut) * 1000
+            
+            image.thumbnail((1920, 1080), PILImage.Resampling.LANCZOS)
+            durees['redimensionnement'] = (time.perf_counter() - etape) * 1000
+            etape = time.perf_counter()
+            
+            # Reconvertir en bytes
+            output = io.BytesIO()
+            image.save(output, format=format_image, quality=85, optimize=True)
+            image_data = output.getvalue()
+            largeur, hauteur = image.size
+            durees['encodage'] = (time.perf_counter() - etape) * 1000
+        else:
+            fichier.seek(0)
+            image_data = fichier.read()
+            durees['decodage'] = (time.perf_counter() - debut) * 1000
+        
+        return {
+            'donnees_blob': image_data,
+            'taille': len(image_data),
+            'largeur': largeur,
+            'hauteur': hauteur,
+            'durees': durees
+        }
+    except Exception as e:
+        raise ValueError(f"Erreur lors du traitement de l'image: {str(e)}")
+
+def traiter_donnees_image(donnees, nom_fichier):
+    """Point d'entrée des processus du pool : traite des données d'image brutes"""
+    return traiter_fichier_image(io.BytesIO(donnees), nom_fichier)
+
+def traiter_chemin_image(chemin, nom_fichier):
+    """Point d'entrée des processus du pool : traite une image envoyée, copiée dans un fichier temporaire"""
+    with open(chemin, 'rb') as fichier:
+        return traiter_fichier_image(fichier, nom_fichier)
+
+def supprimer_fichier_temporaire(chemin, futur=None):
     try:
-        # Décoder base64
-        image_data = base64.b64decode(data_base64)
+        os.remove(chemin)
+    except FileNotFoundError:
+        pass
+
+class PoolTraitementImages:
+    """Pool de processus borné pour le traitement des images, avec compteurs et durées par étape.
+    
+    Les processus sont lancés en 'spawn' : le pool est créé à la première image, dans un worker
+    web qui a déjà ses threads, et un fork à ce moment-là copierait des verrous tenus par ceux-ci.
+    """
+    def __init__(self):
+        self._verrou = threading.Lock()
+        self._executeur = None
+        self._futurs = {}  # futur en cours -> pool qui le traite
+        self._expires = {}  # pool retiré -> futurs expirés qui occupent encore ses processus
+        self._finalisation = None
+        self._durees = defaultdict(float)
+        self.en_cours = 0
+        self.traitees = 0
+        self.refusees = 0
+        self.expirees = 0
+    
+    def soumettre(self, source, nom_fichier):
+        """Lance le traitement ; None si le nombre maximal d'images en cours est atteint.
+        
+        `source` est soit des données brutes, soit un fichier ouvert : celui-ci est copié par blocs
+        dans un fichier temporaire dont seul le chemin est transmis au processus de traitement.
+        """
+        config = current_app.config
+        with self._verrou:
+            if self.en_cours >= config['IMAGES_TRAITEMENT_MAX_EN_COURS']:
+                self.refusees += 1
+                return None
+            if self._executeur is None:
+                self._executeur = ProcessPoolExecutor(max_workers=config['IMAGES_TRAITEMENT_WORKERS'],
+                                                      mp_context=multiprocessing.get_context('spawn'))
+            executeur = self._executeur
+            self.en_cours += 1
+        chemin = None
+        try:
+            if isinstance(source, bytes):
+                futur = executeur.submit(traiter_donnees_image, source, nom_fichier)
+            else:
+                with tempfile.NamedTemporaryFile(prefix='image-', delete=False) as copie:
+                    chemin = copie.name
+                    shutil.copyfileobj(source, copie, 64 * 1024)
+                futur = executeur.submit(traiter_chemin_image, chemin, nom_fichier)
+        except BaseException as e:
+            with self._verrou:
+                self.en_cours -= 1
+                if isinstance(e, BrokenProcessPool):
+                    self._executeur = None  # Recréé à la prochaine image
+            if chemin:
+                supprimer_fichier_temporaire(chemin)
+            raise
+        with self._verrou:
+            self._futurs[futur] = executeur
+        futur.add_done_callback(self._terminer)
+        if chemin:
+            futur.add_done_callback(partial(supprimer_fichier_temporaire, chemin))
+        return futur
+    
+    def _terminer(self, futur):
+        with self._verrou:
+            self.en_cours -= 1
+            executeur = self._futurs.pop(futur, None)
+        if executeur in self._expires:
+            self._recycler(executeur)
+        if not futur.cancelled() and futur.exception() is None:
+            self.enregistrer(futur.result()['durees'])
+    
+    def planifier(self, fonction, *args):
+        """Exécute fonction(*args) dans le thread de finalisation du processus.
+        
+        Les rappels d'un futur tournent dans le thread de gestion du pool de processus : une
+        écriture en base ou un redimensionnement à cet endroit retarderait toutes les autres images.
+        """
+        with self._verrou:
+            if self._finalisation is None:
+                self._finalisation = ThreadPoolExecutor(max_workers=1, thread_name_prefix='images')
+            finalisation = self._finalisation
+        finalisation.submit(fonction, *args)
+    
+    def enregistrer(self, durees):
+        with self._verrou:
+            self.traitees += 1
+            for etape, duree in durees.items():
+                self._durees[etape] += duree
+        for etape, duree in durees.items():
+            metriques.observer('image_traitement_duree_secondes', duree / 1000, etape=etape)
+    
+    def expirer(self, futur):
+        """Abandonne un traitement qui a dépassé son délai.
+        
+        Un futur en attente est simplement annulé. S'il tourne déjà, cancel() ne peut rien : son
+        pool est retiré (les images suivantes partent dans un nouveau) et ses processus sont arrêtés
+        dès que les autres images qu'il traite sont terminées, ce qui libère le processus bloqué.
+        """
+        annule = futur.cancel()
+        with self._verrou:
+            self.expirees += 1
+            executeur = self._futurs.get(futur)
+            if annule or executeur is None:
+                return
+            if self._executeur is executeur:
+                self._executeur = None
+            self._expires.setdefault(executeur, set()).add(futur)
+        self._recycler(executeur)
+    
+    def _recycler(self, executeur):
+        """Arrête les processus d'un pool retiré s'il ne traite plus que des images expirées"""
+        with self._verrou:
+            restants = {futur for futur, pool in self._futurs.items() if pool is executeur}
+            if executeur not in self._expires or not restants <= self._expires[executeur]:
+                return
+            del self._expires[executeur]
+            processus = list((executeur._processes or {}).values())  # Pas d'API publique avant Python 3.14
+        executeur.shutdown(wait=False, cancel_futures=True)
+        for p in processus:
+            p.terminate()  # Les futurs expirés échouent en BrokenProcessPool, ce qui libère leur place
+    
+    def statistiques(self):
+        with self._verrou:
+            return {
+                'en_cours': self.en_cours,
+                'traitees': self.traitees,
+                'refusees': self.refusees,
+                'expirees': self.expirees,
+                'durees_moyennes_ms': {etape: round(total / self.traitees, 2)
+                                       for etape, total in self._durees.items()}
+            }
+
+pool_images = PoolTraitementImages()
+
+class FluxLimite:
+    """Flux d'entrée qui lève RequestEntityTooLarge dès que plus de `limite` octets ont été lus"""
+    def __init__(self, flux, limite):
+        self._flux = flux
+        self.limite = limite
+        self.lus = 0
+    
+    def read(self, taille=-1):
+        donnees = self._flux.read(self.limite - self.lus + 1 if taille is None or taille < 0 else taille)
+        self.lus += len(donnees)
+        if self.lus > self.limite:
+            raise RequestEntityTooLarge()
+        return donnees
+
+def lire_upload_image():
+    """Lit le fichier envoyé (multipart/form-data ou corps brut) sans le charger en mémoire.
+    
+    Retourne (fichier, nom_fichier, type_mime, champs), le fichier étant un buffer
+    débordant sur disque et `champs` les autres paramètres du formulaire ou de l'URL.
+    """
+    taille_max = current_app.config['IMAGES_TAILLE_MAX']
+    if request.content_length is not None and request.content_length > taille_max:
+        raise RequestEntityTooLarge()
+    flux = FluxLimite(request.stream, taille_max)
+    
+    if request.mimetype == 'multipart/form-data':
+        _, champs, fichiers = FormDataParser(silent=False).parse(
+            flux, request.mimetype, request.content_length, request.mimetype_params
+        )
+        envoi = fichiers.get('fichier')
+        if envoi is None or not envoi.filename:
+            raise ValueError('Champ fichier requis')
+        return envoi.stream, champs.get('nom_fichier') or envoi.filename, envoi.mimetype, champs
+    
+    if not request.mimetype.startswith('image/'):
+        raise ValueError('Envoyer multipart/form-data ou un corps de type image/*')
+    if not request.args.get('nom_fichier'):
+        raise ValueError('nom_fichier requis')
+    tampon = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    shutil.copyfileobj(flux, tampon, 64 * 1024)
+    tampon.seek(0)
+    return tampon, request.args['nom_fichier'], request.mimetype, request.args
+
+def appliquer_traitement_image(image, info_image):
+    """Range le résultat de traiter_fichier_image dans l'image, qui devient prête"""
+    image.taille = info_image['taille']
+    image.largeur = info_image['largeur']
+    image.hauteur = info_image['hauteur']
+    enregistrer_donnees_image(image, info_image['donnees_blob'])
+    image.statut = 'pret'
+
+def creer_image(info_image, nom_fichier, type_mime, utilisateur_id=None, repas_id=None, symptome_id=None):
+    """Enregistre une image traitée (ou, sans `info_image`, en cours de traitement), ses versions
+    de cache et ses variantes générées à l'ajout"""
+    verrouiller_ecritures()
+    image = Image(
+        nom_fichier=nom_fichier,
+        type_mime=type_mime,
+        donnees_blob=b'',
+        statut='traitement',
+        utilisateur_id=utilisateur_id,
+        repas_id=repas_id,
+        symptome_id=symptome_id
+    )
+    if info_image is not None:
+        appliquer_traitement_image(image, info_image)
+    
+    db.session.add(image)
+    for utilisateur_id in utilisateurs_concernes_image(image):
+        incrementer_version(cle_version_utilisateur(utilisateur_id))
+    db.session.commit()
+    if image.statut == 'pret':
+        for variante in current_app.config['IMAGES_VARIANTES_UPLOAD']:
+            obtenir_derivee(image, variante)
+    return image
+
+def passer_images_en_erreur(query):
+    """Passe au statut 'erreur' les images de `query` (sans commit), retourne leur nombre"""
+    images = query.all()
+    for image in images:
+        image.statut = 'erreur'
+        for utilisateur_id in utilisateurs_concernes_image(image):
+            incrementer_version(cle_version_utilisateur(utilisateur_id))
+    return len(images)
+
+def expirer_images_en_traitement(image_id=None):
+    """Passe en erreur les images restées au statut 'traitement' au-delà du délai maximal.
+    
+    Le traitement d'une image est perdu si le processus s'arrête entre-temps, ou si même
+    l'enregistrement de l'erreur a échoué.
+    """
+    limite = datetime.utcnow() - timedelta(seconds=current_app.config['IMAGES_TRAITEMENT_DELAI_MAX'])
+    query = Image.query.filter(Image.statut == 'traitement', Image.date_creation < limite)
+    if image_id is not None:
+        query = query.filter(Image.id == image_id)
+    return passer_images_en_erreur(query)
+
+def finaliser_image(application, image_id, futur):
+    """Enregistre le résultat d'un traitement lancé en mode 'traitement' (thread de finalisation du pool)"""
+    with application.app_context():
+        try:
+            verrouiller_ecritures()
+            image = db.session.get(Image, image_id)
+            if image is None:
+                return
+            appliquer_traitement_image(image, futur.result())
+            for utilisateur_id in utilisateurs_concernes_image(image):
+                incrementer_version(cle_version_utilisateur(utilisateur_id))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            application.logger.warning("Traitement de l'image %s échoué: %s", image_id, e)
+            try:
+                passer_images_en_erreur(Image.query.filter(Image.id == image_id, Image.statut == 'traitement'))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                application.logger.exception("Image %s laissée en traitement", image_id)
+            return
         
-        # Ouvrir avec PIL pour obtenir les dimensions
-        image = PILImage.open(io.BytesIO(image_data))
-        largeur, hauteur = image.size
+        # Variantes seulement anticipées : en cas d'échec, elles seront générées à la demande
+        try:
+            for variante in application.config['IMAGES_VARIANTES_UPLOAD']:
+                obtenir_derivee(image, variante)
+        except Exception as e:
+            db.session.rollback()
+            application.logger.warning("Variantes de l'image %s non générées: %s", image_id, e)
+
+def ajouter_image_traitee(source, nom_fichier, type_mime, utilisateur_id=None, repas_id=None, symptome_id=None):
+    """Traite les données (bytes ou fichier ouvert) hors du worker web puis enregistre l'image.
+    
+    Avec ?mode=attente (défaut) la réponse attend le traitement (201) ; avec ?mode=traitement
+    l'image est créée immédiatement au statut 'traitement' (202) et complétée en arrière-plan.
+    """
+    mode = request.args.get('mode', 'attente')
+    if mode not in ('attente', 'traitement'):
+        return jsonify({'erreur': "mode doit valoir 'attente' ou 'traitement'"}), 400
+    debut = time.perf_counter()
+    db.session.rollback()  # Aucune transaction (ni verrou SQLite) ouverte pendant le traitement
+    
+    if current_app.config['IMAGES_TRAITEMENT_WORKERS'] <= 0:
+        info_image = traiter_fichier_image(io.BytesIO(source) if isinstance(source, bytes) else source, nom_fichier)
+        pool_images.enregistrer(info_image['durees'])
+    else:
+        futur = pool_images.soumettre(source, nom_fichier)
+        if futur is None:
+            reponse = jsonify({'erreur': 'Trop d\'images en cours de traitement, réessayez plus tard'})
+            reponse.headers['Retry-After'] = '1'
+            return reponse, 503
         
-        # Optimiser l'image si elle est trop grande
-        if largeur > 1920 or hauteur > 1080:
-            image.thumbnail((1920, 1080), PILImage.Resampling.LANCZOS)
-            
-            # Reconvertir en bytes
-            output = io.BytesIO()
-            format_image = image.format if image.format else 'JPEG'
-            image.save(output, format=format_image, quality=85, optimize=True)
-            image_data = output.getvalue()
-            largeur, hauteur = image.size
+        if mode == 'traitement':
+            image = creer_image(None, nom_fichier, type_mime, utilisateur_id, repas_id, symptome_id)
+            futur.add_done_callback(partial(
+                pool_images.planifier, finaliser_image, current_app._get_current_object(), image.id
+            ))
+            return jsonify(SERIALISEUR_IMAGE(image)), 202
         
-        return {
-            'donnees_blob': image_data,
-            'taille': len(image_data),
-            'largeur': largeur,
-            'hauteur': hauteur
-        }
-    except Exception as e:
-        raise ValueError(f"Erreur lors du traitement de l'image: {str(e)}")
+        try:
+            info_image = futur.result(timeout=current_app.config['IMAGES_TRAITEMENT_DELAI'])
+        except DelaiDepasse:
+            pool_images.expirer(futur)
+            return jsonify({'erreur': 'Délai de traitement de l\'image dépassé'}), 504
+    
+    image = creer_image(info_image, nom_fichier, type_mime, utilisateur_id, repas_id, symptome_id)
+    reponse = jsonify(SERIALISEUR_IMAGE(image))
+    durees = dict(info_image['durees'], total=(time.perf_counter() - debut) * 1000)
+    reponse.headers['Server-Timing'] = ', '.join(f'{etape};dur={duree:.1f}' for etape, duree in durees.items())
+    return reponse, 201
 
 # Routes API pour les utilisateurs
 @app.route('/api/utilisateurs', methods=['POST'])
@@ -291,26 +3057,18 @@ def creer_utilisateur():
     )
     
     db.session.add(utilisateur)
+    db.session.flush()
+    incrementer_version(cle_version_utilisateur(utilisateur.id))
     db.session.commit()
     
-    return jsonify({
-        'id': utilisateur.id,
-        'nom': utilisateur.nom,
-        'email': utilisateur.email,
-        'date_creation': utilisateur.date_creation.isoformat()
-    }), 201
+    return jsonify(SERIALISEUR_UTILISATEUR(utilisateur)), 201
 
 @app.route('/api/utilisateurs/<int:utilisateur_id>', methods=['GET'])
 def obtenir_utilisateur(utilisateur_id):
     """Obtenir les informations d'un utilisateur"""
     utilisateur = Utilisateur.query.get_or_404(utilisateur_id)
     
-    return jsonify({
-        'id': utilisateur.id,
-        'nom': utilisateur.nom,
-        'email': utilisateur.email,
-        'date_creation': utilisateur.date_creation.isoformat()
-    })
+    return jsonify(SERIALISEUR_UTILISATEUR(utilisateur))
 
 @app.route('/api/utilisateurs/<int:utilisateur_id>', methods=['PUT'])
 def modifier_utilisateur(utilisateur_id):
@@ -330,14 +3088,10 @@ def modifier_utilisateur(utilisateur_id):
     if data.get('nom'):
         utilisateur.nom = data['nom']
     
+    incrementer_version(cle_version_utilisateur(utilisateur.id))
     db.session.commit()
     
-    return jsonify({
-        'id': utilisateur.id,
-        'nom': utilisateur.nom,
-        'email': utilisateur.email,
-        'date_creation': utilisateur.date_creation.isoformat()
-    })
+    return jsonify(SERIALISEUR_UTILISATEUR(utilisateur))
 
 @app.route('/api/utilisateurs/<int:utilisateur_id>', methods=['DELETE'])
 def supprimer_utilisateur(utilisateur_id):
@@ -345,10 +3099,115 @@ def supprimer_utilisateur(utilisateur_id):
     utilisateur = Utilisateur.query.get_or_404(utilisateur_id)
     
     db.session.delete(utilisateur)
+    incrementer_version(cle_version_utilisateur(utilisateur.id))
     db.session.commit()
     
     return jsonify({'message': 'Utilisateur supprimé avec succès'}), 200
 
+# Export de l'historique complet d'un utilisateur
+CHAMPS_EXPORT = OrderedDict([
+    ('utilisateur', (Utilisateur, ('id', 'nom', 'email', 'date_creation'))),
+    ('repas', (Repas, ('id', 'date_heure', 'aliments', 'description'))),
+    ('symptome', (Symptome, ('id', 'date_heure', 'type_symptome', 'severite', 'description'))),
+    ('plan_alimentaire', (PlanAlimentaire, ('id', 'nom', 'semaine_debut', 'actif', 'date_creation'))),
+    ('repas_planifie', (RepasPlanifie, ('id', 'plan_id', 'jour_semaine', 'type_repas', 'aliments_planifies',
+                                        'calories_estimees', 'notes'))),
+    ('buffet', (Buffet, ('id', 'nom_evenement', 'date_evenement', 'nombre_invites', 'budget_total',
+                         'type_evenement', 'notes', 'statut', 'date_creation'))),
+    ('plat_buffet', (PlatBuffet, ('id', 'buffet_id', 'nom_plat', 'categorie', 'quantite_par_personne',
+                                  'cout_unitaire', 'allergenes', 'ingredients', 'instructions_preparation',
+                                  'temps_preparation', 'difficulte', 'notes'))),
+    ('image', (Image, ('id', 'uuid', 'nom_fichier', 'type_mime', 'taille', 'largeur', 'hauteur',
+                       'date_creation', 'repas_id', 'symptome_id', 'statut'))),
+])
+CHAMPS_EXPORT_JSON = {'aliments', 'aliments_planifies', 'allergenes', 'ingredients'}  # Colonnes JSON texte
+EXPORT_TAILLE_LOT = 1000
+
+def enregistrements_export(utilisateur_id, inclure_images=False, taille_lot=EXPORT_TAILLE_LOT):
+    """Itère sur (type, {champ: valeur}) de tout l'historique d'un utilisateur.
+    
+    Chaque table est lue en projection, par lots de taille_lot (yield_per : curseur côté serveur
+    quand le pilote le permet), sans jamais charger l'historique entier en mémoire.
+    """
+    def lire(type_enregistrement, *filtres, jointure=None, ordre=None):
+        modele, champs = CHAMPS_EXPORT[type_enregistrement]
+        query = db.session.query(*[getattr(modele, champ) for champ in champs])
+        if jointure is not None:
+            query = query.join(jointure)
+        query = query.filter(*filtres).order_by(*(ordre or (modele.id,)))
+        for ligne in query.execution_options(yield_per=taille_lot):
+            yield type_enregistrement, dict(zip(champs, ligne))
+    
+    yield from lire('utilisateur', Utilisateur.id == utilisateur_id)
+    yield from lire('repas', Repas.utilisateur_id == utilisateur_id, ordre=(Repas.date_heure, Repas.id))
+    yield from lire('symptome', Symptome.utilisateur_id == utilisateur_id, ordre=(Symptome.date_heure, Symptome.id))
+    yield from lire('plan_alimentaire', PlanAlimentaire.utilisateur_id == utilisateur_id)
+    yield from lire('repas_planifie', PlanAlimentaire.utilisateur_id == utilisateur_id, jointure=RepasPlanifie.plan,
+                    ordre=(RepasPlanifie.plan_id, RepasPlanifie.jour_semaine, RepasPlanifie.id))
+    yield from lire('buffet', Buffet.utilisateur_id == utilisateur_id)
+    yield from lire('plat_buffet', Buffet.utilisateur_id == utilisateur_id, jointure=PlatBuffet.buffet,
+                    ordre=(PlatBuffet.buffet_id, PlatBuffet.id))
+    if inclure_images:
+        # Référence vers /api/images/uuid/<uuid> plutôt que les données : l'export reste léger
+        for type_enregistrement, champs in lire('image', Image.utilisateur_id == utilisateur_id):
+            champs['url'] = url_for('obtenir_image_par_uuid', uuid_str=champs['uuid'])
+            yield type_enregistrement, champs
+
+def _valeur_export(champ, valeur, decoder_json):
+    if isinstance(valeur, date):
+        return valeur.isoformat()
+    if decoder_json and champ in CHAMPS_EXPORT_JSON and valeur is not None:
+        try:
+            return json.loads(valeur)
+        except ValueError:
+            return valeur
+    return valeur
+
+def flux_export(enregistrements, format_export, taille_tampon=64 * 1024):
+    """Sérialise les enregistrements en NDJSON ou CSV, par morceaux d'environ taille_tampon caractères"""
+    tampon = io.StringIO()
+    if format_export == 'csv':
+        colonnes = ['type'] + list(OrderedDict.fromkeys(
+            champ for _, champs in CHAMPS_EXPORT.values() for champ in champs
+        )) + ['url']
+        ecrivain = csv.DictWriter(tampon, colonnes)
+        ecrivain.writeheader()
+        ecrire = lambda type_enregistrement, champs: ecrivain.writerow(dict(
+            {champ: _valeur_export(champ, valeur, False) for champ, valeur in champs.items()},
+            type=type_enregistrement
+        ))
+    else:
+        ecrire = lambda type_enregistrement, champs: tampon.write(json.dumps(dict(
+            {'type': type_enregistrement},
+            **{champ: _valeur_export(champ, valeur, True) for champ, valeur in champs.items()}
+        ), ensure_ascii=False) + '\n')
+    
+    for type_enregistrement, champs in enregistrements:
+        ecrire(type_enregistrement, champs)
+        if tampon.tell() >= taille_tampon:
+            yield tampon.getvalue()
+            tampon.seek(0)
+            tampon.truncate()
+    if tampon.tell():
+        yield tampon.getvalue()
+
+@app.route('/api/utilisateurs/<int:utilisateur_id>/export', methods=['GET'])
+@lecture_replica
+def exporter_utilisateur(utilisateur_id):
+    """Exporter tout l'historique d'un utilisateur en flux NDJSON ou CSV"""
+    format_export = request.args.get('format', 'ndjson')
+    if format_export not in ('ndjson', 'csv'):
+        return jsonify({'erreur': 'Format invalide (ndjson ou csv)'}), 400
+    if not db.session.query(db.exists().where(Utilisateur.id == utilisateur_id)).scalar():
+        return jsonify({'erreur': 'Utilisateur non trouvé'}), 404
+    inclure_images = request.args.get('images', 'false').lower() == 'true'
+    
+    flux = flux_export(enregistrements_export(utilisateur_id, inclure_images), format_export)
+    extension, mimetype = ('csv', 'text/csv') if format_export == 'csv' else ('ndjson', 'application/x-ndjson')
+    return Response(stream_with_context(flux), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=utilisateur-{utilisateur_id}.{extension}'
+    })
+
 # Routes CRUD pour les aliments
 @app.route('/api/aliments', methods=['POST'])
 def creer_aliment():
@@ -375,30 +3234,26 @@ def creer_aliment():
     )
     
     db.session.add(aliment)
+    db.session.flush()
+    lier_lignes_repas(aliment)
+    indexer_aliment(aliment)
+    version_catalogue = incrementer_version_catalogue()
     db.session.commit()
+    catalogue_nutriments.appliquer(version_catalogue, aliment)
+    index_suggestions.appliquer(version_catalogue, aliment)
     
-    return jsonify({
-        'id': aliment.id,
-        'nom': aliment.nom,
-        'ingredients': json.loads(aliment.ingredients),
-        'allergenes_courants': json.loads(aliment.allergenes_courants),
-        'calories_pour_100g': aliment.calories_pour_100g,
-        'proteines_pour_100g': aliment.proteines_pour_100g,
-        'glucides_pour_100g': aliment.glucides_pour_100g,
-        'lipides_pour_100g': aliment.lipides_pour_100g,
-        'fibres_pour_100g': aliment.fibres_pour_100g,
-        'categorie': aliment.categorie,
-        'date_creation': aliment.date_creation.isoformat(),
-        'date_modification': aliment.date_modification.isoformat()
-    }), 201
+    return jsonify(SERIALISEUR_ALIMENT(aliment)), 201
 
 @app.route('/api/aliments', methods=['GET'])
+@lecture_replica(catalogue=True)
 def lister_aliments():
     """Lister tous les aliments avec pagination et filtres"""
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
     categorie = request.args.get('categorie')
     recherche = request.args.get('recherche')
+    ingredient = request.args.get('ingredient')
+    allergene = request.args.get('allergene')
     
     query = Aliment.query
     
@@ -406,31 +3261,32 @@ def lister_aliments():
     if categorie:
         query = query.filter(Aliment.categorie == categorie)
     
-    # Recherche par nom
-    if recherche:
-        query = query.filter(Aliment.nom.contains(recherche))
+    # Filtrer sur un élément exact des listes d'ingrédients / d'allergènes
+    if ingredient:
+        query = query.filter(contient_element(Aliment.ingredients, ingredient))
+    if allergene:
+        query = query.filter(contient_element(Aliment.allergenes_courants, allergene))
     
-    # Pagination
-    aliments_pagines = query.order_by(Aliment.nom).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    # Recherche par nom (sans accents via l'index plein texte s'il existe)
+    if recherche:
+        if index_recherche_disponible():
+            requete = requete_recherche(recherche, colonne='nom')
+            query = query.filter(Aliment.id.in_(ids_recherche(requete)) if requete else db.false())
+        else:
+            query = query.filter(Aliment.nom.icontains(recherche, autoescape=True))
     
-    return jsonify({
-        'aliments': [{
-            'id': a.id,
-            'nom': a.nom,
-            'ingredients': json.loads(a.ingredients) if a.ingredients else [],
-            'allergenes_courants': json.loads(a.allergenes_courants) if a.allergenes_courants else [],
-            'calories_pour_100g': a.calories_pour_100g,
-            'proteines_pour_100g': a.proteines_pour_100g,
-            'glucides_pour_100g': a.glucides_pour_100g,
-            'lipides_pour_100g': a.lipides_pour_100g,
-            'fibres_pour_100g': a.fibres_pour_100g,
-            'categorie': a.categorie,
-            'date_creation': a.date_creation.isoformat(),
-            'date_modification': a.date_modification.isoformat()
-        } for a in aliments_pagines.items],
-        'pagination': {
+    # Pagination (par curseur si ?cursor= est fourni)
+    if 'cursor' in request.args:
+        try:
+            aliments, pagination = paginer_par_curseur(query, Aliment.nom, Aliment.id, decroissant=False)
+        except ValueError as e:
+            return jsonify({'erreur': str(e)}), 400
+    else:
+        aliments_pagines = query.order_by(Aliment.nom).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
+        aliments = aliments_pagines.items
+        pagination = {
             'page': page,
             'pages': aliments_pagines.pages,
             'per_page': per_page,
@@ -438,6 +3294,10 @@ def lister_aliments():
             'has_next': aliments_pagines.has_next,
             'has_prev': aliments_pagines.has_prev
         }
+    
+    return jsonify({
+        'aliments': SERIALISEUR_ALIMENT.liste(aliments),
+        'pagination': pagination
     })
 
 @app.route('/api/aliments/<int:aliment_id>', methods=['GET'])
@@ -445,20 +3305,7 @@ def obtenir_aliment(aliment_id):
     """Obtenir un aliment par son ID"""
     aliment = Aliment.query.get_or_404(aliment_id)
     
-    return jsonify({
-        'id': aliment.id,
-        'nom': aliment.nom,
-        'ingredients': json.loads(aliment.ingredients) if aliment.ingredients else [],
-        'allergenes_courants': json.loads(aliment.allergenes_courants) if aliment.allergenes_courants else [],
-        'calories_pour_100g': aliment.calories_pour_100g,
-        'proteines_pour_100g': aliment.proteines_pour_100g,
-        'glucides_pour_100g': aliment.glucides_pour_100g,
-        'lipides_pour_100g': aliment.lipides_pour_100g,
-        'fibres_pour_100g': aliment.fibres_pour_100g,
-        'categorie': aliment.categorie,
-        'date_creation': aliment.date_creation.isoformat(),
-        'date_modification': aliment.date_modification.isoformat()
-    })
+    return jsonify(SERIALISEUR_ALIMENT(aliment))
 
 @app.route('/api/aliments/<int:aliment_id>', methods=['PUT'])
 def modifier_aliment(aliment_id):
@@ -470,10 +3317,12 @@ def modifier_aliment(aliment_id):
         return jsonify({'erreur': 'Données requises'}), 400
     
     # Vérifier l'unicité du nom si modifié
+    ancien_nom = aliment.nom
     if data.get('nom') and data['nom'] != aliment.nom:
         if Aliment.query.filter_by(nom=data['nom']).first():
             return jsonify({'erreur': 'Un aliment avec ce nom existe déjà'}), 400
         aliment.nom = data['nom']
+        lier_lignes_repas(aliment)
     
     # Mettre à jour les champs
     if 'ingredients' in data:
@@ -494,33 +3343,45 @@ def modifier_aliment(aliment_id):
         aliment.categorie = data['categorie']
     
     aliment.date_modification = datetime.utcnow()
+    indexer_aliment(aliment)
+    version_catalogue = incrementer_version_catalogue()
     db.session.commit()
+    catalogue_nutriments.appliquer(version_catalogue, aliment, ancien_nom=ancien_nom)
+    index_suggestions.appliquer(version_catalogue, aliment, ancien_nom=ancien_nom)
     
-    return jsonify({
-        'id': aliment.id,
-        'nom': aliment.nom,
-        'ingredients': json.loads(aliment.ingredients) if aliment.ingredients else [],
-        'allergenes_courants': json.loads(aliment.allergenes_courants) if aliment.allergenes_courants else [],
-        'calories_pour_100g': aliment.calories_pour_100g,
-        'proteines_pour_100g': aliment.proteines_pour_100g,
-        'glucides_pour_100g': aliment.glucides_pour_100g,
-        'lipides_pour_100g': aliment.lipides_pour_100g,
-        'fibres_pour_100g': aliment.fibres_pour_100g,
-        'categorie': aliment.categorie,
-        'date_creation': aliment.date_creation.isoformat(),
-        'date_modification': aliment.date_modification.isoformat()
-    })
+    return jsonify(SERIALISEUR_ALIMENT(aliment))
 
 @app.route('/api/aliments/<int:aliment_id>', methods=['DELETE'])
 def supprimer_aliment(aliment_id):
     """Supprimer un aliment"""
     aliment = Aliment.query.get_or_404(aliment_id)
     
+    RepasAliment.query.filter_by(aliment_id=aliment.id).update(
+        {RepasAliment.aliment_id: None}, synchronize_session=False
+    )
     db.session.delete(aliment)
+    desindexer_aliment(aliment.id)
+    version_catalogue = incrementer_version_catalogue()
     db.session.commit()
+    catalogue_nutriments.appliquer(version_catalogue, aliment, supprime=True)
+    index_suggestions.appliquer(version_catalogue, aliment, supprime=True)
     
     return jsonify({'message': f'Aliment "{aliment.nom}" supprimé avec succès'}), 200
 
+@app.route('/api/aliments/import', methods=['POST'])
+def importer_aliments_route():
+    """Importer ou mettre à jour en masse des aliments depuis un flux NDJSON ou CSV"""
+    format_import = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+    if format_import not in ('ndjson', 'csv'):
+        return jsonify({'erreur': 'Format invalide (ndjson ou csv)'}), 400
+    taille_lot = request.args.get('lot', 1000, type=int)
+    if not 1 <= taille_lot <= 10000:
+        return jsonify({'erreur': 'Taille de lot invalide (1 à 10000)'}), 400
+    
+    flux = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='' if format_import == 'csv' else None)
+    rapport = importer_catalogue(flux, format_import, taille_lot)
+    return jsonify(rapport), 200
+
 @app.route('/api/aliments/categories', methods=['GET'])
 def lister_categories():
     """Lister toutes les catégories d'aliments"""
@@ -532,28 +3393,39 @@ def lister_categories():
         'categories': [cat[0] for cat in categories if cat[0]]
     })
 
+@app.route('/api/aliments/suggest', methods=['GET'])
+def suggerer_aliments():
+    """Suggestions de noms d'aliments pour la saisie semi-automatique"""
+    prefixe = request.args.get('prefix', '')
+    if not prefixe.strip():
+        return jsonify({'erreur': 'prefix requis'}), 400
+    limite = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    
+    suggestions = index_suggestions.actualiser().suggerer(prefixe, limite)
+    
+    return jsonify({
+        'prefix': prefixe,
+        'suggestions': [{'id': identifiant, 'nom': nom} for identifiant, nom in suggestions]
+    })
+
 @app.route('/api/aliments/recherche', methods=['GET'])
+@lecture_replica(catalogue=True)
 def rechercher_aliments():
     """Recherche avancée d'aliments"""
     terme = request.args.get('q', '')
     if not terme:
         return jsonify({'erreur': 'Terme de recherche requis'}), 400
     
-    # Recherche dans le nom et les ingrédients
-    aliments = Aliment.query.filter(
-        db.or_(
-            Aliment.nom.contains(terme),
-            Aliment.ingredients.contains(terme)
-        )
-    ).limit(10).all()
+    # Recherche dans le nom, les ingrédients et les allergènes (index plein texte, par pertinence)
+    ids = rechercher_ids_aliments(terme, limite=10)
+    if ids is None:
+        aliments = requete_recherche_aliments(terme).limit(10).all()
+    else:
+        par_id = {a.id: a for a in Aliment.query.filter(Aliment.id.in_(ids))} if ids else {}
+        aliments = [par_id[i] for i in ids if i in par_id]
     
     return jsonify({
-        'resultats': [{
-            'id': a.id,
-            'nom': a.nom,
-            'categorie': a.categorie,
-            'ingredients': json.loads(a.ingredients) if a.ingredients else []
-        } for a in aliments]
+        'resultats': SERIALISEUR_RECHERCHE_ALIMENT.liste(aliments)
     })
 
 # Routes pour les images avec gestion blob
@@ -566,184 +3438,149 @@ def ajouter_image():
         return jsonify({'erreur': 'nom_fichier, donnees_base64 et type_mime requis'}), 400
     
     try:
-        # Traiter l'image
-        info_image = traiter_image(data['donnees_base64'], data['nom_fichier'])
+        try:
+            donnees = base64.b64decode(data['donnees_base64'])
+        except ValueError as e:
+            raise ValueError(f"Erreur lors du traitement de l'image: {str(e)}")
         
-        # Créer l'enregistrement
-        image = Image(
-            nom_fichier=data['nom_fichier'],
-            donnees_blob=info_image['donnees_blob'],
-            type_mime=data['type_mime'],
-            taille=info_image['taille'],
-            largeur=info_image['largeur'],
-            hauteur=info_image['hauteur'],
-            utilisateur_id=data.get('utilisateur_id'),
-            repas_id=data.get('repas_id'),
-            symptome_id=data.get('symptome_id')
+        # Traiter l'image puis créer l'enregistrement
+        return ajouter_image_traitee(
+            donnees, data['nom_fichier'], data['type_mime'],
+            data.get('utilisateur_id'), data.get('repas_id'), data.get('symptome_id')
         )
         
-        db.session.add(image)
-        db.session.commit()
-        
-        return jsonify({
-            'id': image.id,
-            'uuid': image.uuid,
-            'nom_fichier': image.nom_fichier,
-            'type_mime': image.type_mime,
-            'taille': image.taille,
-            'largeur': image.largeur,
-            'hauteur': image.hauteur,
-            'date_creation': image.date_creation.isoformat(),
-            'utilisateur_id': image.utilisateur_id,
-            'repas_id': image.repas_id,
-            'symptome_id': image.symptome_id
-        }), 201
+    except ValueError as e:
+        return jsonify({'erreur': str(e)}), 400
+    except Exception as e:
+        return jsonify({'erreur': f'Erreur lors de l\'ajout de l\'image: {str(e)}'}), 500
+
+@app.route('/api/images/upload', methods=['POST'])
+def televerser_image():
+    """Ajouter une image envoyée en multipart/form-data (champ `fichier`) ou en corps brut image/*"""
+    try:
+        fichier, nom_fichier, type_mime, champs = lire_upload_image()
+        with fichier:
+            return ajouter_image_traitee(
+                fichier, nom_fichier, type_mime,
+                champs.get('utilisateur_id', type=int),
+                champs.get('repas_id', type=int),
+                champs.get('symptome_id', type=int)
+            )
         
     except ValueError as e:
         return jsonify({'erreur': str(e)}), 400
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return jsonify({'erreur': f'Erreur lors de l\'ajout de l\'image: {str(e)}'}), 500
 
 @app.route('/api/images/<int:image_id>', methods=['GET'])
 def obtenir_image_info(image_id):
     """Obtenir les informations d'une image (sans les données blob)"""
-    image = Image.query.get_or_404(image_id)
+    image = Image.query.with_entities(*COLONNES_METADONNEES_IMAGE).filter(Image.id == image_id).first_or_404()
+    if image.statut == 'traitement' and expirer_images_en_traitement(image_id):
+        db.session.commit()
+        image = Image.query.with_entities(*COLONNES_METADONNEES_IMAGE).filter(Image.id == image_id).one()
     
-    return jsonify({
-        'id': image.id,
-        'uuid': image.uuid,
-        'nom_fichier': image.nom_fichier,
-        'type_mime': image.type_mime,
-        'taille': image.taille,
-        'largeur': image.largeur,
-        'hauteur': image.hauteur,
-        'date_creation': image.date_creation.isoformat(),
-        'utilisateur_id': image.utilisateur_id,
-        'repas_id': image.repas_id,
-        'symptome_id': image.symptome_id
-    })
+    return jsonify(SERIALISEUR_IMAGE(image))
 
 @app.route('/api/images/<int:image_id>/blob', methods=['GET'])
 def obtenir_image_blob(image_id):
     """Obtenir les données blob d'une image"""
     image = Image.query.get_or_404(image_id)
     
-    return send_file(
-        io.BytesIO(image.donnees_blob),
-        mimetype=image.type_mime,
-        as_attachment=False,
-        download_name=image.nom_fichier
-    )
+    return reponse_image(image)
 
 @app.route('/api/images/uuid/<uuid_str>', methods=['GET'])
 def obtenir_image_par_uuid(uuid_str):
     """Obtenir une image par son UUID"""
     image = Image.query.filter_by(uuid=uuid_str).first_or_404()
     
-    return send_file(
-        io.BytesIO(image.donnees_blob),
-        mimetype=image.type_mime,
-        as_attachment=False,
-        download_name=image.nom_fichier
-    )
+    return reponse_image(image)
 
 @app.route('/api/images/<int:image_id>/base64', methods=['GET'])
 def obtenir_image_base64(image_id):
     """Obtenir une image en format base64"""
     image = Image.query.get_or_404(image_id)
+    if (image.statut or 'pret') != 'pret':
+        return jsonify({'erreur': 'Image pas encore disponible', 'statut': image.statut}), 409
     
-    image_base64 = base64.b64encode(image.donnees_blob).decode('utf-8')
+    image_base64 = base64.b64encode(stockage_de(image).lire(image)).decode('utf-8')
     
-    return jsonify({
-        'id': image.id,
-        'uuid': image.uuid,
-        'nom_fichier': image.nom_fichier,
-        'type_mime': image.type_mime,
-        'donnees_base64': image_base64,
-        'taille': image.taille,
-        'largeur': image.largeur,
-        'hauteur': image.hauteur
-    })
+    return jsonify(dict(SERIALISEUR_IMAGE_BASE64(image), donnees_base64=image_base64))
 
 @app.route('/api/images/<int:image_id>', methods=['DELETE'])
 def supprimer_image(image_id):
     """Supprimer une image"""
+    verrouiller_ecritures()  # Avant toute lecture : la vérification des fichiers partagés en dépend
     image = Image.query.get_or_404(image_id)
     
+    for utilisateur_id in utilisateurs_concernes_image(image):
+        incrementer_version(cle_version_utilisateur(utilisateur_id))
+    derivees = list(image.derivees)
     db.session.delete(image)
+    db.session.flush()
+    for contenu in [image] + derivees:
+        stockage_de(contenu).supprimer(contenu)
     db.session.commit()
     
     return jsonify({'message': f'Image "{image.nom_fichier}" supprimée avec succès'}), 200
 
 @app.route('/api/images/utilisateur/<int:utilisateur_id>', methods=['GET'])
+@lecture_replica
 def lister_images_utilisateur(utilisateur_id):
     """Lister les images d'un utilisateur"""
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
     
-    images_pagines = Image.query.filter_by(utilisateur_id=utilisateur_id).order_by(
-        Image.date_creation.desc()
-    ).paginate(page=page, per_page=per_page, error_out=False)
-    
-    return jsonify({
-        'images': [{
-            'id': img.id,
-            'uuid': img.uuid,
-            'nom_fichier': img.nom_fichier,
-            'type_mime': img.type_mime,
-            'taille': img.taille,
-            'largeur': img.largeur,
-            'hauteur': img.hauteur,
-            'date_creation': img.date_creation.isoformat(),
-            'repas_id': img.repas_id,
-            'symptome_id': img.symptome_id
-        } for img in images_pagines.items],
-        'pagination': {
+    query = Image.query.with_entities(*COLONNES_METADONNEES_IMAGE).filter_by(utilisateur_id=utilisateur_id)
+    if 'cursor' in request.args:
+        try:
+            images, pagination = paginer_par_curseur(query, Image.date_creation, Image.id)
+        except ValueError as e:
+            return jsonify({'erreur': str(e)}), 400
+    else:
+        images_pagines = query.order_by(
+            Image.date_creation.desc()
+        ).paginate(page=page, per_page=per_page, error_out=False)
+        images = images_pagines.items
+        pagination = {
             'page': page,
             'pages': images_pagines.pages,
             'per_page': per_page,
             'total': images_pagines.total
         }
+    
+    return jsonify({
+        'images': SERIALISEUR_IMAGE_UTILISATEUR.liste(images),
+        'pagination': pagination
     })
 
 @app.route('/api/images/repas/<int:repas_id>', methods=['GET'])
 def lister_images_repas(repas_id):
     """Lister les images d'un repas"""
-    images = Image.query.filter_by(repas_id=repas_id).order_by(Image.date_creation.desc()).all()
+    images = Image.query.with_entities(*COLONNES_METADONNEES_IMAGE).filter_by(repas_id=repas_id).order_by(
+        Image.date_creation.desc()
+    ).all()
     
     return jsonify({
-        'images': [{
-            'id': img.id,
-            'uuid': img.uuid,
-            'nom_fichier': img.nom_fichier,
-            'type_mime': img.type_mime,
-            'taille': img.taille,
-            'largeur': img.largeur,
-            'hauteur': img.hauteur,
-            'date_creation': img.date_creation.isoformat()
-        } for img in images]
+        'images': SERIALISEUR_IMAGE_METADONNEES.liste(images)
     })
 
 @app.route('/api/images/symptome/<int:symptome_id>', methods=['GET'])
 def lister_images_symptome(symptome_id):
     """Lister les images d'un symptôme"""
-    images = Image.query.filter_by(symptome_id=symptome_id).order_by(Image.date_creation.desc()).all()
+    images = Image.query.with_entities(*COLONNES_METADONNEES_IMAGE).filter_by(symptome_id=symptome_id).order_by(
+        Image.date_creation.desc()
+    ).all()
     
     return jsonify({
-        'images': [{
-            'id': img.id,
-            'uuid': img.uuid,
-            'nom_fichier': img.nom_fichier,
-            'type_mime': img.type_mime,
-            'taille': img.taille,
-            'largeur': img.largeur,
-            'hauteur': img.hauteur,
-            'date_creation': img.date_creation.isoformat()
-        } for img in images]
+        'images': SERIALISEUR_IMAGE_METADONNEES.liste(images)
     })
 
 # Routes d'analyse
 @app.route('/api/analyse/<int:utilisateur_id>', methods=['GET'])
+@lecture_replica
 def analyser_allergies(utilisateur_id):
     """Analyser les allergies potentielles d'un utilisateur"""
     # Vérifier que l'utilisateur existe
@@ -751,12 +3588,67 @@ def analyser_allergies(utilisateur_id):
     if not utilisateur:
         return jsonify({'erreur': 'Utilisateur non trouvé'}), 404
     
-    # Générer le rapport d'analyse
-    rapport = analyseur.generer_rapport(utilisateur_id)
+    # Générer le rapport d'analyse (ou le relire depuis le cache)
+    rapport = obtenir_rapport_analyse(utilisateur_id)
     
     return jsonify(rapport)
 
+@app.route('/api/analyse/<int:utilisateur_id>/jobs', methods=['POST'])
+def creer_tache_analyse(utilisateur_id):
+    """Lancer la génération asynchrone d'un rapport d'analyse"""
+    utilisateur = Utilisateur.query.get(utilisateur_id)
+    if not utilisateur:
+        return jsonify({'erreur': 'Utilisateur non trouvé'}), 404
+    
+    purger_taches()
+    expirer_taches(utilisateur_id)
+    
+    # Une seule tâche en cours par utilisateur
+    tache = TacheAsynchrone.query.filter(
+        TacheAsynchrone.type_tache == 'rapport_analyse',
+        TacheAsynchrone.utilisateur_id == utilisateur_id,
+        TacheAsynchrone.statut.in_(['en_attente', 'en_cours'])
+    ).first()
+    if tache:
+        donnees = tache_en_json(tache)
+        db.session.commit()
+        return jsonify(donnees), 202
+    
+    tache = TacheAsynchrone(type_tache='rapport_analyse', utilisateur_id=utilisateur_id)
+    
+    # Rapport déjà en cache : la tâche est terminée immédiatement
+    cache = db.session.get(CacheRapport, utilisateur_id)
+    if cache and cache.version == lire_version(cle_version_utilisateur(utilisateur_id)):
+        tache.statut = 'termine'
+        tache.resultat = cache.rapport
+        tache.date_debut = tache.date_fin = datetime.utcnow()
+    
+    db.session.add(tache)
+    db.session.flush()
+    tache_id, donnees = tache.id, tache_en_json(tache)
+    db.session.commit()
+    
+    # Réponse construite avant le commit : relire la tâche ouvrirait ici une transaction d'écriture
+    # (BEGIN IMMEDIATE) qui ferait attendre le worker jusqu'à la fin de la requête
+    if donnees['statut'] == 'en_attente':
+        soumettre_tache(tache_id)
+        if current_app.config['ANALYSE_TACHES_WORKERS'] <= 0:
+            donnees = tache_en_json(db.session.get(TacheAsynchrone, tache_id))
+    
+    return jsonify(donnees), 202
+
+@app.route('/api/analyse/<int:utilisateur_id>/jobs/<tache_id>', methods=['GET'])
+def obtenir_tache_analyse(utilisateur_id, tache_id):
+    """Obtenir le statut ou le résultat d'une tâche d'analyse"""
+    tache = TacheAsynchrone.query.filter_by(id=tache_id, utilisateur_id=utilisateur_id).first_or_404()
+    if tache.statut in ('en_attente', 'en_cours') and (tache.date_debut or tache.date_creation) < limite_taches_actives():
+        expirer_taches(utilisateur_id)
+        db.session.commit()
+        db.session.refresh(tache)
+    return jsonify(tache_en_json(tache))
+
 @app.route('/api/score-risque/<int:utilisateur_id>/<aliment>', methods=['GET'])
+@lecture_replica
 def calculer_score_aliment(utilisateur_id, aliment):
     """Calculer le score de risque pour un aliment spécifique"""
     # Vérifier que l'utilisateur existe
@@ -764,7 +3656,10 @@ def calculer_score_aliment(utilisateur_id, aliment):
     if not utilisateur:
         return jsonify({'erreur': 'Utilisateur non trouvé'}), 404
     
-    score = analyseur.calculer_score_risque(utilisateur_id, aliment)
+    try:
+        score = analyseur.calculer_score_risque(utilisateur_id, aliment, request.args.get('backend'))
+    except ValueError as e:
+        return jsonify({'erreur': str(e)}), 400
     
     return jsonify({
         'aliment': aliment,
@@ -774,72 +3669,91 @@ def calculer_score_aliment(utilisateur_id, aliment):
     })
 
 @app.route('/api/dashboard/<int:utilisateur_id>', methods=['GET'])
+@lecture_replica(catalogue=True)
 def dashboard_utilisateur(utilisateur_id):
-    """Dashboard complet pour un utilisateur"""
+    """Dashboard complet pour un utilisateur (réponse en cache, ETag et 304)"""
     # Vérifier que l'utilisateur existe
     utilisateur = Utilisateur.query.get(utilisateur_id)
     if not utilisateur:
         return jsonify({'erreur': 'Utilisateur non trouvé'}), 404
     
+    # La réponse ne dépend que des données de l'utilisateur, du catalogue et de la
+    # période courante (fenêtre glissante des statistiques nutritionnelles)
+    periode = current_app.config['DASHBOARD_CACHE_PERIODE']
+    debut_periode = int(time.time()) // periode * periode
+    cle = (
+        f"{utilisateur_id}:{lire_version(cle_version_utilisateur(utilisateur_id))}:"
+        f"{lire_version(CLE_VERSION_CATALOGUE)}:{debut_periode}"
+    )
+    etag = hashlib.sha1(cle.encode('utf-8')).hexdigest()
+    
+    if request.if_none_match.contains(etag):
+        reponse = current_app.response_class(status=304)
+    else:
+        corps = cache_dashboard.obtenir(etag)
+        if corps is None:
+            corps = construire_dashboard(utilisateur, datetime.utcfromtimestamp(debut_periode)).get_data()
+            cache_dashboard.enregistrer(etag, corps, current_app.config['DASHBOARD_CACHE_TAILLE'])
+        reponse = current_app.response_class(corps, mimetype='application/json')
+    
+    reponse.set_etag(etag)
+    reponse.headers['Cache-Control'] = 'private, no-cache'
+    return reponse
+
+def construire_dashboard(utilisateur, maintenant):
+    """Calcule la réponse du dashboard"""
+    utilisateur_id = utilisateur.id
+    
+    # Analyse des allergies (en premier : sa mise en cache valide la session et expirerait les lignes chargées)
+    rapport_allergies = obtenir_rapport_analyse(utilisateur_id)
+    
     # Statistiques de base
     total_repas = Repas.query.filter_by(utilisateur_id=utilisateur_id).count()
     total_symptomes = Symptome.query.filter_by(utilisateur_id=utilisateur_id).count()
-    total_images = Image.query.filter_by(utilisateur_id=utilisateur_id).count()
+    total_images = db.session.query(db.func.count(Image.id)).filter(Image.utilisateur_id == utilisateur_id).scalar()
     
     # Derniers repas
-    derniers_repas = Repas.query.filter_by(utilisateur_id=utilisateur_id).order_by(
+    derniers_repas = Repas.query.options(db.undefer(Repas.nb_images)).filter_by(utilisateur_id=utilisateur_id).order_by(
         Repas.date_heure.desc()
     ).limit(5).all()
     
     # Derniers symptômes
-    derniers_symptomes = Symptome.query.filter_by(utilisateur_id=utilisateur_id).order_by(
+    derniers_symptomes = Symptome.query.options(db.undefer(Symptome.nb_images)).filter_by(utilisateur_id=utilisateur_id).order_by(
         Symptome.date_heure.desc()
     ).limit(5).all()
     
-    # Analyse des allergies
-    rapport_allergies = analyseur.generer_rapport(utilisateur_id)
-    
     # Statistiques nutritionnelles (basées sur les aliments consommés)
-    stats_nutritionnelles = calculer_stats_nutritionnelles(utilisateur_id)
+    stats_nutritionnelles = calculer_stats_nutritionnelles(utilisateur_id, maintenant)
     
     return jsonify({
-        'utilisateur': {
-            'id': utilisateur.id,
-            'nom': utilisateur.nom,
-            'email': utilisateur.email
-        },
+        'utilisateur': SERIALISEUR_UTILISATEUR_RESUME(utilisateur),
         'statistiques': {
             'total_repas': total_repas,
             'total_symptomes': total_symptomes,
             'total_images': total_images
         },
-        'derniers_repas': [{
-            'id': r.id,
-            'date_heure': r.date_heure.isoformat(),
-            'aliments': json.loads(r.aliments),
-            'description': r.description,
-            'nb_images': len(r.images)
-        } for r in derniers_repas],
-        'derniers_symptomes': [{
-            'id': s.id,
-            'date_heure': s.date_heure.isoformat(),
-            'type_symptome': s.type_symptome,
-            'severite': s.severite,
-            'description': s.description,
-            'nb_images': len(s.images)
-        } for s in derniers_symptomes],
+        'derniers_repas': SERIALISEUR_REPAS_LISTE.liste(derniers_repas),
+        'derniers_symptomes': SERIALISEUR_SYMPTOME_LISTE.liste(derniers_symptomes),
         'analyse_allergies': rapport_allergies,
         'stats_nutritionnelles': stats_nutritionnelles
     })
 
-def calculer_stats_nutritionnelles(utilisateur_id):
+def calculer_stats_nutritionnelles(utilisateur_id, maintenant=None):
     """Calculer les statistiques nutritionnelles d'un utilisateur"""
     # Récupérer les repas des 7 derniers jours
-    date_limite = datetime.utcnow() - timedelta(days=7)
-    repas_recents = Repas.query.filter(
+    date_limite = (maintenant or datetime.utcnow()) - timedelta(days=7)
+    lignes = db.session.query(
+        Repas.date_heure,
+        RepasAliment.quantite,
+        RepasAliment.aliment_id
+    ).outerjoin(
+        RepasAliment, RepasAliment.repas_id == Repas.id
+    ).filter(
         Repas.utilisateur_id == utilisateur_id,
         Repas.date_heure >= date_limite
-    ).all()
+    )
+    # Nutriments lus dans l'index en mémoire, sans requête par aliment
+    nutriments_par_id = catalogue_nutriments.actualiser().par_id
     
     total_calories = 0
     total_proteines = 0
@@ -848,31 +3762,23 @@ def calculer_stats_nutritionnelles(utilisateur_id):
     total_fibres = 0
     jours_avec_repas = set()
     
-    for repas in repas_recents:
-        jours_avec_repas.add(repas.date_heure.date())
-        try:
-            aliments_repas = json.loads(repas.aliments)
-            for aliment_data in aliments_repas:
-                if isinstance(aliment_data, dict):
-                    nom_aliment = aliment_data.get('nom', '')
-                    quantite = aliment_data.get('quantite', 100)  # en grammes
-                    
-                    # Rechercher l'aliment dans la base
-                    aliment = Aliment.query.filter_by(nom=nom_aliment).first()
-                    if aliment:
-                        facteur = quantite / 100  # Facteur de conversion pour 100g
-                        if aliment.calories_pour_100g:
-                            total_calories += aliment.calories_pour_100g * facteur
-                        if aliment.proteines_pour_100g:
-                            total_proteines += aliment.proteines_pour_100g * facteur
-                        if aliment.glucides_pour_100g:
-                            total_glucides += aliment.glucides_pour_100g * facteur
-                        if aliment.lipides_pour_100g:
-                            total_lipides += aliment.lipides_pour_100g * facteur
-                        if aliment.fibres_pour_100g:
-                            total_fibres += aliment.fibres_pour_100g * facteur
-        except:
+    for date_heure, quantite, aliment_id in lignes:
+        jours_avec_repas.add(date_heure.date())
+        nutriments = nutriments_par_id.get(aliment_id)
+        if nutriments is None:
             continue
+        calories, proteines, glucides, lipides, fibres = nutriments
+        facteur = (quantite if quantite is not None else 100) / 100  # Facteur de conversion pour 100g
+        if calories:
+            total_calories += calories * facteur
+        if proteines:
+            total_proteines += proteines * facteur
+        if glucides:
+            total_glucides += glucides * facteur
+        if lipides:
+            total_lipides += lipides * facteur
+        if fibres:
+            total_fibres += fibres * facteur
     
     nb_jours = len(jours_avec_repas) or 1  # Éviter la division par zéro
     
@@ -901,7 +3807,7 @@ def health_check():
     """Vérification de l'état de l'API"""
     # Vérifier la connexion à la base de données
     try:
-        db.session.execute('SELECT 1')
+        db.session.execute(db.text('SELECT 1'))
         db_status = 'OK'
     except:
         db_status = 'ERROR'
@@ -922,6 +3828,7 @@ def health_check():
     })
 
 @app.route('/api/stats', methods=['GET'])
+@lecture_replica
 def statistiques_globales():
     """Statistiques globales de l'application"""
     return jsonify({
@@ -929,10 +3836,169 @@ def statistiques_globales():
         'aliments': Aliment.query.count(),
         'repas': Repas.query.count(),
         'symptomes': Symptome.query.count(),
-        'images': Image.query.count(),
-        'taille_totale_images': db.session.query(db.func.sum(Image.taille)).scalar() or 0
+        'images': db.session.query(db.func.count(Image.id)).scalar(),
+        'taille_totale_images': db.session.query(db.func.sum(Image.taille)).scalar() or 0,
+        'cache_dashboard': cache_dashboard.statistiques(),
+        'traitement_images': pool_images.statistiques(),
+        'checkpoints_wal': points_de_controle_wal.statistiques(),
+        'replica': routage_lecture.statistiques(),
+        'derivees_images': dict(
+            statistiques_derivees.statistiques(),
+            nombre=db.session.query(db.func.count(DeriveeImage.id)).scalar(),
+            taille_totale=db.session.query(db.func.sum(DeriveeImage.taille)).scalar() or 0
+        )
     })
 
+# Connexions SQLite : PRAGMA, transactions d'écriture et checkpoints du journal WAL
+MODES_JOURNAL_SQLITE = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+MODES_SYNCHRONOUS_SQLITE = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+@db.event.listens_for(Engine, 'connect')
+def configurer_connexion_sqlite(connexion_dbapi, enregistrement):
+    """Applique les PRAGMA configurés à chaque nouvelle connexion SQLite"""
+    if not isinstance(connexion_dbapi, sqlite3.Connection):
+        return
+    config = app.config
+    journal = config['SQLITE_JOURNAL_MODE'].upper()
+    synchronous = config['SQLITE_SYNCHRONOUS'].upper()
+    if journal not in MODES_JOURNAL_SQLITE or synchronous not in MODES_SYNCHRONOUS_SQLITE:
+        raise ValueError(f'SQLITE_JOURNAL_MODE ou SQLITE_SYNCHRONOUS invalide : {journal}, {synchronous}')
+    
+    # Les transactions sont ouvertes par debuter_transaction_sqlite, pas par le pilote
+    connexion_dbapi.isolation_level = None
+    curseur = connexion_dbapi.cursor()
+    curseur.execute(f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT'])}")
+    curseur.execute(f'PRAGMA journal_mode = {journal}')
+    curseur.execute(f'PRAGMA synchronous = {synchronous}')
+    curseur.execute(f"PRAGMA cache_size = {int(config['SQLITE_CACHE_SIZE'])}")
+    curseur.execute(f"PRAGMA mmap_size = {int(config['SQLITE_MMAP_SIZE'])}")
+    curseur.close()
+
+@db.event.listens_for(Engine, 'begin')
+def debuter_transaction_sqlite(connexion):
+    """Ouvre les transactions SQLite. Celles des requêtes d'écriture (POST, PUT, DELETE...), et celles
+    demandées par verrouiller_ecritures, prennent le verrou d'écriture dès le début (BEGIN IMMEDIATE) :
+    un conflit attend busy_timeout au lieu d'échouer immédiatement en « database is locked » quand la
+    transaction passe de la lecture à l'écriture."""
+    if connexion.dialect.name != 'sqlite' or connexion.get_execution_options().get('isolation_level') == 'AUTOCOMMIT':
+        return
+    connexion_dbapi = connexion.connection.driver_connection
+    # Une seule connexion à la fois prend le verrou dans la requête : une autre (inspection du
+    # schéma...) ouverte pendant la transaction d'écriture se contente de lire
+    immediate = connexion.get_execution_options().get('ecriture_immediate') or (
+        app.config['SQLITE_ECRITURE_IMMEDIATE'] and has_request_context()
+        and request.method not in ('GET', 'HEAD', 'OPTIONS') and g.get('connexion_ecriture') is None
+    )
+    connexion_dbapi.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+    connexion.info['ecriture_immediate'] = immediate
+    if immediate and has_request_context():
+        g.connexion_ecriture = connexion_dbapi
+
+@db.event.listens_for(Engine, 'commit')
+@db.event.listens_for(Engine, 'rollback')
+def terminer_transaction_sqlite(connexion):
+    if has_request_context() and g.get('connexion_ecriture') is connexion.connection.driver_connection:
+        g.connexion_ecriture = None
+
+def verrouiller_ecritures():
+    """Prend pour la transaction de la session le verrou d'écriture de la base SQLite, dès son début.
+    
+    La transaction est ouverte en BEGIN IMMEDIATE (comme celles des requêtes POST, PUT, DELETE) :
+    elle est sérialisée avec tous les autres écrivains de la base, et pas seulement avec ceux qui
+    touchent les mêmes lignes, jusqu'à son commit ou son rollback. À appeler avant toute lecture :
+    une transaction déjà ouverte en lecture ne peut pas prendre ce verrou sans écrire
+    (RuntimeError). Sans effet sous PostgreSQL.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    options = {} if db.session().in_transaction() else {'execution_options': {'ecriture_immediate': True}}
+    connexion = db.session.connection(bind_arguments={'bind': db.engine}, **options)
+    if not connexion.info.get('ecriture_immediate'):
+        raise RuntimeError("Transaction SQLite déjà ouverte en lecture : verrou d'écriture impossible")
+
+class PointsDeControleWal:
+    """Checkpoints périodiques du journal WAL dans un thread du processus, hors du chemin des requêtes.
+    
+    Un checkpoint PASSIVE n'attend personne ; au-delà de SQLITE_WAL_TAILLE_MAX, un checkpoint
+    TRUNCATE ramène le fichier -wal à zéro.
+    """
+    def __init__(self):
+        self._verrou = threading.Lock()
+        self._thread = None
+        self.nb_checkpoints = 0
+        self.dernier = None
+    
+    def demarrer(self, application):
+        periode = application.config['SQLITE_CHECKPOINT_PERIODE']
+        if periode <= 0 or not application.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+            return
+        with self._verrou:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._boucle, args=(application, periode), name='checkpoints-wal', daemon=True
+            )
+            self._thread.start()
+    
+    def executer(self, mode=None):
+        """Exécute un checkpoint (mode choisi selon la taille du journal par défaut), retourne son résultat"""
+        chemin_wal = f'{db.engine.url.database}-wal'
+        taille_wal = os.path.getsize(chemin_wal) if os.path.exists(chemin_wal) else 0
+        mode = mode or ('TRUNCATE' if taille_wal > current_app.config['SQLITE_WAL_TAILLE_MAX'] else 'PASSIVE')
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connexion:
+            bloque, pages_journal, pages_copiees = connexion.exec_driver_sql(f'PRAGMA wal_checkpoint({mode})').one()
+        resultat = {
+            'mode': mode,
+            'bloque': bool(bloque),
+            'taille_wal_avant': taille_wal,
+            'pages_journal': pages_journal,
+            'pages_copiees': pages_copiees,
+            'date': datetime.utcnow().isoformat()
+        }
+        with self._verrou:
+            self.nb_checkpoints += 1
+            self.dernier = resultat
+        return resultat
+    
+    def _boucle(self, application, periode):
+        while True:
+            time.sleep(periode)
+            with application.app_context():
+                try:
+                    self.executer()
+                except Exception:
+                    application.logger.exception('Échec du checkpoint WAL')
+    
+    def statistiques(self):
+        with self._verrou:
+            return {'actif': self._thread is not None, 'checkpoints': self.nb_checkpoints, 'dernier': self.dernier}
+
+points_de_controle_wal = PointsDeControleWal()
+
+# Budget de requêtes SQL (mode debug)
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def compter_requete_sql(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.nb_requetes_sql = g.get('nb_requetes_sql', 0) + 1
+
+@app.after_request
+def verifier_budget_requetes(reponse):
+    """En debug, signale les requêtes HTTP qui exécutent plus de REQUETES_BUDGET requêtes SQL"""
+    if not (current_app.debug or current_app.testing):
+        return reponse
+    nb_requetes = g.get('nb_requetes_sql', 0)
+    reponse.headers['X-Requetes-SQL'] = str(nb_requetes)
+    budget = current_app.config['REQUETES_BUDGET']
+    if nb_requetes <= budget:
+        return reponse
+    message = f'{request.method} {request.path}: {nb_requetes} requêtes SQL (budget {budget})'
+    if current_app.config['REQUETES_BUDGET_STRICT']:
+        reponse = jsonify({'erreur': f'Budget de requêtes SQL dépassé - {message}'})
+        reponse.status_code = 500
+        return reponse
+    current_app.logger.warning('Budget de requêtes SQL dépassé - %s', message)
+    return reponse
+
 # Gestion des erreurs
 @app.errorhandler(404)
 def not_found(error):
@@ -942,6 +4008,15 @@ def not_found(error):
 def bad_request(error):
     return jsonify({'erreur': 'Requête invalide'}), 400
 
+@app.errorhandler(413)
+def request_entity_too_large(error):
+    return jsonify({'erreur': f"Fichier trop volumineux (maximum {current_app.config['IMAGES_TAILLE_MAX']} octets)"}), 413
+
+@app.errorhandler(DonneesImageIntrouvables)
+def donnees_image_introuvables(erreur):
+    db.session.rollback()
+    return jsonify({'erreur': "Données de l'image introuvables"}), 410
+
 @app.errorhandler(500)
 def internal_error(error):
     db.session.rollback()
@@ -950,12 +4025,11 @@ def internal_error(error):
 # Initialisation de la base de données
 def init_database():
     """Initialise la base de données avec des données de base"""
-    db.create_all()
+    preparer_base()
     
     # Ajouter quelques aliments de base s'ils n'existent pas
     if Aliment.query.count() == 0:
         aliments_base = [
-           [
   {
     "nom": "Biryani de poulet",
     "ingredients": ["riz basmati", "poulet", "yaourt", "oignons", "garam masala", "safran", "ghee", "menthe", "coriandre"],
@@ -1011,7 +4085,6 @@ def init_database():
     "fibres_pour_100g": 0.8,
     "categorie": "Grillades"
   }
-]
         ]
         
         for aliment_data in aliments_base:
@@ -1047,8 +4120,8 @@ def ajouter_repas():
     date_heure = datetime.utcnow()
     if data.get('date_heure'):
         try:
-            date_heure = parser.parse(data['date_heure'])
-        except:
+            date_heure = analyser_date(data['date_heure'])
+        except ValueError:
             pass
     
     repas = Repas(
@@ -1059,40 +4132,41 @@ def ajouter_repas():
     )
     
     db.session.add(repas)
+    creer_lignes_repas(repas, data['aliments'])
+    analyseur.enregistrer_repas(repas)
+    incrementer_version(cle_version_utilisateur(repas.utilisateur_id))
     db.session.commit()
     
-    return jsonify({
-        'id': repas.id,
-        'utilisateur_id': repas.utilisateur_id,
-        'date_heure': repas.date_heure.isoformat(),
-        'aliments': json.loads(repas.aliments),
-        'description': repas.description
-    }), 201
+    return jsonify(SERIALISEUR_REPAS.avec('utilisateur_id')(repas)), 201
 
 @app.route('/api/repas/<int:utilisateur_id>', methods=['GET'])
+@lecture_replica
 def lister_repas(utilisateur_id):
     """Lister les repas d'un utilisateur"""
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
     
-    repas_pagines = Repas.query.filter_by(utilisateur_id=utilisateur_id).order_by(
-        Repas.date_heure.desc()
-    ).paginate(page=page, per_page=per_page, error_out=False)
-    
-    return jsonify({
-        'repas': [{
-            'id': r.id,
-            'date_heure': r.date_heure.isoformat(),
-            'aliments': json.loads(r.aliments),
-            'description': r.description,
-            'nb_images': len(r.images)
-        } for r in repas_pagines.items],
-        'pagination': {
+    query = Repas.query.options(db.undefer(Repas.nb_images)).filter_by(utilisateur_id=utilisateur_id)
+    if 'cursor' in request.args:
+        try:
+            repas, pagination = paginer_par_curseur(query, Repas.date_heure, Repas.id)
+        except ValueError as e:
+            return jsonify({'erreur': str(e)}), 400
+    else:
+        repas_pagines = query.order_by(
+            Repas.date_heure.desc()
+        ).paginate(page=page, per_page=per_page, error_out=False)
+        repas = repas_pagines.items
+        pagination = {
             'page': page,
             'pages': repas_pagines.pages,
             'per_page': per_page,
             'total': repas_pagines.total
         }
+    
+    return jsonify({
+        'repas': SERIALISEUR_REPAS_LISTE.liste(repas),
+        'pagination': pagination
     })
 
 # Routes pour les symptômes
@@ -1113,8 +4187,8 @@ def ajouter_symptome():
     date_heure = datetime.utcnow()
     if data.get('date_heure'):
         try:
-            date_heure = parser.parse(data['date_heure'])
-        except:
+            date_heure = analyser_date(data['date_heure'])
+        except ValueError:
             pass
     
     symptome = Symptome(
@@ -1126,43 +4200,184 @@ def ajouter_symptome():
     )
     
     db.session.add(symptome)
+    analyseur.enregistrer_symptome(symptome)
+    incrementer_version(cle_version_utilisateur(symptome.utilisateur_id))
     db.session.commit()
     
-    return jsonify({
-        'id': symptome.id,
-        'utilisateur_id': symptome.utilisateur_id,
-        'date_heure': symptome.date_heure.isoformat(),
-        'type_symptome': symptome.type_symptome,
-        'severite': symptome.severite,
-        'description': symptome.description
-    }), 201
+    return jsonify(SERIALISEUR_SYMPTOME.avec('utilisateur_id')(symptome)), 201
 
 @app.route('/api/symptomes/<int:utilisateur_id>', methods=['GET'])
+@lecture_replica
 def lister_symptomes(utilisateur_id):
     """Lister les symptômes d'un utilisateur"""
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
     
-    symptomes_pagines = Symptome.query.filter_by(utilisateur_id=utilisateur_id).order_by(
-        Symptome.date_heure.desc()
-    ).paginate(page=page, per_page=per_page, error_out=False)
-    
-    return jsonify({
-        'symptomes': [{
-            'id': s.id,
-            'date_heure': s.date_heure.isoformat(),
-            'type_symptome': s.type_symptome,
-            'severite': s.severite,
-            'description': s.description,
-            'nb_images': len(s.images)
-        } for s in symptomes_pagines.items],
-        'pagination': {
+    query = Symptome.query.options(db.undefer(Symptome.nb_images)).filter_by(utilisateur_id=utilisateur_id)
+    if 'cursor' in request.args:
+        try:
+            symptomes, pagination = paginer_par_curseur(query, Symptome.date_heure, Symptome.id)
+        except ValueError as e:
+            return jsonify({'erreur': str(e)}), 400
+    else:
+        symptomes_pagines = query.order_by(
+            Symptome.date_heure.desc()
+        ).paginate(page=page, per_page=per_page, error_out=False)
+        symptomes = symptomes_pagines.items
+        pagination = {
             'page': page,
             'pages': symptomes_pagines.pages,
             'per_page': per_page,
             'total': symptomes_pagines.total
         }
+    
+    return jsonify({
+        'symptomes': SERIALISEUR_SYMPTOME_LISTE.liste(symptomes),
+        'pagination': pagination
     })
+# Ingestion par lot (clients mobiles hors ligne)
+EVENEMENTS_LOT_MAX = 1000
+
+def valider_evenement(evenement):
+    """Colonnes du repas ou du symptôme décrit par un événement du lot ; ValueError s'il est invalide"""
+    if not isinstance(evenement, dict):
+        raise ValueError('objet attendu')
+    cle = evenement.get('cle')
+    if not isinstance(cle, str) or not 0 < len(cle) <= 64:
+        raise ValueError("cle d'idempotence requise (64 caractères max)")
+    date_heure = analyser_date(evenement['date_heure']) if evenement.get('date_heure') else datetime.utcnow()
+    
+    if evenement.get('type') == 'repas':
+        if not evenement.get('aliments'):
+            raise ValueError('aliments requis')
+        return {
+            'date_heure': date_heure,
+            'aliments': evenement['aliments'],
+            'description': evenement.get('description', '')
+        }
+    if evenement.get('type') == 'symptome':
+        if not evenement.get('type_symptome') or not evenement.get('severite'):
+            raise ValueError('type_symptome et severite requis')
+        try:
+            severite = int(evenement['severite'])
+        except (TypeError, ValueError):
+            raise ValueError('severite doit être un entier')
+        return {
+            'date_heure': date_heure,
+            'type_symptome': evenement['type_symptome'],
+            'severite': severite,
+            'description': evenement.get('description', '')
+        }
+    raise ValueError("type doit être 'repas' ou 'symptome'")
+
+def ingerer_evenements(utilisateur_id, evenements):
+    """Enregistre un lot d'événements dans une seule transaction, retourne un résultat par événement.
+    
+    Un événement dont la clé est déjà connue (même type, même utilisateur) n'est pas réinséré :
+    son résultat renvoie l'id existant avec le statut 'doublon'.
+    """
+    resultats = [{'index': index} for index in range(len(evenements))]
+    valides = []
+    for resultat, evenement in zip(resultats, evenements):
+        try:
+            colonnes = valider_evenement(evenement)
+        except ValueError as e:
+            if isinstance(evenement, dict) and isinstance(evenement.get('cle'), str):
+                resultat['cle'] = evenement['cle']
+            resultat.update(statut='erreur', erreur=str(e))
+            continue
+        resultat.update(type=evenement['type'], cle=evenement['cle'])
+        valides.append((resultat, colonnes))
+    
+    modeles = {'repas': Repas, 'symptome': Symptome}
+    connus = {
+        (type_evenement, cle): id_existant
+        for type_evenement, modele in modeles.items()
+        for cle, id_existant in db.session.query(modele.cle_client, modele.id).filter(
+            modele.utilisateur_id == utilisateur_id,
+            modele.cle_client.in_({r['cle'] for r, _ in valides if r['type'] == type_evenement})
+        )
+    }
+    ids_catalogue = ids_catalogue_par_nom(
+        nom
+        for resultat, colonnes in valides if resultat['type'] == 'repas'
+        for nom, _ in extraire_lignes_aliments(colonnes['aliments'])
+    )
+    
+    # Insertions groupées (executemany) ; les ids sont relus par clé, unique pour l'utilisateur
+    nouveaux = {'repas': {}, 'symptome': {}}
+    for resultat, colonnes in valides:
+        type_evenement, cle = resultat['type'], resultat['cle']
+        if (type_evenement, cle) in connus or cle in nouveaux[type_evenement]:
+            resultat['statut'] = 'doublon'
+            continue
+        nouveaux[type_evenement][cle] = colonnes
+        resultat['statut'] = 'cree'
+    
+    ids = dict(connus)
+    for type_evenement, lignes in nouveaux.items():
+        if not lignes:
+            continue
+        modele = modeles[type_evenement]
+        db.session.execute(db.insert(modele.__table__), [
+            dict(colonnes, utilisateur_id=utilisateur_id, cle_client=cle,
+                 **({'aliments': json.dumps(colonnes['aliments'])} if type_evenement == 'repas' else {}))
+            for cle, colonnes in lignes.items()
+        ])
+        for cle, id_cree in db.session.query(modele.cle_client, modele.id).filter(
+            modele.utilisateur_id == utilisateur_id,
+            modele.cle_client.in_(list(lignes))
+        ):
+            ids[(type_evenement, cle)] = id_cree
+    
+    lignes_repas = [
+        {'repas_id': ids[('repas', cle)], 'aliment_id': ids_catalogue.get(nom), 'nom': nom, 'quantite': quantite}
+        for cle, colonnes in nouveaux['repas'].items()
+        for nom, quantite in extraire_lignes_aliments(colonnes['aliments'])
+    ]
+    if lignes_repas:
+        db.session.execute(db.insert(RepasAliment.__table__), lignes_repas)
+    
+    if nouveaux['repas'] or nouveaux['symptome']:
+        # Un seul recalcul de la table d'exposition plutôt qu'une mise à jour par événement
+        analyseur.reconstruire_expositions(utilisateur_id)
+        incrementer_version(cle_version_utilisateur(utilisateur_id))
+    db.session.commit()
+    
+    for resultat, _ in valides:
+        resultat['id'] = ids[(resultat['type'], resultat['cle'])]
+    return resultats
+
+@app.route('/api/utilisateurs/<int:utilisateur_id>/evenements', methods=['POST'])
+def ingerer_evenements_route(utilisateur_id):
+    """Enregistrer en une requête un lot de repas et de symptômes saisis hors ligne"""
+    data = request.get_json()
+    evenements = data.get('evenements') if isinstance(data, dict) else None
+    if not isinstance(evenements, list) or not evenements:
+        return jsonify({'erreur': 'Liste evenements requise'}), 400
+    if len(evenements) > EVENEMENTS_LOT_MAX:
+        return jsonify({'erreur': f'{EVENEMENTS_LOT_MAX} événements maximum par lot'}), 413
+    
+    if not db.session.query(db.exists().where(Utilisateur.id == utilisateur_id)).scalar():
+        return jsonify({'erreur': 'Utilisateur non trouvé'}), 404
+    
+    try:
+        resultats = ingerer_evenements(utilisateur_id, evenements)
+    except IntegrityError:
+        # Même lot rejoué en parallèle : les clés insérées entre-temps ressortent en doublons
+        db.session.rollback()
+        resultats = ingerer_evenements(utilisateur_id, evenements)
+    
+    nb_par_statut = defaultdict(int)
+    for resultat in resultats:
+        nb_par_statut[resultat['statut']] += 1
+    return jsonify({
+        'resultats': resultats,
+        'crees': nb_par_statut['cree'],
+        'doublons': nb_par_statut['doublon'],
+        'erreurs': nb_par_statut['erreur']
+    }), 200
+
 # POUR LES PLANIFICATIONS ALIMENTAIRES
 @app.route('/api/plans-alimentaires', methods=['POST'])
 def creer_plan_alimentaire():
@@ -1187,6 +4402,7 @@ def creer_plan_alimentaire():
     )
     
     db.session.add(plan)
+    incrementer_version(cle_version_utilisateur(plan.utilisateur_id))
     db.session.commit()
     
     return jsonify({
@@ -1199,6 +4415,7 @@ def creer_plan_alimentaire():
     }), 201
 
 @app.route('/api/plans-alimentaires/<int:utilisateur_id>', methods=['GET'])
+@lecture_replica
 def obtenir_plans_alimentaires(utilisateur_id):
     """Obtenir tous les plans alimentaires d'un utilisateur"""
     actif_seulement = request.args.get('actif', 'false').lower() == 'true'
@@ -1208,6 +4425,7 @@ def obtenir_plans_alimentaires(utilisateur_id):
         query = query.filter_by(actif=True)
     
     plans = query.order_by(PlanAlimentaire.semaine_debut.desc()).all()
+    nombres_repas = compter_par(RepasPlanifie.plan_id, [plan.id for plan in plans])
     
     return jsonify([{
         'id': plan.id,
@@ -1215,7 +4433,7 @@ def obtenir_plans_alimentaires(utilisateur_id):
         'semaine_debut': plan.semaine_debut.isoformat(),
         'actif': plan.actif,
         'date_creation': plan.date_creation.isoformat(),
-        'nombre_repas': len(plan.repas_planifies)
+        'nombre_repas': nombres_repas.get(plan.id, 0)
     } for plan in plans])
 
 @app.route('/api/plans-alimentaires/<int:plan_id>/repas', methods=['POST'])
@@ -1252,6 +4470,7 @@ def ajouter_repas_planifie(plan_id):
     )
     
     db.session.add(repas)
+    incrementer_version(cle_version_utilisateur(plan.utilisateur_id))
     db.session.commit()
     
     return jsonify({
@@ -1268,20 +4487,17 @@ def ajouter_repas_planifie(plan_id):
 def obtenir_planning_semaine(plan_id):
     """Obtenir le planning complet d'une semaine"""
     plan = PlanAlimentaire.query.get_or_404(plan_id)
-    repas = RepasPlanifie.query.filter_by(plan_id=plan_id).all()
+    repas = db.session.query(
+        RepasPlanifie.id, RepasPlanifie.jour_semaine, RepasPlanifie.type_repas,
+        RepasPlanifie.aliments_planifies.label('aliments'), RepasPlanifie.calories_estimees, RepasPlanifie.notes
+    ).filter(RepasPlanifie.plan_id == plan_id).all()
     
     # Organiser par jour et type de repas
     planning = defaultdict(lambda: defaultdict(list))
     noms_jours = ['Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche']
     
-    for repas_item in repas:
-        jour_nom = noms_jours[repas_item.jour_semaine]
-        planning[jour_nom][repas_item.type_repas].append({
-            'id': repas_item.id,
-            'aliments': json.loads(repas_item.aliments_planifies),
-            'calories_estimees': repas_item.calories_estimees,
-            'notes': repas_item.notes
-        })
+    for repas_item, donnees in zip(repas, SERIALISEUR_REPAS_PLANIFIE.liste(repas)):
+        planning[noms_jours[repas_item.jour_semaine]][repas_item.type_repas].append(donnees)
     
     return jsonify({
         'plan': {
@@ -1380,6 +4596,7 @@ def creer_buffet():
     )
     
     db.session.add(buffet)
+    incrementer_version(cle_version_utilisateur(buffet.utilisateur_id))
     db.session.commit()
     
     return jsonify({
@@ -1395,9 +4612,11 @@ def creer_buffet():
     }), 201
 
 @app.route('/api/buffets/<int:utilisateur_id>', methods=['GET'])
+@lecture_replica
 def obtenir_buffets_utilisateur(utilisateur_id):
     """Obtenir tous les buffets d'un utilisateur"""
     buffets = Buffet.query.filter_by(utilisateur_id=utilisateur_id).order_by(Buffet.date_evenement.desc()).all()
+    nombres_plats = compter_par(PlatBuffet.buffet_id, [buffet.id for buffet in buffets])
     
     return jsonify([{
         'id': buffet.id,
@@ -1407,7 +4626,7 @@ def obtenir_buffets_utilisateur(utilisateur_id):
         'budget_total': buffet.budget_total,
         'type_evenement': buffet.type_evenement,
         'statut': buffet.statut,
-        'nombre_plats': len(buffet.plats_buffet),
+        'nombre_plats': nombres_plats.get(buffet.id, 0),
         'date_creation': buffet.date_creation.isoformat()
     } for buffet in buffets])
 
@@ -1442,6 +4661,7 @@ def ajouter_plat_buffet(buffet_id):
     )
     
     db.session.add(plat)
+    incrementer_version(cle_version_utilisateur(buffet.utilisateur_id))
     db.session.commit()
     
     return jsonify({
@@ -1586,6 +4806,332 @@ def generer_planning_preparation(buffet_id):
         'recommandations': recommandations
     })
 
+# ==================== COMMANDES CLI ====================
+
+@app.cli.command('comparer-analyse')
+@click.option('--backend', type=click.Choice(['python', 'numpy']), default=None, help="Backend du nouveau moteur")
+def comparer_analyse(backend):
+    """Compare le moteur d'analyse par balayage avec l'ancien calcul aliment par aliment"""
+    nb_differences = 0
+    for (utilisateur_id,) in db.session.query(Utilisateur.id).order_by(Utilisateur.id):
+        attendu = {p['aliment']: (p['score_risque'], p['niveau_alerte'])
+                   for p in analyseur._detecter_patterns_naif(utilisateur_id)}
+        obtenu = {p['aliment']: (p['score_risque'], p['niveau_alerte'])
+                  for p in analyseur.detecter_patterns(utilisateur_id, backend)}
+        if attendu != obtenu:
+            nb_differences += 1
+            print(f"Utilisateur {utilisateur_id}: attendu={attendu} obtenu={obtenu}")
+    print(f"{nb_differences} utilisateur(s) avec des différences")
+    if nb_differences:
+        raise SystemExit(1)
+
+@app.cli.command('bench-analyse')
+@click.option('--tailles', default='1000,5000,20000,100000', show_default=True, help="Nombres de repas à tester")
+@click.option('--aliments', 'nb_aliments', default=500, show_default=True, help="Taille du vocabulaire d'aliments")
+@click.option('--repetitions', default=3, show_default=True)
+def bench_analyse(tailles, nb_aliments, repetitions):
+    """Compare les backends python et numpy sur des historiques synthétiques"""
+    if np is None:
+        raise click.ClickException("numpy n'est pas installé")
+    generateur = random.Random(42)
+    vocabulaire = [f"aliment-{i:06d}" for i in range(nb_aliments)]
+    debut = datetime(2024, 1, 1)
+    print(f"{'repas':>8} {'symptomes':>10} {'python (ms)':>12} {'numpy (ms)':>11} {'gain':>6}")
+    for taille in (int(t) for t in tailles.split(',')):
+        repas = sorted(
+            (debut + timedelta(minutes=generateur.randrange(taille * 360)), generateur.sample(vocabulaire, 3))
+            for _ in range(taille)
+        )
+        dates_symptomes = sorted(
+            debut + timedelta(minutes=generateur.randrange(taille * 360)) for _ in range(taille // 10)
+        )
+        durees = {}
+        resultats = {}
+        for backend in analyseur.backends:
+            meilleur = float('inf')
+            for _ in range(repetitions):
+                t0 = time.perf_counter()
+                resultats[backend] = analyseur._compter_expositions(repas, dates_symptomes, backend=backend)
+                meilleur = min(meilleur, time.perf_counter() - t0)
+            durees[backend] = meilleur * 1000
+        if resultats['python'] != resultats['numpy']:
+            raise click.ClickException(f"Résultats différents pour {taille} repas")
+        print(f"{taille:>8} {len(dates_symptomes):>10} {durees['python']:>12.1f} {durees['numpy']:>11.1f} "
+              f"{durees['python'] / durees['numpy']:>5.1f}x")
+
+@app.cli.command('bench-serialisation')
+@click.option('--nombre', default=500, show_default=True, help="Nombre d'aliments de la réponse")
+@click.option('--repetitions', default=20, show_default=True)
+def bench_serialisation(nombre, repetitions):
+    """Compare la construction d'une liste d'aliments à la main (ancien chemin) et par sérialiseur,
+    encodée par le module json ou par orjson"""
+    generateur = random.Random(42)
+    maintenant = datetime.utcnow()
+    aliments = [Aliment(
+        id=i, nom=f"Aliment {i:06d}", categorie=generateur.choice(['fruit', 'légume', 'plat', 'boisson']),
+        ingredients=json.dumps([f"ingrédient {generateur.randrange(1000)}" for _ in range(6)]),
+        allergenes_courants=json.dumps(generateur.sample(['gluten', 'lait', 'oeuf', 'arachide', 'soja'], 2)),
+        calories_pour_100g=generateur.uniform(0, 900), proteines_pour_100g=generateur.uniform(0, 50),
+        glucides_pour_100g=generateur.uniform(0, 100), lipides_pour_100g=generateur.uniform(0, 100),
+        fibres_pour_100g=generateur.uniform(0, 30), date_creation=maintenant, date_modification=maintenant
+    ) for i in range(nombre)]
+    
+    def a_la_main(aliments):
+        return [{
+            'id': a.id,
+            'nom': a.nom,
+            'ingredients': json.loads(a.ingredients) if a.ingredients else [],
+            'allergenes_courants': json.loads(a.allergenes_courants) if a.allergenes_courants else [],
+            'calories_pour_100g': a.calories_pour_100g,
+            'proteines_pour_100g': a.proteines_pour_100g,
+            'glucides_pour_100g': a.glucides_pour_100g,
+            'lipides_pour_100g': a.lipides_pour_100g,
+            'fibres_pour_100g': a.fibres_pour_100g,
+            'categorie': a.categorie,
+            'date_creation': a.date_creation.isoformat(),
+            'date_modification': a.date_modification.isoformat()
+        } for a in aliments]
+    
+    chemins = [('à la main + json', a_la_main, DefaultJSONProvider(app)),
+               ('sérialiseur + json', SERIALISEUR_ALIMENT.liste, DefaultJSONProvider(app))]
+    if orjson is not None:
+        chemins.append(('sérialiseur + orjson', SERIALISEUR_ALIMENT.liste, FournisseurJsonOrjson(app)))
+    
+    reference = None
+    print(f"{'chemin':<22} {'dicts (ms)':>11} {'encodage (ms)':>14} {'total (ms)':>11} {'gain':>6}")
+    for nom, construire, encodeur in chemins:
+        meilleur_dicts = meilleur_total = float('inf')
+        for _ in range(repetitions):
+            t0 = time.perf_counter()
+            donnees = construire(aliments)
+            t1 = time.perf_counter()
+            corps = encodeur.response({'aliments': donnees}).get_data()
+            t2 = time.perf_counter()
+            meilleur_dicts, meilleur_total = min(meilleur_dicts, t1 - t0), min(meilleur_total, t2 - t0)
+        if reference is None:
+            reference, corps_reference = meilleur_total, corps
+        elif json.loads(corps) != json.loads(corps_reference):
+            raise click.ClickException(f"Réponse différente pour le chemin {nom}")
+        print(f"{nom:<22} {meilleur_dicts * 1000:>11.2f} {(meilleur_total - meilleur_dicts) * 1000:>14.2f} "
+              f"{meilleur_total * 1000:>11.2f} {reference / meilleur_total:>5.1f}x")
+
+@app.cli.command('migrer-repas-aliments')
+@click.option('--lot', 'taille_lot', default=500, show_default=True, help="Nombre de repas par transaction")
+def migrer_repas_aliments(taille_lot):
+    """Crée les lignes RepasAliment des repas enregistrés avant la table normalisée"""
+    db.create_all()
+    nb_repas = migrer_lignes_repas(taille_lot)
+    print(f"{nb_repas} repas migré(s)")
+
+@app.cli.command('importer-aliments')
+@click.argument('fichier', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format_import', type=click.Choice(['ndjson', 'csv']),
+              help="Format du fichier (déduit de l'extension par défaut)")
+@click.option('--lot', 'taille_lot', default=1000, show_default=True, help="Nombre d'aliments par transaction")
+def importer_aliments(fichier, format_import, taille_lot):
+    """Importe ou met à jour le catalogue d'aliments depuis un fichier NDJSON ou CSV"""
+    db.create_all()
+    format_import = format_import or ('csv' if fichier.lower().endswith('.csv') else 'ndjson')
+    with open(fichier, encoding='utf-8-sig', newline='' if format_import == 'csv' else None) as flux:
+        rapport = importer_catalogue(
+            flux, format_import, taille_lot,
+            progression=lambda r: print(f"\r{r['lignes']} ligne(s) lue(s)...", end='', flush=True)
+        )
+    print()
+    for erreur in rapport['erreurs']:
+        print(f"Ligne {erreur['ligne']} : {erreur['erreur']}")
+    if rapport['nb_erreurs'] > len(rapport['erreurs']):
+        print(f"... et {rapport['nb_erreurs'] - len(rapport['erreurs'])} autre(s) erreur(s)")
+    print(f"{rapport['lignes']} ligne(s) lue(s) : {rapport['crees']} aliment(s) créé(s), "
+          f"{rapport['mis_a_jour']} mis à jour, {rapport['nb_erreurs']} erreur(s) "
+          f"en {rapport['duree_secondes']} s ({rapport['lignes_par_seconde']} lignes/s)")
+
+@app.cli.command('migrer-schema')
+@click.option('--liste', is_flag=True, help="Afficher l'état des migrations sans rien appliquer")
+@click.option('--jusqua', type=int, help="Version maximale à appliquer")
+def migrer_schema_commande(liste, jusqua):
+    """Applique à la base (SQLite ou PostgreSQL) les migrations de schéma pas encore appliquées"""
+    if liste:
+        db.create_all()
+        appliquees = versions_schema_appliquees()
+        for etape in MIGRATIONS:
+            print(f"{'appliquée ' if etape.version in appliquees else 'en attente'}  {etape.version:>3}  {etape.description}")
+        return
+    nouvelles = migrer_schema(jusqua)
+    for etape in nouvelles:
+        print(f"Migration {etape.version} appliquée : {etape.description}")
+    print(f"{len(nouvelles)} migration(s) appliquée(s), schéma en version {max(versions_schema_appliquees(), default=0)}")
+
+@app.cli.command('verifier-index')
+def verifier_index():
+    """Vérifie par EXPLAIN que les requêtes fréquentes utilisent leur index"""
+    nb_echecs = 0
+    for description, query, index_attendu in requetes_critiques():
+        plan = plan_execution(query)
+        utilise = any(index_attendu in etape for etape in plan)
+        nb_echecs += not utilise
+        print(f"{'ok   ' if utilise else 'ÉCHEC'} {description} ({index_attendu})")
+        if not utilise:
+            for etape in plan:
+                print(f"      {etape}")
+    db.session.rollback()
+    if nb_echecs:
+        raise SystemExit(1)
+
+@app.cli.command('migrer-images')
+@click.option('--vers', 'destination', type=click.Choice(['fichiers', 'base']), default='fichiers', show_default=True,
+              help="Stockage de destination")
+@click.option('--lot', 'taille_lot', default=50, show_default=True, help="Nombre d'images par transaction")
+@click.option('--vacuum', is_flag=True, help="Compacter la base SQLite à la fin")
+def migrer_images(destination, taille_lot, vacuum):
+    """Déplace les données des images entre la base et le stockage sur disque, sans interruption"""
+    migrer_schema()
+    nb_images = deplacer_images(destination, taille_lot)
+    print(f"{nb_images} image(s) migrée(s) vers '{destination}'")
+    if vacuum and db.engine.dialect.name == 'sqlite':
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connexion:
+            connexion.execute(db.text('VACUUM'))
+        print("Base compactée")
+
+@app.cli.command('bench-suggestions')
+@click.option('--taille', default=100000, show_default=True, help="Nombre de noms du catalogue synthétique")
+@click.option('--requetes', 'nb_requetes', default=20000, show_default=True, help="Nombre de préfixes recherchés")
+@click.option('--limite', default=10, show_default=True, help="Suggestions par requête")
+def bench_suggestions(taille, nb_requetes, limite):
+    """Mesure la latence de l'index de suggestions sur un catalogue synthétique"""
+    generateur = random.Random(42)
+    mots = ['bœuf', 'poulet', 'riz', 'pâtes', 'épices', 'crème', 'fromage', 'salade', 'tarte', 'sauce',
+            'haché', 'rôti', 'grillé', 'aux', 'pommes', 'légumes', 'façon', 'maison', 'thaï', 'curry']
+    noms = [f"{' '.join(generateur.sample(mots, generateur.randint(1, 4)))} {i}" for i in range(taille)]
+    index = IndexSuggestions()
+    t0 = time.perf_counter()
+    index.construire(enumerate(noms))
+    print(f"Construction : {(time.perf_counter() - t0) * 1000:.0f} ms pour {len(index)} noms")
+    
+    prefixes = [normaliser_texte(generateur.choice(noms))[:generateur.randint(1, 8)] for _ in range(nb_requetes)]
+    durees = []
+    for prefixe in prefixes:
+        t0 = time.perf_counter()
+        index.suggerer(prefixe, limite)
+        durees.append((time.perf_counter() - t0) * 1e6)
+    durees.sort()
+    print(f"{nb_requetes} requêtes : médiane {durees[len(durees) // 2]:.1f} µs, "
+          f"p99 {durees[int(len(durees) * 0.99)]:.1f} µs, max {durees[-1]:.1f} µs")
+
+@app.cli.command('reindexer-aliments')
+def reindexer_aliments():
+    """Reconstruit l'index de recherche plein texte du catalogue"""
+    if not creer_index_recherche(reconstruire=True):
+        raise click.ClickException("Index plein texte indisponible (SQLite avec FTS5 requis)")
+    nb_indexes = db.session.execute(db.text('SELECT count(*) FROM aliment_recherche')).scalar()
+    print(f"{nb_indexes} aliment(s) indexé(s)")
+
+def routes_projections_images():
+    """Routes de liste et de métadonnées à contrôler, sur des images réellement liées à un
+    utilisateur, un repas et un symptôme ; None si la base n'en contient pas"""
+    def premier_id(colonne):
+        return db.session.query(colonne).filter(colonne.isnot(None)).order_by(colonne).limit(1).scalar()
+    
+    image_id, utilisateur_id = premier_id(Image.id), premier_id(Image.utilisateur_id)
+    repas_id, symptome_id = premier_id(Image.repas_id), premier_id(Image.symptome_id)
+    if None in (image_id, utilisateur_id, repas_id, symptome_id):
+        return None
+    return [
+        f'/api/images/{image_id}',
+        f'/api/images/utilisateur/{utilisateur_id}',
+        f'/api/images/repas/{repas_id}',
+        f'/api/images/symptome/{symptome_id}',
+        f'/api/repas/{utilisateur_id}',
+        f'/api/symptomes/{utilisateur_id}',
+        f'/api/dashboard/{utilisateur_id}',
+        f'/api/utilisateurs/{utilisateur_id}/export?images=true',
+    ]
+
+def controler_projections(routes):
+    """Appelle chaque route et retourne (route, statut, requêtes SQL, requêtes lisant donnees_blob)"""
+    requetes = []
+    
+    def enregistrer_requete(conn, cursor, statement, parameters, context, executemany):
+        requetes.append(statement)
+    
+    client = current_app.test_client()
+    resultats = []
+    db.event.listen(db.engine, 'before_cursor_execute', enregistrer_requete)
+    try:
+        for route in routes:
+            requetes.clear()
+            reponse = client.get(route)
+            reponse.get_data()  # Les réponses en flux lisent la base pendant leur parcours
+            fautives = [requete for requete in requetes if 'donnees_blob' in requete]
+            resultats.append((route, reponse.status_code, list(requetes), fautives))
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', enregistrer_requete)
+    return resultats
+
+@app.cli.command('verifier-projections')
+def verifier_projections():
+    """Vérifie que les routes de liste et de métadonnées ne lisent jamais les données des images"""
+    db.create_all()
+    routes = routes_projections_images()
+    if routes is None:
+        print("Aucune image liée à la fois à un utilisateur, un repas et un symptôme : rien à vérifier")
+        raise SystemExit(1)
+    echec = False
+    for route, statut, requetes, fautives in controler_projections(routes):
+        echec = echec or statut != 200 or bool(fautives)
+        print(f"{route}: {statut}, {len(requetes)} requête(s), {len(fautives)} lisant les données")
+        for requete in fautives:
+            print(f"    {' '.join(requete.split())}")
+    if echec:
+        raise SystemExit(1)
+
+@app.cli.command('reconstruire-expositions')
+@click.option('--utilisateur', 'utilisateur_id', type=int, help="Limiter à un utilisateur")
+@click.option('--backend', type=click.Choice(['python', 'numpy']), default=None, help="Backend de calcul")
+def reconstruire_expositions(utilisateur_id, backend):
+    """Reconstruit la table d'exposition à partir de l'historique complet"""
+    db.create_all()
+    if utilisateur_id:
+        utilisateurs = [utilisateur_id]
+    else:
+        utilisateurs = [uid for (uid,) in db.session.query(Utilisateur.id).order_by(Utilisateur.id)]
+    for uid in utilisateurs:
+        analyseur.reconstruire_expositions(uid, backend)
+        db.session.commit()
+    print(f"Table d'exposition reconstruite pour {len(utilisateurs)} utilisateur(s)")
+
+@app.cli.command('verifier-expositions')
+@click.option('--utilisateur', 'utilisateur_id', type=int, help="Limiter à un utilisateur")
+def verifier_expositions(utilisateur_id):
+    """Vérifie la table d'exposition contre un recalcul complet"""
+    if utilisateur_id:
+        utilisateurs = [utilisateur_id]
+    else:
+        utilisateurs = [uid for (uid,) in db.session.query(Utilisateur.id).order_by(Utilisateur.id)]
+    nb_incoherents = 0
+    for uid in utilisateurs:
+        ecarts = analyseur.verifier_expositions(uid)
+        if ecarts:
+            nb_incoherents += 1
+            for aliment, ecart in sorted(ecarts.items()):
+                print(f"Utilisateur {uid} - {aliment}: enregistré={ecart['enregistre']} attendu={ecart['attendu']}")
+    print(f"{nb_incoherents} utilisateur(s) incohérent(s) sur {len(utilisateurs)}")
+    if nb_incoherents:
+        raise SystemExit(1)
+
+def preparer_base():
+    """Met le schéma à jour avant de servir : migrations, index de recherche, tâches et images abandonnées"""
+    migrer_schema()
+    creer_index_recherche()
+    expirer_taches()
+    expirer_images_en_traitement()
+    db.session.commit()
+
+def demarrer_taches_de_fond():
+    """Tâches de fond propres à chaque processus servant l'application (worker gunicorn)"""
+    points_de_controle_wal.demarrer(app)
+    metriques.demarrer(app)
+
 if __name__ == '__main__':
     with app.app_context():
         init_database()
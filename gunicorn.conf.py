@@ -0,0 +1,44 @@
+# Configuration gunicorn (production) : gunicorn -c gunicorn.conf.py
+import multiprocessing
+import os
+import tempfile
+
+wsgi_app = 'app:app'
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Processus et threads par processus (worker gthread)
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+# Supérieur à IMAGES_TRAITEMENT_DELAI : un upload qui attend son traitement n'est pas tué
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))  # 0 = workers jamais recyclés
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Métriques des workers, additionnées par /metrics
+os.environ.setdefault('METRIQUES_DOSSIER', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'allergie-metriques'
+))
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+
+def on_starting(server):
+    """Migrations appliquées une seule fois, par le maître, avant le lancement des workers"""
+    from app import app, db, metriques, preparer_base
+    with app.app_context():
+        preparer_base()
+        db.engine.dispose()  # Aucune connexion ouverte ne doit être partagée par les workers
+    metriques.vider(app.config['METRIQUES_DOSSIER'])  # Les compteurs repartent de zéro avec le serveur
+
+
+def post_worker_init(worker):
+    """Tâches de fond de chaque worker, une fois l'application chargée"""
+    from app import demarrer_taches_de_fond
+    demarrer_taches_de_fond()
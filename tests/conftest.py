@@ -0,0 +1,70 @@
+"""Fixtures communes : l'application sur une base jetable.
+
+SQLite (fichier temporaire) par défaut ; avec TEST_DATABASE_URL=postgresql://..., la même suite
+tourne sur cette base PostgreSQL, qui doit être vide et réservée aux tests (ses tables sont
+supprimées au démarrage). La même base sert aussi de réplique, toujours à jour : les routes
+@lecture_replica passent par le routage des lectures.
+"""
+import os
+import tempfile
+import uuid
+
+import pytest
+
+DOSSIER_TESTS = tempfile.mkdtemp(prefix='allergie-tests-')
+
+# Configuration lue par app.py à l'import
+if os.environ.get('TEST_DATABASE_URL'):
+    os.environ['DATABASE_URL'] = os.environ['TEST_DATABASE_URL']
+    os.environ['DATABASE_REPLICA_URL'] = os.environ['TEST_DATABASE_URL']
+else:
+    os.environ.pop('DATABASE_URL', None)
+    os.environ['DATABASE_PATH'] = os.path.join(DOSSIER_TESTS, 'tests.db')
+    os.environ['DATABASE_REPLICA_URL'] = 'sqlite:///' + os.environ['DATABASE_PATH']
+os.environ.update(
+    IMAGES_DOSSIER=os.path.join(DOSSIER_TESTS, 'images'),
+    IMAGES_TRAITEMENT_WORKERS='0',
+    ANALYSE_TACHES_WORKERS='0',
+    METRIQUES_DOSSIER='',
+)
+
+import app as module_app  # noqa: E402
+from app import db  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def application():
+    module_app.app.config['TESTING'] = True
+    with module_app.app.app_context():
+        if db.engine.dialect.name == 'postgresql':
+            db.drop_all()
+        module_app.preparer_base()
+    return module_app.app
+
+
+@pytest.fixture
+def contexte(application):
+    """Contexte d'application pour lire ou préparer la base directement"""
+    with application.app_context():
+        yield
+        db.session.remove()
+
+
+@pytest.fixture
+def client(application):
+    return application.test_client()
+
+
+@pytest.fixture
+def suffixe():
+    """Suffixe unique : la base est partagée par les tests, les noms du catalogue ne doivent pas se croiser"""
+    return uuid.uuid4().hex[:8]
+
+
+@pytest.fixture
+def utilisateur(client, suffixe):
+    """Identifiant d'un nouvel utilisateur"""
+    reponse = client.post('/api/utilisateurs', json={'nom': 'Test', 'email': f'test-{suffixe}@exemple.fr'})
+    assert reponse.status_code == 201
+    return reponse.get_json()['id']
+
@@ -0,0 +1,94 @@
+"""Le moteur d'analyse par balayage donne les mêmes patterns que l'ancien calcul aliment par aliment"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import analyseur
+
+# (décalage du repas en heures, aliments, décalage du symptôme après le repas en heures ou None)
+HISTORIQUE = [
+    (0, ['Lait', 'Riz'], 3),
+    (24, ['Riz au lait'], 47),
+    (96, ['Lait', 'Pain'], 49),
+    (168, ['Pain', 'Riz'], 1),
+    (192, ['Lait'], 24),
+    (240, ['Riz'], None),
+    (264, ['Pain au lait', 'Oeuf'], 2),
+    (312, ['Lait', 'Oeuf'], 6),
+]
+
+
+@pytest.fixture
+def historique(client, utilisateur):
+    """Repas et symptômes entrelacés, avec des symptômes aux bornes de la fenêtre de réaction"""
+    debut = datetime(2024, 5, 1, 8)
+    for heures, aliments, reaction in HISTORIQUE:
+        date = debut + timedelta(hours=heures)
+        reponse = client.post('/api/repas', json={
+            'utilisateur_id': utilisateur, 'aliments': [{'nom': nom} for nom in aliments],
+            'date_heure': date.isoformat()
+        })
+        assert reponse.status_code == 201
+        if reaction is not None:
+            reponse = client.post('/api/symptomes', json={
+                'utilisateur_id': utilisateur, 'type_symptome': 'urticaire', 'severite': 3,
+                'date_heure': (date + timedelta(hours=reaction)).isoformat()
+            })
+            assert reponse.status_code == 201
+    return utilisateur
+
+
+def resume(patterns):
+    return {p['aliment']: (p['score_risque'], p['niveau_alerte']) for p in patterns}
+
+
+@pytest.mark.parametrize('backend', ['python', 'numpy'])
+def test_balayage_identique_au_calcul_naif(contexte, historique, backend):
+    if backend == 'numpy':
+        pytest.importorskip('numpy')
+
+    attendu = resume(analyseur._detecter_patterns_naif(historique))
+
+    assert attendu
+    assert resume(analyseur.detecter_patterns(historique, backend)) == attendu
+
+
+def test_table_d_exposition_a_jour(contexte, historique):
+    assert analyseur.verifier_expositions(historique) == {}
+    assert resume(analyseur.patterns_enregistres(historique)) == resume(analyseur.detecter_patterns(historique))
+
+
+def test_commande_comparer_analyse(application, historique):
+    resultat = application.test_cli_runner().invoke(args=['comparer-analyse'])
+
+    assert resultat.exit_code == 0, resultat.output
+    assert '0 utilisateur(s) avec des différences' in resultat.output
+
+
+def test_repas_et_symptomes_simultanes(application, utilisateur):
+    """Repas et symptômes envoyés en parallèle : chaque réaction est comptée une et une seule fois"""
+    debut = datetime(2024, 6, 1, 8)
+
+    def envoyer(indice):
+        client = application.test_client()
+        date = debut + timedelta(hours=12 * indice)
+        if indice % 2:
+            reponse = client.post('/api/symptomes', json={
+                'utilisateur_id': utilisateur, 'type_symptome': 'nausée', 'severite': 2,
+                'date_heure': (date + timedelta(hours=3)).isoformat()
+            })
+        else:
+            reponse = client.post('/api/repas', json={
+                'utilisateur_id': utilisateur, 'aliments': [{'nom': 'Lait'}, {'nom': f'Plat {indice % 3}'}],
+                'date_heure': date.isoformat()
+            })
+        return reponse.status_code
+
+    with ThreadPoolExecutor(max_workers=4) as executeur:
+        assert set(executeur.map(envoyer, range(40))) == {201}
+
+    # Contexte ouvert après les requêtes : sa session ne garde aucune transaction pendant les envois
+    with application.app_context():
+        assert analyseur.verifier_expositions(utilisateur) == {}
+        assert analyseur.patterns_enregistres(utilisateur)
@@ -0,0 +1,43 @@
+"""Configuration invalide : l'application refuse de démarrer au lieu d'échouer à chaque requête"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def importer_app(tmp_path, **variables):
+    env = dict(os.environ, DATABASE_PATH=str(tmp_path / 'config.db'), **variables)
+    env.pop('DATABASE_URL', None)
+    return subprocess.run(
+        [sys.executable, '-c', 'import app'], cwd=RACINE, env=env, capture_output=True, text=True
+    )
+
+
+@pytest.mark.parametrize('variables, message', [
+    ({'ANALYSE_BACKEND': 'fortran'}, 'ANALYSE_BACKEND inconnu : fortran'),
+    ({'DASHBOARD_CACHE_PERIODE': '0'}, 'DASHBOARD_CACHE_PERIODE doit être un nombre de secondes positif'),
+    ({'DASHBOARD_CACHE_PERIODE': '-60'}, 'DASHBOARD_CACHE_PERIODE doit être un nombre de secondes positif'),
+])
+def test_configuration_refusee_au_demarrage(tmp_path, variables, message):
+    resultat = importer_app(tmp_path, **variables)
+
+    assert resultat.returncode != 0
+    assert message in resultat.stderr
+
+
+def test_configuration_par_defaut_acceptee(tmp_path):
+    resultat = importer_app(tmp_path)
+
+    assert resultat.returncode == 0, resultat.stderr
+
+
+def test_init_database_prepare_la_base(contexte):
+    from app import Aliment, MIGRATIONS, init_database, versions_schema_appliquees
+
+    init_database()
+
+    assert versions_schema_appliquees() == {etape.version for etape in MIGRATIONS}
+    assert Aliment.query.count() > 0
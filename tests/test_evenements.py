@@ -0,0 +1,38 @@
+"""Lot d'événements hors ligne rejoué : les clés déjà connues ressortent en doublons"""
+from app import Repas, RepasAliment, Symptome, db
+
+LOT = [
+    {'type': 'repas', 'cle': 'a1', 'date_heure': '2024-03-01T12:00:00',
+     'aliments': [{'nom': 'Pain'}, {'nom': 'Beurre', 'quantite': 10}]},
+    {'type': 'symptome', 'cle': 'a1', 'date_heure': '2024-03-01T14:00:00', 'type_symptome': 'urticaire', 'severite': 2},
+    {'type': 'repas', 'cle': 'a2', 'date_heure': '2024-03-02T12:00:00', 'aliments': {'Lait': 200}},
+    {'type': 'repas', 'cle': 'a2', 'date_heure': '2024-03-02T12:00:00', 'aliments': {'Lait': 200}},  # Renvoyé dans le lot
+    {'type': 'symptome', 'cle': 'a3', 'type_symptome': 'nausée'},
+]
+
+
+def compter(application, utilisateur):
+    with application.app_context():
+        repas = db.session.query(Repas.id).filter(Repas.utilisateur_id == utilisateur)
+        return (
+            repas.count(),
+            Symptome.query.filter_by(utilisateur_id=utilisateur).count(),
+            RepasAliment.query.filter(RepasAliment.repas_id.in_(repas)).count(),
+        )
+
+
+def test_lot_rejoue(application, client, utilisateur):
+    envoyer = lambda: client.post(f'/api/utilisateurs/{utilisateur}/evenements', json={'evenements': LOT})
+
+    premier = envoyer().get_json()
+    apres_premier = compter(application, utilisateur)
+    second = envoyer().get_json()
+
+    assert (premier['crees'], premier['doublons'], premier['erreurs']) == (3, 1, 1)
+    assert [r['statut'] for r in premier['resultats']] == ['cree', 'cree', 'cree', 'doublon', 'erreur']
+    assert apres_premier == (2, 1, 3)
+
+    assert (second['crees'], second['doublons'], second['erreurs']) == (0, 4, 1)
+    assert [r['statut'] for r in second['resultats']] == ['doublon'] * 4 + ['erreur']
+    assert [r.get('id') for r in second['resultats']] == [r.get('id') for r in premier['resultats']]
+    assert compter(application, utilisateur) == apres_premier
@@ -0,0 +1,57 @@
+"""Import du catalogue rejoué : les aliments existants sont mis à jour, jamais dupliqués"""
+import json
+
+from app import Aliment, db
+
+
+def fichier_ndjson(suffixe):
+    lignes = [
+        {'nom': f'Tofu {suffixe}', 'ingredients': ['soja'], 'allergenes_courants': ['soja'], 'calories_pour_100g': 76},
+        {'nom': f'Houmous {suffixe}', 'ingredients': ['pois chiches', 'sésame'], 'allergenes_courants': ['sésame']},
+        {'nom': f'Tofu {suffixe}', 'categorie': 'protéines'},  # Même nom : champs ajoutés au même aliment
+        {'nom': ''},
+        {'nom': f'Seitan {suffixe}', 'allergenes_courants': 'gluten'},
+    ]
+    return '\n'.join(json.dumps(ligne, ensure_ascii=False) for ligne in lignes) + '\n'
+
+
+def aliments_importes(application, suffixe):
+    with application.app_context():
+        return {aliment.nom: (aliment.categorie, aliment.calories_pour_100g, aliment.allergenes_courants)
+                for aliment in Aliment.query.filter(Aliment.nom.endswith(suffixe))}
+
+
+def test_import_rejoue(application, client, suffixe):
+    contenu = fichier_ndjson(suffixe).encode()
+    importer = lambda: client.post('/api/aliments/import?lot=2', data=contenu, content_type='application/x-ndjson')
+
+    premier = importer().get_json()
+    apres_premier = aliments_importes(application, suffixe)
+    second = importer().get_json()
+
+    assert (premier['lignes'], premier['crees'], premier['mis_a_jour'], premier['nb_erreurs']) == (5, 3, 1, 1)
+    assert (second['lignes'], second['crees'], second['mis_a_jour'], second['nb_erreurs']) == (5, 0, 4, 1)
+    assert second['erreurs'] == [{'ligne': 4, 'erreur': 'nom requis'}]
+    assert aliments_importes(application, suffixe) == apres_premier
+    assert apres_premier[f'Tofu {suffixe}'] == ('protéines', 76, '["soja"]')
+    assert len(apres_premier) == 3
+
+
+def test_commande_rejouee(application, suffixe, tmp_path):
+    fichier = tmp_path / 'catalogue.csv'
+    fichier.write_text(
+        'nom,ingredients,allergenes_courants,calories_pour_100g\n'
+        + f'Pesto {suffixe},basilic;pignons,fruits à coque,520\n'
+        + f'Tahini {suffixe},sésame,sésame,595\n',
+        encoding='utf-8'
+    )
+    runner = application.test_cli_runner()
+
+    premier = runner.invoke(args=['importer-aliments', str(fichier)])
+    second = runner.invoke(args=['importer-aliments', str(fichier)])
+
+    assert '2 ligne(s) lue(s) : 2 aliment(s) créé(s), 0 mis à jour, 0 erreur(s)' in premier.output
+    assert '2 ligne(s) lue(s) : 0 aliment(s) créé(s), 2 mis à jour, 0 erreur(s)' in second.output
+    with application.app_context():
+        assert Aliment.query.filter(Aliment.nom.endswith(suffixe)).count() == 2
+        db.session.remove()
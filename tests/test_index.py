@@ -0,0 +1,33 @@
+"""Les requêtes les plus fréquentes utilisent leur index (plans EXPLAIN)"""
+from datetime import datetime, timedelta
+
+from app import db, plan_execution, requetes_critiques
+
+
+def test_requetes_critiques_utilisent_leur_index(client, contexte, utilisateur):
+    debut = datetime(2024, 3, 1, 12)
+    for jour in range(5):
+        date = debut + timedelta(days=jour)
+        client.post('/api/repas', json={
+            'utilisateur_id': utilisateur, 'aliments': [{'nom': 'Pain'}], 'date_heure': date.isoformat()
+        })
+        client.post('/api/symptomes', json={
+            'utilisateur_id': utilisateur, 'type_symptome': 'nausée', 'severite': 2,
+            'date_heure': (date + timedelta(hours=3)).isoformat()
+        })
+
+    echecs = {}
+    for description, query, index_attendu in requetes_critiques():
+        plan = plan_execution(query)
+        if not any(index_attendu in etape for etape in plan):
+            echecs[description] = (index_attendu, plan)
+    db.session.rollback()
+
+    assert echecs == {}
+
+
+def test_commande_verifier_index(application):
+    resultat = application.test_cli_runner().invoke(args=['verifier-index'])
+
+    assert resultat.exit_code == 0, resultat.output
+    assert 'ÉCHEC' not in resultat.output
@@ -0,0 +1,93 @@
+"""Colonnes JSON : TEXT sous SQLite, JSONB sous PostgreSQL (migration 3)"""
+import os
+
+import pytest
+
+from app import db, MigrationSchema, migrer_schema, requete_recherche_aliments
+
+POSTGRESQL = bool(os.environ.get('TEST_DATABASE_URL'))
+
+
+def creer_aliment(client, nom, ingredients, allergenes=()):
+    reponse = client.post('/api/aliments', json={
+        'nom': nom, 'ingredients': ingredients, 'allergenes_courants': list(allergenes)
+    })
+    assert reponse.status_code == 201
+    return reponse.get_json()['id']
+
+
+def test_listes_json_relues_a_l_identique(client, suffixe):
+    ingredients = [f'riz {suffixe}', 'lait « entier »', 'sel']
+    aliment_id = creer_aliment(client, f'Riz au lait {suffixe}', ingredients, ['lactose'])
+
+    aliment = client.get(f'/api/aliments/{aliment_id}').get_json()
+    assert aliment['ingredients'] == ingredients
+    assert aliment['allergenes_courants'] == ['lactose']
+
+
+def test_filtre_sur_un_element_exact(client, suffixe):
+    riz = creer_aliment(client, f'Riz {suffixe}', [f'riz-{suffixe}'], [f'aucun-{suffixe}'])
+    riz_au_lait = creer_aliment(client, f'Riz au lait {suffixe}', [f'riz-{suffixe} rond', 'lait'], [f'lactose-{suffixe}'])
+
+    par_ingredient = client.get(f'/api/aliments?ingredient=riz-{suffixe}').get_json()['aliments']
+    assert [aliment['id'] for aliment in par_ingredient] == [riz]
+    par_allergene = client.get(f'/api/aliments?allergene=lactose-{suffixe}').get_json()['aliments']
+    assert [aliment['id'] for aliment in par_allergene] == [riz_au_lait]
+
+
+def test_filtre_echappe_les_caracteres_speciaux(client, suffixe):
+    creer_aliment(client, f'Pâte {suffixe}', [f'{suffixe}%'])
+
+    assert client.get(f'/api/aliments?ingredient={suffixe}_').get_json()['aliments'] == []
+
+
+@pytest.mark.skipif(not POSTGRESQL, reason='TEST_DATABASE_URL (PostgreSQL) non défini')
+def test_migration_jsonb_convertit_les_anciens_textes(contexte, utilisateur):
+    def executer(sql, **parametres):
+        return db.session.execute(db.text(sql), parametres)
+
+    # Base antérieure à la migration : colonnes TEXT, valeurs vides ou qui ne sont pas du JSON
+    executer('DROP INDEX IF EXISTS ix_aliment_ingredients_gin')
+    executer('DROP INDEX IF EXISTS ix_aliment_allergenes_gin')
+    for table, colonne in (('repas', 'aliments'), ('aliment', 'ingredients'), ('aliment', 'allergenes_courants')):
+        executer(f'ALTER TABLE {table} ALTER COLUMN {colonne} TYPE TEXT USING {colonne}::text')
+    repas = [
+        executer(
+            'INSERT INTO repas (utilisateur_id, date_heure, aliments) VALUES (:u, now(), :a) RETURNING id',
+            u=utilisateur, a=texte
+        ).scalar()
+        for texte in ('', 'pain, beurre', '[{"nom": "riz"}]')
+    ]
+    aliment = executer(
+        "INSERT INTO aliment (nom, ingredients, allergenes_courants) "
+        "VALUES ('Ancien aliment', '', 'lait; oeufs') RETURNING id"
+    ).scalar()
+    MigrationSchema.query.filter_by(version=3).delete()
+    db.session.commit()
+
+    assert [etape.version for etape in migrer_schema()] == [3]
+
+    types = {colonne['name']: colonne['type'] for colonne in db.inspect(db.engine).get_columns('repas')}
+    assert type(types['aliments']).__name__ == 'JSONB'
+    valeurs = dict(executer('SELECT id, aliments FROM repas WHERE id = ANY(:ids)', ids=repas).all())
+    assert [valeurs[repas_id] for repas_id in repas] == [[], 'pain, beurre', [{'nom': 'riz'}]]
+    assert executer(
+        'SELECT ingredients, allergenes_courants FROM aliment WHERE id = :id', id=aliment
+    ).one() == (None, 'lait; oeufs')
+    index = {index['name'] for index in db.inspect(db.engine).get_indexes('aliment')}
+    assert {'ix_aliment_ingredients_gin', 'ix_aliment_allergenes_gin'} <= index
+
+
+def test_recherche_hors_plein_texte(client, contexte, suffixe):
+    riz = creer_aliment(client, f'Riz {suffixe}', ['riz'], [f'aucun-{suffixe}'])
+    riz_au_lait = creer_aliment(client, f'Gâteau {suffixe}', [f'riz-{suffixe}', 'lait'], [f'lactose-{suffixe}'])
+    salade = creer_aliment(client, f'Salade {suffixe}', [f'riz-{suffixe} rond'])
+
+    def ids(terme):
+        return [aliment.id for aliment in requete_recherche_aliments(terme)]
+
+    assert ids(f'riz {suffixe}') == [riz]  # Partie du nom, sans tenir compte de la casse
+    assert ids(f'riz-{suffixe}') == [riz_au_lait]  # Ingrédient égal au terme, pas « riz-... rond »
+    assert ids(f'lactose-{suffixe}') == [riz_au_lait]
+    assert ids(f'salade {suffixe}') == [salade]
+    db.session.rollback()
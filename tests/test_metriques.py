@@ -0,0 +1,57 @@
+"""Métriques HTTP des réponses (y compris en flux) et addition des fichiers des workers"""
+import os
+
+import pytest
+
+import app as module_app
+from app import Metriques
+
+
+@pytest.fixture
+def metriques(monkeypatch):
+    """Compteurs propres au test, à la place de ceux du processus"""
+    metriques = Metriques()
+    monkeypatch.setattr(module_app, 'metriques', metriques)
+    return metriques
+
+
+def series(texte):
+    """Valeur de chaque série d'une exposition au format texte Prometheus"""
+    return dict(ligne.rsplit(' ', 1) for ligne in texte.splitlines() if not ligne.startswith('#'))
+
+
+@pytest.mark.parametrize('chemin, endpoint', [
+    ('/api/utilisateurs/{}', 'obtenir_utilisateur'),
+    ('/api/utilisateurs/{}/export', 'exporter_utilisateur'),  # Réponse NDJSON en flux
+])
+def test_requete_mesuree(client, utilisateur, metriques, chemin, endpoint):
+    reponse = client.get(chemin.format(utilisateur))
+    assert reponse.status_code == 200
+    corps = reponse.get_data()
+    reponse.close()
+
+    valeurs = series(metriques.exposition())
+    labels = f'endpoint="{endpoint}",methode="GET"'
+    assert valeurs[f'http_requetes_total{{{labels},statut="200"}}'] == '1'
+    assert valeurs[f'http_requete_duree_secondes_count{{{labels}}}'] == '1'
+    assert float(valeurs[f'http_requete_duree_secondes_sum{{{labels}}}']) > 0
+    assert valeurs[f'http_reponse_taille_octets_count{{{labels}}}'] == '1'
+    assert valeurs[f'http_reponse_taille_octets_sum{{{labels}}}'] == str(len(corps))
+
+
+def test_exposition_additionne_les_workers(tmp_path):
+    for pid, (requetes, duree) in ((101, (3, 0.02)), (102, (2, 7.0))):
+        worker = Metriques()
+        worker.incrementer('http_requetes_total', requetes, endpoint='index', methode='GET', statut='200')
+        worker.observer('http_requete_duree_secondes', duree, endpoint='index', methode='GET')
+        worker.ecrire(tmp_path)
+        os.replace(tmp_path / f'metriques-{os.getpid()}.json', tmp_path / f'metriques-{pid}.json')
+
+    valeurs = series(Metriques().exposition(tmp_path))
+
+    labels = 'endpoint="index",methode="GET"'
+    assert valeurs[f'http_requetes_total{{{labels},statut="200"}}'] == '5'
+    assert valeurs[f'http_requete_duree_secondes_count{{{labels}}}'] == '2'
+    assert float(valeurs[f'http_requete_duree_secondes_sum{{{labels}}}']) == pytest.approx(7.02)
+    assert valeurs[f'http_requete_duree_secondes_bucket{{{labels},le="0.025"}}'] == '1'
+    assert valeurs[f'http_requete_duree_secondes_bucket{{{labels},le="+Inf"}}'] == '2'
@@ -0,0 +1,62 @@
+"""Les routes de liste et de métadonnées ne lisent jamais les données des images"""
+import base64
+import io
+
+import pytest
+from PIL import Image as PILImage
+
+from app import controler_projections, routes_projections_images
+
+
+@pytest.fixture
+def image_liee(client, utilisateur):
+    """Image liée à l'utilisateur, à l'un de ses repas et à l'un de ses symptômes"""
+    repas = client.post('/api/repas', json={'utilisateur_id': utilisateur, 'aliments': [{'nom': 'Pain'}]})
+    symptome = client.post('/api/symptomes', json={
+        'utilisateur_id': utilisateur, 'type_symptome': 'urticaire', 'severite': 3
+    })
+    tampon = io.BytesIO()
+    PILImage.new('RGB', (64, 48), 'red').save(tampon, 'PNG')
+    image = client.post('/api/images', json={
+        'nom_fichier': 'repas.png',
+        'type_mime': 'image/png',
+        'donnees_base64': base64.b64encode(tampon.getvalue()).decode(),
+        'utilisateur_id': utilisateur,
+        'repas_id': repas.get_json()['id'],
+        'symptome_id': symptome.get_json()['id'],
+    })
+    assert image.status_code == 201
+    return image.get_json()
+
+
+def routes(image):
+    return [
+        f"/api/images/{image['id']}",
+        f"/api/images/utilisateur/{image['utilisateur_id']}",
+        f"/api/images/repas/{image['repas_id']}",
+        f"/api/images/symptome/{image['symptome_id']}",
+        f"/api/repas/{image['utilisateur_id']}",
+        f"/api/symptomes/{image['utilisateur_id']}",
+        f"/api/dashboard/{image['utilisateur_id']}",
+        f"/api/utilisateurs/{image['utilisateur_id']}/export?images=true",
+    ]
+
+
+def test_routes_de_metadonnees_sans_donnees_blob(contexte, image_liee):
+    resultats = controler_projections(routes(image_liee))
+
+    for route, statut, requetes, fautives in resultats:
+        assert statut == 200, route
+        assert requetes, route
+        assert fautives == [], route
+
+
+def test_controle_detecte_une_lecture_des_donnees(contexte, image_liee):
+    [(_, statut, _, fautives)] = controler_projections([f"/api/images/{image_liee['id']}/blob"])
+
+    assert statut == 200
+    assert fautives
+
+
+def test_routes_choisies_sur_des_images_liees(contexte, image_liee):
+    assert routes_projections_images() is not None
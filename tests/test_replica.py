@@ -0,0 +1,81 @@
+"""Routage des lectures : réplique, repli sur la base principale et rejeu après une panne"""
+import time
+
+import pytest
+from flask import g
+from sqlalchemy.exc import OperationalError
+
+from app import Aliment, db, routage_lecture
+
+
+@pytest.fixture
+def replique(application, monkeypatch):
+    """Réplique à jour (la base de test elle-même), sans fenêtre collante ; état du routage remis à zéro"""
+    monkeypatch.setitem(application.config, 'REPLICA_FENETRE_COLLANTE', 0)
+    routage_lecture.indisponible_jusqua = routage_lecture.prochaine_verification = 0
+    with application.app_context():
+        yield db.engines['replica']
+    routage_lecture.indisponible_jusqua = routage_lecture.prochaine_verification = 0
+
+
+@pytest.fixture
+def repas(client, utilisateur):
+    reponse = client.post('/api/repas', json={'utilisateur_id': utilisateur, 'aliments': [{'nom': 'Pain'}]})
+    assert reponse.status_code == 201
+    return utilisateur
+
+
+def test_lecture_sur_la_replique(client, replique, repas):
+    reponse = client.get(f'/api/repas/{repas}')
+
+    assert reponse.status_code == 200
+    assert reponse.headers['X-Base-Lecture'] == 'replica'
+
+
+def test_base_principale_apres_une_ecriture(client, replique, repas, application, monkeypatch):
+    monkeypatch.setitem(application.config, 'REPLICA_FENETRE_COLLANTE', 60)
+
+    assert client.get(f'/api/repas/{repas}').headers['X-Base-Lecture'] == 'collant'
+
+
+def panne(connexion, curseur, instruction, parametres, contexte, executemany):
+    """Erreur du pilote, comme une connexion perdue, sur la lecture des repas"""
+    if 'FROM repas' in instruction:
+        raise connexion.dialect.dbapi.OperationalError('connexion perdue')
+
+
+def test_panne_de_la_replique_rejoue_la_route(client, replique, repas):
+    db.event.listen(replique, 'before_cursor_execute', panne)
+    try:
+        reponse = client.get(f'/api/repas/{repas}')
+    finally:
+        db.event.remove(replique, 'before_cursor_execute', panne)
+
+    assert reponse.status_code == 200
+    assert reponse.headers['X-Base-Lecture'] == 'indisponible'
+    assert len(reponse.get_json()['repas']) == 1
+    assert routage_lecture.indisponible_jusqua > time.monotonic()
+
+
+def test_erreur_de_la_base_principale_non_rejouee(client, replique, repas, application, monkeypatch):
+    monkeypatch.setitem(application.config, 'REPLICA_FENETRE_COLLANTE', 60)  # Lecture sur la base principale
+    db.event.listen(db.engine, 'before_cursor_execute', panne)
+    try:
+        with pytest.raises(OperationalError):
+            client.get(f'/api/repas/{repas}')
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', panne)
+
+    assert routage_lecture.indisponible_jusqua == 0
+
+
+def test_sql_textuel_lu_sur_la_base_principale(application, replique):
+    with application.test_request_context():
+        g.lecture_replica = True
+        assert db.session.get_bind(clause=db.select(Aliment.id)) is replique
+        assert db.session.get_bind(clause=db.text('SELECT 1').execution_options(lecture_replica=True)) is replique
+        assert g.lecture_replica
+
+        assert db.session.get_bind(clause=db.text('SELECT rowid FROM aliment_recherche')) is db.engine
+        assert not g.lecture_replica
+        assert db.session.get_bind(clause=db.select(Aliment.id)) is db.engine
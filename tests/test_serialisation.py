@@ -0,0 +1,74 @@
+"""Les deux encodeurs de réponses (json, orjson) produisent le même contenu pour les sérialiseurs"""
+import json
+from types import SimpleNamespace
+
+import pytest
+from flask.json.provider import DefaultJSONProvider
+
+import app as module_app
+from app import Aliment, Image, Repas, Symptome, Utilisateur, db
+
+orjson = pytest.importorskip('orjson')
+
+
+@pytest.fixture
+def donnees(client, utilisateur, suffixe):
+    """Un objet de chaque modèle sérialisé, avec des textes non ASCII et des valeurs nulles"""
+    aliment = client.post('/api/aliments', json={
+        'nom': f'Crème brûlée {suffixe}', 'ingredients': ['œufs', 'crème'], 'allergenes_courants': ['lait'],
+        'calories_pour_100g': 287.5, 'categorie': 'dessert',
+    })
+    assert aliment.status_code == 201
+    repas = client.post('/api/repas', json={
+        'utilisateur_id': utilisateur, 'description': 'Dîner « léger »', 'aliments': [{'nom': 'Crème brûlée'}]
+    })
+    symptome = client.post('/api/symptomes', json={
+        'utilisateur_id': utilisateur, 'type_symptome': 'démangeaisons', 'severite': 2
+    })
+    image = client.post('/api/images', json={
+        'nom_fichier': 'été.png', 'type_mime': 'image/png', 'utilisateur_id': utilisateur,
+        'donnees_base64': 'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4z8AAAAMBAQDJ/pLvAAAAAElFTkSuQmCC',
+    })
+    assert image.status_code == 201
+    return {
+        'aliment': aliment.get_json()['id'], 'repas': repas.get_json()['id'],
+        'symptome': symptome.get_json()['id'], 'image': image.get_json()['id'], 'utilisateur': utilisateur,
+    }
+
+
+def sorties_des_serialiseurs(donnees):
+    repas = db.session.get(Repas, donnees['repas'], options=[db.undefer(Repas.nb_images)])
+    symptome = db.session.get(Symptome, donnees['symptome'], options=[db.undefer(Symptome.nb_images)])
+    objets = {
+        'UTILISATEUR': db.session.get(Utilisateur, donnees['utilisateur']),
+        'UTILISATEUR_RESUME': db.session.get(Utilisateur, donnees['utilisateur']),
+        'ALIMENT': db.session.get(Aliment, donnees['aliment']),
+        'RECHERCHE_ALIMENT': db.session.get(Aliment, donnees['aliment']),
+        'REPAS': repas,
+        'REPAS_LISTE': repas,
+        'SYMPTOME': symptome,
+        'SYMPTOME_LISTE': symptome,
+        'IMAGE': db.session.get(Image, donnees['image']),
+        'IMAGE_METADONNEES': db.session.get(Image, donnees['image']),
+        'IMAGE_UTILISATEUR': db.session.get(Image, donnees['image']),
+        'IMAGE_BASE64': db.session.get(Image, donnees['image']),
+        # Ligne de projection, comme dans obtenir_planning_semaine
+        'REPAS_PLANIFIE': SimpleNamespace(id=1, aliments='["pâtes", "crème"]', calories_estimees=None, notes='À midi'),
+    }
+    noms = {nom[len('SERIALISEUR_'):] for nom in vars(module_app) if nom.startswith('SERIALISEUR_')}
+    assert noms == set(objets)  # Un nouveau sérialiseur doit être ajouté ici
+    for nom, objet in objets.items():
+        serialiseur = getattr(module_app, f'SERIALISEUR_{nom}')
+        yield nom, serialiseur(objet)
+        yield f'{nom}.liste', serialiseur.liste([objet])
+
+
+def test_memes_reponses_avec_json_et_orjson(application, donnees):
+    defaut, rapide = DefaultJSONProvider(application), module_app.FournisseurJsonOrjson(application)
+    with application.app_context():
+        sorties = list(sorties_des_serialiseurs(donnees))
+        for nom, sortie in sorties:
+            assert json.loads(rapide.dumps(sortie)) == json.loads(defaut.dumps(sortie)), nom
+            with application.test_request_context():
+                assert rapide.response(sortie).get_json() == defaut.response(sortie).get_json(), nom
+        db.session.remove()
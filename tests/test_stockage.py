@@ -0,0 +1,84 @@
+"""Stockage des images en fichiers : fichiers partagés par empreinte entre images et dérivées"""
+import base64
+import io
+import os
+import sqlite3
+
+import pytest
+from PIL import Image as PILImage
+
+from app import DeriveeImage, Image, StockageFichiers, db, verrouiller_ecritures
+
+
+@pytest.fixture
+def fichiers(application, monkeypatch):
+    monkeypatch.setitem(application.config, 'IMAGES_STOCKAGE', 'fichiers')
+    return StockageFichiers(application.config['IMAGES_DOSSIER'])
+
+
+def lire(application, modele, **filtres):
+    """Ligne lue dans son propre contexte : une requête du client lancée sous un contexte ouvert
+    partagerait sa session (et sa transaction) avec le test"""
+    with application.app_context():
+        objet = modele.query.filter_by(**filtres).one()
+        db.session.expunge(objet)
+        return objet
+
+
+def televerser(client, donnees, nom='repas.png'):
+    reponse = client.post('/api/images', json={
+        'nom_fichier': nom, 'type_mime': 'image/png', 'donnees_base64': base64.b64encode(donnees).decode()
+    })
+    assert reponse.status_code == 201
+    return reponse.get_json()['id']
+
+
+def png(largeur, hauteur, couleur):
+    tampon = io.BytesIO()
+    PILImage.new('RGB', (largeur, hauteur), couleur).save(tampon, 'PNG')
+    return tampon.getvalue()
+
+
+def test_fichier_partage_entre_image_et_derivee(application, client, fichiers):
+    originale = televerser(client, png(1200, 900, 'green'))
+    miniature = client.get(f'/api/images/{originale}/blob?variant=thumb')
+    assert miniature.status_code == 200
+    copie = televerser(client, miniature.data, 'miniature.png')
+    derivee = lire(application, DeriveeImage, image_id=originale, variante='thumb')
+    assert lire(application, Image, id=copie).empreinte == derivee.empreinte
+
+    assert client.delete(f'/api/images/{copie}').status_code == 200
+    assert client.get(f'/api/images/{originale}/blob?variant=thumb').data == miniature.data
+
+    assert client.delete(f'/api/images/{originale}').status_code == 200
+    assert not os.path.exists(fichiers.chemin_empreinte(derivee.empreinte))
+
+
+def test_fichier_absent(application, client, fichiers):
+    image_id = televerser(client, png(40, 30, 'blue'))
+    os.remove(fichiers.chemin(lire(application, Image, id=image_id)))
+
+    reponse = client.get(f'/api/images/{image_id}/blob')
+    assert reponse.status_code == 410
+    assert client.get(f'/api/images/{image_id}/base64').status_code == 410
+    assert client.delete(f'/api/images/{image_id}').status_code == 200
+
+
+@pytest.mark.skipif(os.environ.get('TEST_DATABASE_URL') is not None, reason='verrou propre à SQLite')
+def test_verrou_d_ecriture_sqlite(application):
+    with application.app_context():
+        verrouiller_ecritures()
+        autre = sqlite3.connect(db.engine.url.database, timeout=0)
+        try:
+            with pytest.raises(sqlite3.OperationalError, match='locked'):
+                autre.execute('BEGIN IMMEDIATE')
+            db.session.rollback()
+            autre.execute('BEGIN IMMEDIATE')
+            autre.rollback()
+        finally:
+            autre.close()
+
+        db.session.get(Image, 1)  # Transaction ouverte en lecture
+        with pytest.raises(RuntimeError):
+            verrouiller_ecritures()
+        db.session.rollback()
@@ -0,0 +1,20 @@
+"""Index de suggestions : les écritures publient de nouveaux tableaux au lieu de modifier ceux en lecture"""
+from types import SimpleNamespace
+
+from app import IndexSuggestions
+
+
+def test_appliquer_ne_modifie_pas_les_tableaux_publies():
+    index = IndexSuggestions()
+    index.construire([(1, 'Bœuf haché'), (2, 'Riz au lait')])
+    index.version = 1
+    noms, alias = index._noms, index._alias
+    copies = [list(tableau) for tableau in noms + alias]
+
+    index.appliquer(2, SimpleNamespace(id=3, nom='Riz basmati'))
+    index.appliquer(3, SimpleNamespace(id=1, nom='Bœuf haché'), supprime=True)
+
+    assert [list(tableau) for tableau in noms + alias] == copies
+    assert index.suggerer('riz') == [(2, 'Riz au lait'), (3, 'Riz basmati')]
+    assert index.suggerer('hache') == []
+    assert index.version == 3
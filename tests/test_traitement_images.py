@@ -0,0 +1,55 @@
+"""Traitement des images dans le pool de processus : délai dépassé et recyclage du processus bloqué"""
+import base64
+import io
+import time
+
+import pytest
+from PIL import Image as PILImage
+
+import app as module_app
+
+
+def traitement_bloque(donnees, nom_fichier):
+    """Remplace le décodage dans le processus de traitement : ne rend jamais la main à temps"""
+    time.sleep(120)
+
+
+@pytest.fixture
+def pool(application, monkeypatch):
+    """Pool propre au test, avec un seul processus de traitement"""
+    pool = module_app.PoolTraitementImages()
+    monkeypatch.setattr(module_app, 'pool_images', pool)
+    monkeypatch.setitem(application.config, 'IMAGES_TRAITEMENT_WORKERS', 1)
+    yield pool
+    if pool._executeur is not None:
+        pool._executeur.shutdown(cancel_futures=True)
+
+
+def televerser(client):
+    tampon = io.BytesIO()
+    PILImage.new('RGB', (40, 30), 'red').save(tampon, 'PNG')
+    return client.post('/api/images', json={
+        'nom_fichier': 'repas.png', 'type_mime': 'image/png',
+        'donnees_base64': base64.b64encode(tampon.getvalue()).decode()
+    })
+
+
+def test_delai_depasse_recycle_le_processus(application, client, pool, monkeypatch):
+    assert televerser(client).status_code == 201  # Processus démarré : la suite le trouve libre
+    processus = list(pool._executeur._processes.values())
+
+    traitement = module_app.traiter_donnees_image
+    monkeypatch.setattr(module_app, 'traiter_donnees_image', traitement_bloque)
+    monkeypatch.setitem(application.config, 'IMAGES_TRAITEMENT_DELAI', 1)
+    reponse = televerser(client)
+    assert reponse.status_code == 504
+
+    limite = time.monotonic() + 10
+    while pool.statistiques()['en_cours'] and time.monotonic() < limite:
+        time.sleep(0.05)
+    assert pool.statistiques()['en_cours'] == 0
+    assert not any(p.is_alive() for p in processus)
+    assert pool.statistiques()['expirees'] == 1
+
+    monkeypatch.setattr(module_app, 'traiter_donnees_image', traitement)
+    assert televerser(client).status_code == 201